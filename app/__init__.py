@@ -5,6 +5,7 @@ import os
 from flask import Flask
 from redis import Redis
 from celery import Celery, Task
+from kombu import Queue
 from config import config # 导入应用配置
 
 # 全局变量，存储 Celery 和 Redis 实例
@@ -41,6 +42,21 @@ def create_app(config_name=None) -> Flask:
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
 
+    # 预加载分词词典：Celery prefork 模式下在 fork 之前完成，子进程共享已加载的词典
+    if app.config.get('TOKENIZER_PRELOAD', True):
+        try:
+            from modules.tokenizer_module import TokenizerModule
+            TokenizerModule.initialize(app)
+        except Exception as e:
+            print(f"预加载分词词典失败 (将在首次分词时加载): {e}")
+
+    # 模板快速回复的意图关键词注册到共享词表 (在处理请求前完成，避免运行中重建自动机)
+    try:
+        from modules.template_responder_module import TemplateResponderModule
+        TemplateResponderModule.register_intents(app)
+    except Exception as e:
+        print(f"注册模板回复意图失败: {e}")
+
     # 初始化 Redis
     try:
         redis_client = Redis.from_url(app.config['REDIS_URL'], decode_responses=True)
@@ -54,10 +70,22 @@ def create_app(config_name=None) -> Flask:
 
     # 初始化 Celery
     try:
+        queues = {lane: app.config[f"CELERY_QUEUE_{lane.upper()}"] for lane in ("interactive", "summary", "maintenance")}
         app.config.update(CELERY=dict(
             broker_url=app.config["CELERY_BROKER_URL"],
             result_backend=app.config["CELERY_RESULT_BACKEND"],
-            broker_connection_retry_on_startup=app.config.get("CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP", True)
+            broker_connection_retry_on_startup=app.config.get("CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP", True),
+            # 未指定 -Q 的 Worker 消费全部队列，且按此顺序优先取对话轮次
+            task_queues=[Queue(name, routing_key=name) for name in queues.values()],
+            task_default_queue=queues["interactive"],
+            task_routes={
+                "app.tasks.process_dialogue_task": {"queue": queues["interactive"]},
+                "app.tasks.record_crisis_turn_task": {"queue": queues["interactive"]},
+                "app.tasks.generate_summary_task": {"queue": queues["summary"]},
+                "app.tasks.compact_history_task": {"queue": queues["maintenance"]},
+            },
+            broker_transport_options={"priority_steps": list(range(10)), "sep": ":", "queue_order_strategy": "priority"},
+            worker_prefetch_multiplier=app.config.get("CELERY_WORKER_PREFETCH_MULTIPLIER", 1),
         ))
         celery_app = celery_init_app(app)
         app.celery = celery_app
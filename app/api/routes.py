@@ -1,12 +1,18 @@
 # D:\python_code\LocalAgent\app\api\routes.py
 # 文件作用：定义 API 相关的路由 (使用修正后的蓝图变量 api_v1)
 
-from flask import request, jsonify, session, current_app
+from flask import request, jsonify, session, current_app, Response, stream_with_context
 # !! 修改：导入修正后的蓝图变量名 api_v1 !!
 from . import api_v1
 from app.utils import get_current_llm_config, get_api_key_status
 from app.modules.context_manager_module import ContextManagerModule
-from app.tasks import generate_summary_task, get_task_result
+from app.tasks import generate_summary_task, get_task_result, queue_options
+from modules.stream_relay_module import StreamRelayModule
+from modules.llm_cache_module import LLMCacheModule
+from modules.endpoint_pool_module import EndpointPoolModule
+from modules.tokenizer_module import TokenizerModule
+from modules.template_responder_module import TemplateResponderModule
+from modules.generation_policy_module import GenerationPolicyModule
 from redis import exceptions as redis_exceptions
 import uuid
 
@@ -101,7 +107,7 @@ def api_summarize_chat():
         if not ContextManagerModule.get_history(sid):
             return jsonify(ok=False, error="对话历史为空，无法总结"), 400
 
-        task = generate_summary_task.delay(session_id=sid)
+        task = generate_summary_task.apply_async(kwargs=dict(session_id=sid), **queue_options("summary"))
         print(f"[API] 已启动总结任务: {task.id} for session {sid}")
         return jsonify(ok=True, task_id=task.id, msg="总结任务已启动"), 202
     except redis_exceptions.ConnectionError as e:
@@ -146,6 +152,26 @@ def api_get_task_result(task_id):
         print(f"[API] 查询任务 {task_id} 结果时出错: {e}")
         return jsonify(ok=False, error=f"查询任务结果出错: {e}"), 500
 
+# --- 流式获取任务输出 API (SSE) ---
+@api_v1.route('/stream_task/<task_id>', methods=['GET'])
+def api_stream_task(task_id):
+    redis_available = hasattr(current_app, 'redis_client') and current_app.redis_client is not None
+    if not redis_available: return jsonify(ok=False, error="服务不可用，无法流式输出"), 503
+
+    # 断线重连时浏览器会带上 Last-Event-ID，从该位置继续读取
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id') or "0-0"
+
+    def event_stream():
+        try:
+            for event_id, event, data in StreamRelayModule.iter_events(task_id, last_id=last_id):
+                yield StreamRelayModule.format_sse(event, data, event_id)
+        except redis_exceptions.ConnectionError as e:
+            print(f"[API] 流式读取任务 {task_id} 时 Redis 连接失败: {e}")
+            yield StreamRelayModule.format_sse("error", '{"message": "会话存储服务连接失败"}')
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # 禁止代理缓冲
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream', headers=headers)
+
 # --- 上传 TXT 文件 API ---
 # !! 修改：使用 @api_v1.route 装饰器 !!
 @api_v1.route('/upload_txt', methods=['POST'])
@@ -191,4 +217,15 @@ def api_get_key_status_endpoint():
         return jsonify(ok=True, status=status)
     except Exception as e:
         print(f"获取 API Key 状态失败: {e}")
-        return jsonify(ok=False, error="获取状态失败"), 500
\ No newline at end of file
+        return jsonify(ok=False, error="获取状态失败"), 500
+
+# --- 获取 LLM 缓存命中统计 API ---
+@api_v1.route('/cache_stats', methods=['GET'])
+def api_cache_stats():
+    try:
+        return jsonify(ok=True, stats=LLMCacheModule.get_stats(), endpoints=EndpointPoolModule.get_status("Local"),
+                       tokenizer=TokenizerModule.get_stats(), templates=TemplateResponderModule.get_stats(),
+                       generation_policies=GenerationPolicyModule.get_stats())
+    except Exception as e:
+        print(f"获取缓存统计失败: {e}")
+        return jsonify(ok=False, error="获取统计失败"), 500
@@ -8,7 +8,8 @@ import json
 from . import main
 from app.modules.context_manager_module import ContextManagerModule # Use absolute import
 from app.utils import get_current_llm_config, get_api_key_status  # Use absolute import
-from app.tasks import process_dialogue_task                      # Use absolute import
+from app.tasks import process_dialogue_task, queue_options, record_crisis_turn # Use absolute import
+from modules.dialogue_pipeline import DialoguePipeline
 from redis import exceptions as redis_exceptions
 
 @main.route('/', methods=['GET', 'POST'])
@@ -50,31 +51,48 @@ def index_page():
                 error_message = "请输入内容。"
                 success = False
             else:
-                try:
-                    ContextManagerModule.add_message(session_id, "user", user_input)
-                except redis_exceptions.ConnectionError as e:
-                     print(f"添加用户消息时 Redis 连接失败: {e}")
-                     flash("会话存储服务连接失败，请稍后重试。", "error")
-                     success = False
-                     error_message = "服务连接失败"
-                except Exception as e:
-                    print(f"添加用户消息到 Redis 失败: {e}")
-                    flash("无法保存您的消息，请稍后重试。", "error")
-                    error_message = "消息保存失败"
+                # 前端请求流式回复时，入队后立即返回任务ID，由 SSE 接口推送 token
+                stream_mode = request.form.get('stream') == '1' and current_app.config.get('LLM_STREAM_ENABLED', True)
+                # 危机消息在入队前同步识别并立即回复，响应时间不受任务队列积压影响；状态写入会话，历史由后台任务记录
+                crisis_result = DialoguePipeline.screen_crisis(user_input, session_id)
+                if crisis_result:
+                    record_crisis_turn(session_id, user_input, crisis_result["response"])
+                    if stream_mode: return jsonify(ok=True, result=crisis_result)
                     success = False
+                    final_response = crisis_result["response"]
+                    state_dict = crisis_result["state"]
+                    outputs = crisis_result["outputs"]
+                else:
+                    try:
+                        ContextManagerModule.add_message(session_id, "user", user_input)
+                    except redis_exceptions.ConnectionError as e:
+                         print(f"添加用户消息时 Redis 连接失败: {e}")
+                         flash("会话存储服务连接失败，请稍后重试。", "error")
+                         success = False
+                         error_message = "服务连接失败"
+                    except Exception as e:
+                        print(f"添加用户消息到 Redis 失败: {e}")
+                        flash("无法保存您的消息，请稍后重试。", "error")
+                        error_message = "消息保存失败"
+                        success = False
 
                 if success:
                     celery_available = hasattr(current_app, 'celery') and current_app.celery is not None
                     if celery_available:
                         try:
-                            task = process_dialogue_task.delay(
+                            # 对话轮次总是提交到快速通道，不排在总结/压缩任务之后
+                            task = process_dialogue_task.apply_async(kwargs=dict(
                                 session_id=session_id,
                                 user_input=user_input,
                                 selected_provider=current_provider,
                                 selected_model=current_model,
-                                session_api_keys=temp_keys
-                            )
+                                session_api_keys=temp_keys,
+                                stream=stream_mode
+                            ), **queue_options("interactive"))
                             print(f"启动Celery任务: {task.id}")
+                            if stream_mode:
+                                return jsonify(ok=True, task_id=task.id,
+                                               stream_url=url_for('api_v1.api_stream_task', task_id=task.id)), 202
 
                             try:
                                 llm_timeout_config = current_app.config.get('LLM_REQUEST_TIMEOUT', 120)
@@ -114,7 +132,7 @@ def index_page():
     conversation_history = []
     if redis_available:
         try:
-            conversation_history = ContextManagerModule.get_history(session_id)
+            conversation_history = ContextManagerModule.get_full_history(session_id) # 含已折叠进摘要的旧消息
         except redis_exceptions.ConnectionError as e:
              print(f"获取历史时 Redis 连接失败: {e}")
              flash("会话存储服务连接失败，无法加载历史记录。", "error")
@@ -1,8 +1,10 @@
 # ./app/modules/context_manager_module.py
 # 文件路径: ./app/modules/context_manager_module.py
 import json
+import time
 from flask import current_app # 导入current_app
 from redis import exceptions as redis_exceptions # 导入Redis异常
+from modules.token_counter_module import TokenCounterModule # token估算
 
 class ContextManagerModule:
     # Redis上下文管理模块
@@ -19,13 +21,23 @@ class ContextManagerModule:
         # 生成会话历史Redis Key
         return f"history:{session_id}"
 
+    @classmethod
+    def _get_summary_key(cls, session_id: str) -> str:
+        # 滚动摘要Key (Hash: summary / covered / updated_at)，与历史Key相邻
+        return f"history_summary:{session_id}"
+
+    @classmethod
+    def _get_archive_key(cls, session_id: str) -> str:
+        # 已折叠进摘要的原始消息 (仅用于页面展示与完整总结)
+        return f"history_archive:{session_id}"
+
     @classmethod
     def add_message(cls, session_id: str, role: str, content: str):
-        # Redis添加消息并截断
+        # Redis添加消息 (附带各模型家族的token数)，仅按存储上限截断；发送给模型的历史由 ContextWindowModule 按token预算选取
         redis = cls._get_redis_client() # 获取客户端
         history_key = cls._get_history_key(session_id) # 生成Key
-        max_messages = current_app.config.get('MAX_CONVERSATION_HISTORY_TURNS', 10) * 2
-        message_item = json.dumps({"role": role, "content": content}, ensure_ascii=False)
+        max_messages = current_app.config.get('CONTEXT_STORE_MAX_MESSAGES', 200)
+        message_item = json.dumps({"role": role, "content": content, "tokens": TokenCounterModule.count_all(content)}, ensure_ascii=False)
 
         try:
             pipe = redis.pipeline()
@@ -55,13 +67,71 @@ class ContextManagerModule:
             print(f"[错误][Redis] 获取会话 {session_id} 历史失败: {e}")
             return [] # 其他错误返回空列表
 
+    @classmethod
+    def get_full_history(cls, session_id: str) -> list:
+        # 已折叠的旧消息 + 当前历史 (页面展示、完整总结使用)
+        redis = cls._get_redis_client() # 获取客户端
+        try:
+            archived = [json.loads(item) for item in redis.lrange(cls._get_archive_key(session_id), 0, -1)]
+        except redis_exceptions.ConnectionError:
+            raise
+        except Exception as e:
+            print(f"[错误][Redis] 获取会话 {session_id} 归档历史失败: {e}")
+            archived = []
+        return archived + cls.get_history(session_id)
+
+    @classmethod
+    def get_history_length(cls, session_id: str) -> int:
+        # 当前历史消息条数
+        return cls._get_redis_client().llen(cls._get_history_key(session_id))
+
+    @classmethod
+    def get_summary(cls, session_id: str) -> dict | None:
+        # 读取滚动摘要 {"summary", "covered", "updated_at"}，不存在返回 None
+        redis = cls._get_redis_client() # 获取客户端
+        try:
+            data = redis.hgetall(cls._get_summary_key(session_id))
+        except redis_exceptions.ConnectionError:
+            raise
+        except Exception as e:
+            print(f"[错误][Redis] 获取会话 {session_id} 摘要失败: {e}")
+            return None
+        if not data or not data.get("summary"): return None
+        return {"summary": data["summary"], "covered": int(data.get("covered", 0)), "updated_at": int(data.get("updated_at", 0))}
+
+    @classmethod
+    def fold_into_summary(cls, session_id: str, block: list, summary: str) -> bool:
+        # 原子地把历史开头的 block 替换为新摘要：开头仍是这些消息时才截断 (期间被清空或改写则放弃)
+        redis = cls._get_redis_client() # 获取客户端
+        history_key = cls._get_history_key(session_id) # 生成Key
+        summary_key = cls._get_summary_key(session_id)
+        archive_key = cls._get_archive_key(session_id)
+        max_archive = current_app.config.get('CONTEXT_STORE_MAX_MESSAGES', 200)
+        if not block: return False
+        with redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(history_key, summary_key)
+                    head = [json.loads(item) for item in pipe.lrange(history_key, 0, len(block) - 1)]
+                    if head != block: return False
+                    covered = int(pipe.hget(summary_key, "covered") or 0)
+                    pipe.multi()
+                    pipe.ltrim(history_key, len(block), -1)
+                    pipe.hset(summary_key, mapping={"summary": summary, "covered": covered + len(block), "updated_at": int(time.time())})
+                    pipe.rpush(archive_key, *[json.dumps(m, ensure_ascii=False) for m in block])
+                    pipe.ltrim(archive_key, -max_archive, -1)
+                    pipe.execute()
+                    return True
+                except redis_exceptions.WatchError:
+                    continue # 期间有新消息追加，重新校验
+
     @classmethod
     def clear_history(cls, session_id: str):
-        # Redis删除指定会话历史
+        # Redis删除指定会话历史 (含滚动摘要与归档)
         redis = cls._get_redis_client() # 获取客户端
         history_key = cls._get_history_key(session_id) # 生成Key
         try:
-            redis.delete(history_key) # DEL: 直接删除Key
+            redis.delete(history_key, cls._get_summary_key(session_id), cls._get_archive_key(session_id)) # DEL: 直接删除Key
         except redis_exceptions.ConnectionError as conn_err:
              print(f"[错误][Redis] 清空历史时连接失败: {conn_err}")
              raise # 重新抛出连接错误
@@ -4,8 +4,9 @@
 from celery import shared_task # 导入共享任务装饰器
 from flask import current_app # 导入 Flask 当前应用代理
 from modules.dialogue_pipeline import DialoguePipeline # 导入对话处理模块
-from modules.context_manager_module import ContextManagerModule # 导入上下文管理模块
+from app.modules.context_manager_module import ContextManagerModule # 导入上下文管理模块 (Redis)
 from modules.summary_module import SummaryModule # 导入总结模块
+from modules.stream_relay_module import StreamRelayModule # 导入流式中继模块
 # !! 移除: from app import celery_app as current_celery_app !!
 from celery.result import AsyncResult # 导入获取异步结果的类
 from redis import exceptions as redis_exceptions # 导入 Redis 异常
@@ -17,12 +18,15 @@ import traceback # 用于打印错误堆栈
 @shared_task(bind=True, ignore_result=False)
 def process_dialogue_task(self, session_id: str, user_input: str,
                           selected_provider: str | None, selected_model: str | None,
-                          session_api_keys: dict | None = None):
-    """Celery 任务：处理单轮用户对话"""
+                          session_api_keys: dict | None = None,
+                          stream: bool = False):
+    """Celery 任务：处理单轮用户对话 (stream=True 时经 Redis Stream 实时中继 token)"""
     # 打印任务开始日志，包含任务 ID
     print(f"[任务 {self.request.id}] 开始处理会话 {session_id} 的用户输入...")
     # 获取临时的 API Keys
     temp_keys = session_api_keys or {}
+    # 流式模式下的 token 回调
+    on_token = StreamRelayModule.make_token_callback(self.request.id) if stream else None
     try:
         # 调用对话处理流水线
         result = DialoguePipeline.process_input(
@@ -30,7 +34,8 @@ def process_dialogue_task(self, session_id: str, user_input: str,
             selected_provider=selected_provider,
             selected_model=selected_model,
             session_id=session_id,
-            temp_keys=temp_keys # 传递临时 Key
+            temp_keys=temp_keys, # 传递临时 Key
+            on_token=on_token # 传递流式回调
         )
 
         # 如果处理成功且有回复内容
@@ -42,6 +47,8 @@ def process_dialogue_task(self, session_id: str, user_input: str,
                 try:
                     # 将助手的回复添加到 Redis 历史记录
                     ContextManagerModule.add_message(session_id, "assistant", response_plain)
+                    # 历史过长时排入低优先级压缩任务 (不影响本轮回复)
+                    schedule_compaction(session_id)
                 except redis_exceptions.ConnectionError as redis_err:
                     # 处理 Redis 连接错误
                     print(f"[任务 {self.request.id} 错误] 保存助手回复时 Redis 连接失败: {redis_err}")
@@ -54,19 +61,23 @@ def process_dialogue_task(self, session_id: str, user_input: str,
                     result["success"] = False
                     result["message"] = "生成回复成功，但保存会话时发生内部错误。"
 
+        # 流式模式下推送最终结果 (优化后的回复、状态与分析输出)
+        if stream: StreamRelayModule.publish(self.request.id, "done", result)
         # 返回处理结果 (包含 success, response, state, outputs 等)
         return result
 
     except redis_exceptions.ConnectionError as e:
         # 处理任务执行过程中的 Redis 连接错误
         print(f"[任务 {self.request.id}] 处理对话时 Redis 连接错误: {e}")
-        return {"success": False, "message": "会话存储服务暂时不可用，请稍后重试。"}
+        result = {"success": False, "message": "会话存储服务暂时不可用，请稍后重试。"}
     except Exception as e:
         # 处理任务执行过程中的其他未知异常
         print(f"[任务 {self.request.id}] 处理对话异常: {e}")
         traceback.print_exc() # 打印详细的错误堆栈信息
         # 返回包含错误信息的失败结果
-        return {"success": False, "message": f"处理请求时发生内部错误: {type(e).__name__}"}
+        result = {"success": False, "message": f"处理请求时发生内部错误: {type(e).__name__}"}
+    if stream: StreamRelayModule.publish(self.request.id, "error", result)
+    return result
 
 # --- 异步生成总结的任务 ---
 @shared_task(bind=True, ignore_result=False)
@@ -75,8 +86,8 @@ def generate_summary_task(self, session_id: str):
     # 打印任务开始日志
     print(f"[任务 {self.request.id}] 开始为会话 {session_id} 生成总结...")
     try:
-        # 从 Redis 获取对话历史
-        history = ContextManagerModule.get_history(session_id)
+        # 从 Redis 获取对话历史 (含已折叠进摘要的旧消息)
+        history = ContextManagerModule.get_full_history(session_id)
         # 如果历史为空，返回错误
         if not history: return {"ok": False, "error": "历史为空，无法生成总结"}
 
@@ -100,6 +111,88 @@ def generate_summary_task(self, session_id: str):
         return {"ok": False, "error": f"生成总结时发生内部错误: {type(e).__name__}"}
 
 
+# --- 滚动压缩历史的任务 (低优先级) ---
+@shared_task(bind=True, ignore_result=True)
+def compact_history_task(self, session_id: str):
+    """Celery 任务：把最早的一段历史折叠进会话的滚动摘要"""
+    redis = current_app.redis_client
+    lock_key = f"compaction_lock:{session_id}"
+    try:
+        # 同一会话同时只允许一个压缩任务
+        if not redis.set(lock_key, self.request.id, nx=True, ex=current_app.config.get('LLM_REQUEST_TIMEOUT', 120) + 30):
+            print(f"[任务 {self.request.id}] 会话 {session_id} 正在压缩，跳过")
+            return
+        try:
+            history = ContextManagerModule.get_history(session_id)
+            if len(history) <= current_app.config.get('COMPACTION_TRIGGER_MESSAGES', 24): return
+
+            # 折叠最早的消息，只保留最新 N 条；以助手回复结尾，保证折叠的是完整轮次
+            block = history[:len(history) - current_app.config.get('COMPACTION_KEEP_MESSAGES', 12)]
+            while block and block[-1].get("role") != "assistant": block.pop()
+            if not block: return
+
+            previous = ContextManagerModule.get_summary(session_id)
+            fold_result = SummaryModule.fold_summary(previous["summary"] if previous else None, block)
+            if not fold_result.success:
+                print(f"[任务 {self.request.id}] 会话 {session_id} 增量摘要失败: {fold_result.message}")
+                return
+            if ContextManagerModule.fold_into_summary(session_id, block, fold_result.data.get("summary", "")):
+                print(f"[任务 {self.request.id}] 会话 {session_id} 已将 {len(block)} 条旧消息折叠进摘要")
+            else:
+                print(f"[任务 {self.request.id}] 会话 {session_id} 历史已变化，放弃本次折叠")
+        finally:
+            redis.delete(lock_key)
+    except redis_exceptions.ConnectionError as e:
+        print(f"[任务 {self.request.id}] 压缩历史时 Redis 连接错误: {e}")
+    except Exception as e:
+        print(f"[任务 {self.request.id}] 压缩历史异常: {e}")
+        traceback.print_exc()
+
+@shared_task(bind=True, ignore_result=True)
+def record_crisis_turn_task(self, session_id: str, user_input: str, response: str):
+    """Celery 任务：写入 Web 端快速通道处理的危机轮次 (用户消息 + 危机回复)"""
+    try:
+        ContextManagerModule.add_message(session_id, "user", user_input)
+        ContextManagerModule.add_message(session_id, "assistant", response)
+        schedule_compaction(session_id) # 与普通对话轮次一样，历史过长时排入压缩任务
+        print(f"[任务 {self.request.id}] 已记录会话 {session_id} 的危机轮次")
+    except redis_exceptions.ConnectionError as e:
+        print(f"[任务 {self.request.id}] 记录危机轮次时 Redis 连接错误: {e}")
+    except Exception as e:
+        print(f"[任务 {self.request.id}] 记录危机轮次异常: {e}")
+        traceback.print_exc()
+
+def record_crisis_turn(session_id: str, user_input: str, response: str):
+    """危机轮次已在 Web 端回复，历史由快速通道任务异步写入；任务无法提交时直接写入"""
+    try:
+        record_crisis_turn_task.apply_async(args=[session_id, user_input, response], **queue_options("interactive"))
+    except Exception as e:
+        print(f"[危机] 提交记录任务失败，直接写入会话 {session_id}: {e}")
+        try:
+            ContextManagerModule.add_message(session_id, "user", user_input)
+            ContextManagerModule.add_message(session_id, "assistant", response)
+            schedule_compaction(session_id)
+        except Exception as e_save:
+            print(f"[危机] 写入会话 {session_id} 历史失败: {e_save}")
+
+def queue_options(lane: str) -> dict:
+    """任务提交参数：lane 为 interactive / summary / maintenance，返回对应的队列名与优先级"""
+    config = current_app.config
+    return {
+        "queue": config.get(f'CELERY_QUEUE_{lane.upper()}', lane),
+        "priority": config.get('CELERY_TASK_PRIORITIES', {}).get(lane, 5),
+    }
+
+def schedule_compaction(session_id: str):
+    """历史超过阈值时排入压缩任务"""
+    if not current_app.config.get('COMPACTION_ENABLED', True): return
+    try:
+        if ContextManagerModule.get_history_length(session_id) <= current_app.config.get('COMPACTION_TRIGGER_MESSAGES', 24): return
+        compact_history_task.apply_async(args=[session_id], **queue_options("maintenance"))
+    except Exception as e:
+        print(f"[压缩] 排入会话 {session_id} 的压缩任务失败: {e}")
+
+
 # --- 获取任务结果的辅助函数 ---
 def get_task_result(task_id: str) -> tuple[str, any]:
     """根据任务 ID 从 Celery 后端获取任务状态和结果"""
@@ -3,30 +3,15 @@
 import os
 import json
 from flask import session, current_app # 导入 current_app
+from modules.prompt_registry_module import PromptRegistryModule # 提示词注册表
 
 # 备用提示词
 FALLBACK_PROMPT = "你是一位友好的AI助手。"
 
 def load_prompt() -> str:
-    # 加载系统提示词
-    # PROMPT_FILE_PATH 来自 config.py，是相对于 app 目录的路径
-    # 需要拼接 app.root_path (Flask 应用根目录)
-    prompt_full_path = os.path.join(current_app.root_path, current_app.config['PROMPT_FILE_PATH'])
-
-    prompt_dir = os.path.dirname(prompt_full_path)
-    if prompt_dir and not os.path.exists(prompt_dir): # 检查目录
-        try: os.makedirs(prompt_dir); print(f"创建目录: {prompt_dir}")
-        except OSError as e: print(f"创建提示词目录失败: {e}")
-
-    if not os.path.exists(prompt_full_path): # 文件不存在
-        print(f"提示词文件不存在: {prompt_full_path}，使用备用。")
-        return FALLBACK_PROMPT
-    try:
-        with open(prompt_full_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-        return content if content else FALLBACK_PROMPT # 文件为空也用备用
-    except OSError as e: print(f"读取提示词失败: {e}"); return FALLBACK_PROMPT
-    except Exception as e: print(f"加载提示词未知错误: {e}"); return FALLBACK_PROMPT
+    # 加载系统提示词 (PROMPT_FILE_PATH 相对于应用根目录)
+    # 由注册表缓存，仅在文件修改时间变化时重新读取
+    return PromptRegistryModule.get_base(fallback=FALLBACK_PROMPT)
 
 def get_current_llm_config(session, config) -> tuple[str, str | None]:
     # 获取当前LLM配置
@@ -1,7 +1,9 @@
 # ./celery_worker.py
 # 文件路径: ./celery_worker.py
 import os
+from celery.signals import celeryd_init, worker_ready
 from app import create_app # 导入应用工厂
+from modules.ollama_adapter_module import OllamaAdapterModule
 
 # 创建一个临时的 Flask 应用实例，主要是为了加载配置给 Celery
 # 这个 flask_app 不会用来处理 Web 请求
@@ -14,3 +16,28 @@ celery = flask_app.celery
 # 可在此导入任务模块，确保 Worker 能自动发现它们
 # 例如: import app.tasks
 # (如果 tasks.py 使用了 @shared_task, Celery 通常能自动发现)
+
+# Worker 就绪后预热本地模型 (加载进显存并预填充系统提示)，避免首个请求遇到冷启动
+@worker_ready.connect
+def warm_up_local_models(sender=None, **kwargs):
+    OllamaAdapterModule.start_warm_up(flask_app)
+
+# 只消费单个队列的 Worker 未指定 -c 时，按 CELERY_QUEUE_CONCURRENCY 设置池大小
+# (对话队列需要大量并发等待模型，总结/维护队列只需少量执行单元)
+# 该值按线程/协程池 (threads/gevent/eventlet) 设定；prefork 池每个执行单元是一个进程，不超过 CPU 核数
+THREAD_LIKE_POOLS = ("thread", "gevent", "eventlet") # 也匹配以类路径指定的池 (celery.concurrency.thread:TaskPool)
+@celeryd_init.connect
+def size_pool_for_queue(sender=None, conf=None, options=None, **kwargs):
+    options = options or {}
+    queues = options.get("queues") or []
+    if isinstance(queues, str): queues = queues.split(",")
+    if len(queues) != 1 or options.get("concurrency"): return
+    lanes = {flask_app.config.get(f"CELERY_QUEUE_{lane.upper()}"): lane for lane in ("interactive", "summary", "maintenance")}
+    lane = lanes.get(queues[0].strip())
+    concurrency = flask_app.config.get("CELERY_QUEUE_CONCURRENCY", {}).get(lane)
+    if not concurrency: return
+    pool = str(options.get("pool") or "prefork").lower()
+    if not any(name in pool for name in THREAD_LIKE_POOLS):
+        concurrency = min(concurrency, os.cpu_count() or 1)
+    conf.worker_concurrency = concurrency
+    print(f"[Worker] 队列 {queues[0]} 池大小: {concurrency} ({pool})")
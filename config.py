@@ -23,12 +23,58 @@ class Config:
     CELERY_TIMEZONE = 'Asia/Shanghai' # 时区设置
     CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True # 启动时重试连接
 
+    # --- Celery 队列与优先级：对话轮次走快速通道，不与总结/压缩等后台任务排在同一队列 ---
+    CELERY_QUEUE_INTERACTIVE = os.environ.get('CELERY_QUEUE_INTERACTIVE', 'interactive') # 对话轮次 (Web 端同步等待结果)
+    CELERY_QUEUE_SUMMARY = os.environ.get('CELERY_QUEUE_SUMMARY', 'summary') # 用户请求的会话总结
+    CELERY_QUEUE_MAINTENANCE = os.environ.get('CELERY_QUEUE_MAINTENANCE', 'maintenance') # 历史压缩等后台维护任务
+    CELERY_TASK_PRIORITIES = {'interactive': 0, 'summary': 5, 'maintenance': 9} # 队列内优先级 (Redis Broker 中数值越小越优先)
+    CELERY_QUEUE_CONCURRENCY = {'interactive': 200, 'summary': 4, 'maintenance': 2} # 只消费单个队列且未指定 -c 时的 Worker 池大小 (线程/协程池；prefork 池不超过 CPU 核数)
+    CELERY_WORKER_PREFETCH_MULTIPLIER = 1 # 每个执行单元只预取一个任务，长任务不会囤积排在后面的对话轮次
+
     # --- 应用特定配置 ---
     PROMPT_FILE_PATH = os.path.join('templates', 'prompt.txt') # Prompt路径 (相对app)
-    MAX_CONVERSATION_HISTORY_TURNS = 10 # 最大历史轮数 (user+ai算2轮)
+    PROMPT_RELOAD_INTERVAL = 2 # 检查提示词文件修改时间的最短间隔 (秒)，文件修改后自动重新加载
+    PROMPT_STATE_VARIANTS_ENABLED = os.environ.get('PROMPT_STATE_VARIANTS_ENABLED', 'True').lower() == 'true' # 是否按对话状态追加提示段
+    PROMPT_VARIANT_TEMPLATE = "\n\n# 本轮对话提示\n{guidance}" # 追加到基础提示之后的格式
+    PROMPT_STATE_VARIANTS = { # 键为 UserType / EmotionType 的取值
+        "user_type": {
+            "探索型": "用户希望了解知识或进行自我探索，可适当解释相关概念，并引导其联系自身经历。",
+            "倾诉型": "用户主要在倾诉，以倾听和共情为主，少给建议，多做情感反映。",
+            "求助型": "用户在寻求具体方法，在共情之后给出一到两个可操作的小步骤。",
+            "测试型": "用户在试探你的能力或边界，简要说明你能提供的帮助与局限，再温和地把话题引回用户自身。",
+            "危机型": "用户近期表达过危机信号，优先关注其安全状况，必要时重复危机求助渠道。",
+        },
+        "user_emotion": {
+            "消极": "用户情绪低落，语气要温和、放慢节奏，先确认和接纳情绪。",
+            "矛盾": "用户情绪矛盾，帮助其分别说出两方面的感受，不急于下结论。",
+        },
+    }
+    MAX_CONVERSATION_HISTORY_TURNS = 10 # 最大历史轮数 (user+ai算2轮，仅旧版流水线使用)
+
+    # --- 旧版 app.py 聊天记录 (分段追加日志 + 会话偏移索引) ---
+    CONTEXT_FILE = 'context.txt' # 旧的单文件聊天记录，首次使用分段日志时导入 (原文件不修改)
+    TRANSCRIPT_LOG_DIR = os.environ.get('TRANSCRIPT_LOG_DIR') or 'transcripts' # 段文件与索引所在目录
+    TRANSCRIPT_SEGMENT_BYTES = 64 * 1024 * 1024 # 单个段文件的大小上限，超过后写入新段
+    TRANSCRIPT_COMPACT_INTERVAL = 300 # 后台压缩检查间隔 (秒)，0 关闭
+    TRANSCRIPT_COMPACT_DEAD_RATIO = 0.5 # 已封存段中已删除记录占比达到该值时回收
+    TRANSCRIPT_WRITE_BEHIND = os.environ.get('TRANSCRIPT_WRITE_BEHIND', 'True').lower() == 'true' # 后台批量写入 (关闭时在请求中同步写入)
+    TRANSCRIPT_QUEUE_MAX = 10000 # 内存队列上限 (条)
+    TRANSCRIPT_FLUSH_BATCH = 256 # 攒够该条数立即写出
+    TRANSCRIPT_FLUSH_INTERVAL = 0.2 # 未攒够一批时的最长等待 (秒)
+    TRANSCRIPT_FSYNC = os.environ.get('TRANSCRIPT_FSYNC', 'interval') # 落盘策略: always (每批) / interval / never (交给操作系统)
+    TRANSCRIPT_FSYNC_INTERVAL = 1.0 # interval 策略下两次 fsync 的最短间隔 (秒)
+    TRANSCRIPT_ENQUEUE_TIMEOUT = 0.5 # 队列满时请求线程最多等待的时间 (秒)，超时后同步写入
+    TRANSCRIPT_SHUTDOWN_TIMEOUT = 5 # 进程退出时写完队列的时间上限 (秒)
+
+    # --- 分词 (jieba) ---
+    TOKENIZER_PRELOAD = os.environ.get('TOKENIZER_PRELOAD', 'True').lower() == 'true' # 创建应用时 (fork 之前) 预加载词典
+    JIEBA_CACHE_FILE = os.environ.get('JIEBA_CACHE_FILE') or os.path.join('instance', 'jieba.cache') # 序列化词典缓存 (相对应用根目录)
+    JIEBA_USER_DICT = os.path.join('templates', 'user_dict.txt') # 领域自定义词典
 
     # --- LLM API 配置 ---
     LOCAL_API_URL = os.environ.get('LOCAL_API_URL', 'http://localhost:11434/api/chat')
+    LOCAL_API_MODE = os.environ.get('LOCAL_API_MODE') or ('ollama' if LOCAL_API_URL.rstrip('/').endswith('/api/chat') else 'openai') # ollama: 原生接口 (keep_alive/num_ctx/耗时统计)
+    LOCAL_API_URLS = [u.strip() for u in os.environ.get('LOCAL_API_URLS', LOCAL_API_URL).split(',') if u.strip()] # 多台本地主机 (逗号分隔)，按负载分发
     LOCAL_API_KEY = os.environ.get("LOCAL_API_KEY", None)
     LOCAL_MODELS = ["qwen2:latest", "llama3"] # 本地模型列表
 
@@ -40,7 +86,10 @@ class Config:
     # 统一管理 Provider
     AVAILABLE_PROVIDERS = {
         "Local": {
-            "url": LOCAL_API_URL,
+            "url": LOCAL_API_URLS[0] if LOCAL_API_URLS else LOCAL_API_URL,
+            "endpoints": LOCAL_API_URLS, # 多端点时由 EndpointPoolModule 负载均衡
+            "api_mode": LOCAL_API_MODE, # 请求格式 (ollama / openai)
+            "rate_limit": {"rps": 2, "burst": 4, "max_wait": 30}, # 本地主机并发能力有限，超出时排队
             "models": LOCAL_MODELS,
             "key_required": bool(LOCAL_API_KEY), # 本地Key是否必须
             "key_configured": bool(LOCAL_API_KEY) # 本地Key是否已配
@@ -49,7 +98,8 @@ class Config:
             "url": DEEPSEEK_API_URL,
             "models": DEEPSEEK_MODELS,
             "key_required": True, # DeepSeek需要Key
-            "key_configured": bool(DEEPSEEK_API_KEY) # 只要环境变量有值就算配置
+            "key_configured": bool(DEEPSEEK_API_KEY), # 只要环境变量有值就算配置
+            "rate_limit": {"rps": 5, "burst": 10, "tpm": 120000, "max_wait": 10}, # 请求/秒、突发、token/分钟、最长排队秒数
         }
         # 可添加更多 Provider
     }
@@ -65,6 +115,141 @@ class Config:
     # LLM 请求超时时间（秒）
     LLM_REQUEST_TIMEOUT = 120 # 请求超时
 
+    # --- 提供者客户端 (连接池 / 重试 / 熔断) 配置，可在 AVAILABLE_PROVIDERS 中按提供者覆盖 ---
+    PROVIDER_POOL_MAXSIZE = 10 # 每个提供者的连接池大小
+    PROVIDER_CONNECT_TIMEOUT = 5 # 建立连接超时 (秒)，读超时仍为 LLM_REQUEST_TIMEOUT
+    PROVIDER_MAX_RETRIES = 2 # 可重试失败 (连接失败/429/502/503/504) 的最大重试次数
+    PROVIDER_RETRY_BACKOFF = 0.5 # 退避基数 (秒)，按 2^n 增长并加随机抖动
+    PROVIDER_RETRY_BACKOFF_MAX = 8 # 单次退避上限 (秒)
+    CIRCUIT_BREAKER_WINDOW = 20 # 熔断统计窗口 (最近N次调用)
+    CIRCUIT_BREAKER_MIN_REQUESTS = 5 # 窗口内最少调用数才判断失败率
+    CIRCUIT_BREAKER_FAILURE_RATE = 0.5 # 失败率阈值
+    CIRCUIT_BREAKER_COOLDOWN = 30 # 熔断打开后的冷却时间 (秒)
+    RATE_LIMIT_DEFAULT = None # 未在 AVAILABLE_PROVIDERS 中配置 rate_limit 的提供者的限额 (None 不限流)
+    RATE_LIMIT_MAX_WAIT = 10 # 默认最长排队时间 (秒)，超过则本次调用失败
+    RATE_LIMIT_OUTPUT_ESTIMATE = 300 # token 桶按 提示token + 该值 预扣
+
+    # --- 多端点负载均衡 (EndpointPoolModule) ---
+    ENDPOINT_LATENCY_ALPHA = 0.3 # 端点平滑耗时 (EWMA) 的新样本权重
+    ENDPOINT_EJECT_FAILURES = 3 # 连续失败 (超时/网络异常/5xx) 达到该次数摘除端点
+    ENDPOINT_EJECT_SECONDS = 30 # 摘除时长 (秒)，到期后自动恢复调度
+
+    # --- 异步运行时配置 ---
+    ASYNC_ANALYZER_WORKERS = int(os.environ.get('ASYNC_ANALYZER_WORKERS', 4)) # 分析模块线程池大小
+
+    # --- LLM 回复缓存 (L1 进程内 LRU + L2 Redis) ---
+    LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'True').lower() == 'true' # 全局开关，提供者可用 cache_enabled 单独关闭
+    LLM_CACHE_L1_MAXSIZE = 512 # 进程内最多缓存条数
+    LLM_CACHE_L1_TTL = 300 # 进程内缓存有效期 (秒)
+    LLM_CACHE_L2_TTL = 3600 # Redis 缓存有效期 (秒)
+
+    # --- 开场轮次语义缓存 (SimHash 近重复匹配) ---
+    SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'True').lower() == 'true' # 是否启用
+    SEMANTIC_CACHE_MAX_DISTANCE = 3 # 允许的最大汉明距离 (64位指纹)
+    SEMANTIC_CACHE_MAX_TURNS = 0 # 仅对已完成轮次不超过该值的会话生效 (0 = 仅首轮)
+    SEMANTIC_CACHE_MIN_TOKENS = 1 # 有效词少于该值不参与
+    SEMANTIC_CACHE_TTL = 86400 # 缓存有效期 (秒)
+
+    # --- 模板快速回复 (问候 / 能力试探轮次跳过模型调用) ---
+    TEMPLATE_FASTPATH_ENABLED = os.environ.get('TEMPLATE_FASTPATH_ENABLED', 'True').lower() == 'true' # 是否启用
+    TEMPLATE_MAX_TURNS = 2 # 仅对已完成轮次不超过该值的会话生效
+    TEMPLATE_MAX_NEGATIVE_INTENSITY = 0.6 # 消极情绪强度达到该值时不使用模板 (危机状态/危机情绪始终不使用)
+    TEMPLATE_MAX_LEFTOVER_CHARS = 1 # 去掉意图关键词后消息最多剩余的字符数 (如 "你好呀" 的 "呀")，超过说明消息还有实际内容
+    TEMPLATE_VARIABLES = {"assistant_name": "AI心理咨询助手"} # 回复模板中的占位符
+    TEMPLATE_RESPONSES = { # 意图 -> 关键词、消息长度上限 (去标点后)、限定的用户类型、回复模板
+        "greeting": {
+            "keywords": ["你好", "您好", "嗨", "哈喽", "hello", "hi", "在吗", "早上好", "晚上好"],
+            "max_chars": 8,
+            "response": "你好，我是你的{assistant_name}。很高兴和你聊聊，最近有什么想说的吗？开心的事或是烦恼，都可以慢慢讲给我听。",
+        },
+        "identity": {
+            "keywords": ["你是谁"],
+            "max_chars": 10,
+            "user_types": ["测试型"],
+            "response": "我是一个{assistant_name}，可以陪你聊聊心里的想法和感受，帮你梳理情绪、练习一些应对技巧。\n不过我不能替代专业的心理咨询或治疗。你今天想聊些什么呢？",
+        },
+        "capability": {
+            "keywords": ["你能做什么", "你的能力", "你可以做什么"],
+            "max_chars": 12,
+            "user_types": ["测试型"],
+            "response": "我可以：\n1. 倾听你的烦恼，陪你梳理情绪；\n2. 帮你识别一些让自己更难受的想法模式；\n3. 带你做放松、正念之类的小练习。\n我无法提供诊断或紧急救助，如果遇到危机请联系专业机构。你想从哪里开始呢？",
+        },
+    }
+
+    # --- 在途请求合并 (singleflight) ---
+    SINGLEFLIGHT_ENABLED = os.environ.get('SINGLEFLIGHT_ENABLED', 'True').lower() == 'true' # 相同 LLM 请求同一时刻只调用一次提供者
+    SINGLEFLIGHT_RESULT_TTL = 30 # 领头者结果保留时间 (秒)，供稍晚到达的等待者读取
+
+    # --- 上下文窗口 (按 token 预算装入历史) ---
+    LLM_MAX_TOKENS = 1500 # 单次回复的最大 token 数 (同时从上下文预算中预留)
+    CONTEXT_HISTORY_BUDGET = 3000 # 历史消息最多占用的 token 数，控制提示长度与本地模型预填充时间
+    CONTEXT_SAFETY_MARGIN = 256 # token 估算误差余量
+    CONTEXT_DEFAULT_WINDOW = 4096 # 未在 MODEL_CONTEXT_WINDOWS 中列出的模型的上下文窗口
+    MODEL_CONTEXT_WINDOWS = { # 各模型上下文窗口 (token)
+        "qwen2:latest": 8192, "llama3": 8192,
+        "deepseek-chat": 65536, "deepseek-coder": 16384,
+    }
+    TOKEN_COUNT_RATIOS = { # 模型家族 -> (每个汉字, 每个英文单词/数字串, 每个其他符号) 的估算 token 数
+        "deepseek": (0.6, 1.3, 1.0),
+        "qwen": (0.7, 1.3, 1.0),
+        "llama": (1.3, 1.3, 1.0),
+        "default": (1.0, 1.3, 1.0),
+    }
+    CONTEXT_STORE_MAX_MESSAGES = 200 # Redis 中每个会话最多保存的消息数 (仅限制存储，不决定发送内容)
+
+    # --- 生成策略 (按对话状态决定输出预算 / 采样参数 / 提供者) ---
+    GENERATION_POLICY_ENABLED = os.environ.get('GENERATION_POLICY_ENABLED', 'True').lower() == 'true' # 关闭时所有轮次使用默认策略
+    GENERATION_POLICY_DEFAULT = {"max_tokens": LLM_MAX_TOKENS, "temperature": 0.7, "stop": []} # 未匹配任何规则时的策略
+    # 规则按顺序匹配，取第一条满足 when 中全部条件的规则 (覆盖默认策略中的同名字段)。
+    # when 条件：crisis (bool), user_types / emotions (枚举值列表), min_intensity / max_intensity,
+    #            min_turns / max_turns (已完成轮次), max_input_chars (本轮消息字数)
+    # 可选 provider / model：该轮改用指定的提供者 (未配置模型或缺少 Key 时保持用户的选择)
+    GENERATION_POLICIES = [
+        {"name": "crisis", "when": {"crisis": True}, "max_tokens": 800, "temperature": 0.3},
+        {"name": "probe", "when": {"user_types": ["测试型"]}, "max_tokens": 300, "temperature": 0.5},
+        {"name": "coping_plan", "when": {"user_types": ["求助型"]}, "max_tokens": 1500}, # 求助的短句 (如"我该怎么办") 也需要完整的建议
+        {"name": "short_turn", "when": {"max_input_chars": 15, "max_intensity": 0.7}, "max_tokens": 400},
+        {"name": "high_intensity", "when": {"min_intensity": 0.8}, "max_tokens": 900, "temperature": 0.5},
+        {"name": "venting", "when": {"user_types": ["倾诉型"]}, "max_tokens": 700},
+    ]
+
+    # --- Ollama 原生模式 (LOCAL_API_MODE = 'ollama') ---
+    OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m') # 模型闲置后在显存中保留的时长，避免冷启动 (-1 为常驻)
+    OLLAMA_NUM_CTX = None # 固定的 num_ctx；None 时使用 MODEL_CONTEXT_WINDOWS 中该模型的窗口
+    OLLAMA_WARMUP_ON_START = os.environ.get('OLLAMA_WARMUP_ON_START', 'True').lower() == 'true' # Worker 启动时预热 LOCAL_MODELS
+    CONTEXT_PACK_ALIGN = int(os.environ.get('CONTEXT_PACK_ALIGN', 1)) # 仅 Ollama 原生模式：历史截断起点按该条数对齐以复用 KV 前缀缓存 (最多多丢弃 该值-1 条)，1 为不对齐
+
+    # --- 延迟 SLO 与模型降级 ---
+    SLO_DOWNGRADE_ENABLED = os.environ.get('SLO_DOWNGRADE_ENABLED', 'True').lower() == 'true' # 是否启用
+    MODEL_FALLBACKS = { # 主模型 ("提供者/模型" 或模型名) -> 超出 SLO 时改用的较小模型 (同一提供者)
+        # "llama3": "qwen2:1.5b",
+    }
+    LATENCY_SLO = {"p50": 8.0, "p95": 20.0} # 默认延迟目标 (秒，整次调用耗时)
+    LATENCY_SLO_OVERRIDES = {} # 按模型覆盖，如 {"llama3": {"p50": 6.0, "p95": 15.0}}
+    SLO_MIN_SAMPLES = 20 # 样本不足时不降级
+    SLO_RECOVER_RATIO = 0.7 # 回落到 SLO 的该比例以下才恢复 (滞回)
+    SLO_MIN_DEGRADED_SECONDS = 60 # 降级后至少保持的时间 (秒)
+    SLO_RECOVER_WINDOW = 20 # 判断恢复时最多使用降级之后最近的多少个样本
+    SLO_RECOVER_MIN_SAMPLES = 5 # 降级之后至少新增多少个样本才判断恢复
+    SLO_PROBE_INTERVAL = 30 # 降级期间每隔多少秒放行一个请求到主模型以刷新延迟样本
+    SLO_EVAL_INTERVAL = 5 # 进程内缓存评估结果的时间 (秒)
+
+    # --- 请求对冲 (hedging) 配置，默认关闭 ---
+    HEDGING_ENABLED = os.environ.get('HEDGING_ENABLED', 'False').lower() == 'true' # 主提供者慢时并发请求备用提供者
+    HEDGE_SECONDARY_PROVIDER = os.environ.get('HEDGE_SECONDARY_PROVIDER') or None # 备用提供者，留空则取第一个可用的其他提供者
+    HEDGE_DELAY_PERCENTILE = 0.95 # 对冲等待时间取主提供者近期耗时的该分位数
+    HEDGE_MIN_SAMPLES = 20 # 样本少于该值时使用 HEDGE_DEFAULT_DELAY
+    HEDGE_DEFAULT_DELAY = 8.0 # 默认对冲等待时间 (秒)
+    HEDGE_MIN_DELAY = 1.0 # 对冲等待时间下限 (秒)
+    HEDGE_MAX_DELAY = 30.0 # 对冲等待时间上限 (秒)
+    LATENCY_WINDOW = 200 # 每个 (提供者, 模型) 保留的最近耗时样本数
+
+    # --- 流式输出 (SSE) 配置 ---
+    LLM_STREAM_ENABLED = os.environ.get('LLM_STREAM_ENABLED', 'True').lower() == 'true' # 是否允许流式回复
+    STREAM_RELAY_TTL = 600 # Redis Stream 保留时间 (秒)
+    STREAM_RELAY_MAXLEN = 5000 # 单个任务最多保留的事件数
+    STREAM_RELAY_BLOCK_MS = 15000 # Web端 XREAD 阻塞时长 (毫秒)，同时作为心跳间隔
+
     # 危机干预信息
     CRISIS_HOTLINE_INFO = os.environ.get("CRISIS_HOTLINE_INFO", """
 - 希望24热线：400-161-9995
@@ -84,6 +269,13 @@ class Config:
     SUMMARY_MODEL = _summary_model # 总结用Model
     SUMMARY_PROMPT = os.environ.get("SUMMARY_PROMPT", "请根据对话记录，生成一段简洁的总结报告，包含用户议题、情绪状态、关键点和后续建议。\n对话记录如下：\n{conversation_history}") # 总结提示 (优先环境变量)
 
+    # 历史滚动压缩：较早的对话折叠进增量摘要，提示中以摘要代替原始旧消息
+    COMPACTION_ENABLED = os.environ.get('COMPACTION_ENABLED', 'True').lower() == 'true' # 是否启用
+    COMPACTION_TRIGGER_MESSAGES = 24 # 历史超过该条数时触发压缩
+    COMPACTION_KEEP_MESSAGES = 12 # 压缩后保留的最新原始消息条数
+    COMPACTION_PROMPT = os.environ.get("COMPACTION_PROMPT", "请把下面新增的对话并入已有摘要，输出一段新的简洁摘要 (不超过300字)，保留用户的主要议题、情绪变化、关键事实和已给出的建议。\n已有摘要：\n{previous_summary}\n新增对话：\n{conversation_history}") # 增量摘要提示
+    HISTORY_SUMMARY_TEMPLATE = "\n\n以下是本次会话较早部分的摘要，请结合它理解上下文：\n{summary}" # 追加到系统提示后的摘要格式
+
     @staticmethod
     def init_app(app):
         # 应用初始化钩子
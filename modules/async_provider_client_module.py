@@ -0,0 +1,79 @@
+# D:\python_code\LocalAgent\modules\async_provider_client_module.py
+import asyncio
+import httpx
+from flask import current_app
+from modules.provider_client_module import ProviderClientModule, CircuitOpenError
+
+
+class AsyncProviderClientModule:
+    """
+    ProviderClientModule 的 asyncio 版本 (基于 httpx.AsyncClient)。
+    每个 (提供者, 事件循环) 一个连接池客户端；重试、退避参数和熔断器与同步客户端共用，
+    因此同一提供者在同步/异步两条路径上的失败会合并统计。
+    """
+    RETRYABLE_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError, httpx.ConnectTimeout)
+
+    _clients: dict = {}
+
+    @classmethod
+    def get_client(cls, provider: str) -> httpx.AsyncClient:
+        # 获取 (或创建) 当前事件循环上的提供者客户端
+        loop = asyncio.get_running_loop()
+        key = (provider, id(loop))
+        client = cls._clients.get(key)
+        if client is None or client.is_closed:
+            pool_size = ProviderClientModule._setting(provider, "pool_maxsize", 'PROVIDER_POOL_MAXSIZE', 10)
+            connect_timeout = ProviderClientModule._setting(provider, "connect_timeout", 'PROVIDER_CONNECT_TIMEOUT', 5)
+            read_timeout = current_app.config.get('LLM_REQUEST_TIMEOUT', 120)
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+            cls._clients[key] = client
+        return client
+
+    @classmethod
+    async def post(cls, provider: str, url: str, headers: dict, payload: dict, stream: bool = False) -> httpx.Response:
+        # 发送请求 (语义同 ProviderClientModule.post)；stream=True 时调用方负责 await resp.aclose()
+        breaker = ProviderClientModule.get_breaker(provider, url)
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"{provider} 熔断中，暂不发起请求")
+
+        client = cls.get_client(provider)
+        max_retries = ProviderClientModule._setting(provider, "max_retries", 'PROVIDER_MAX_RETRIES', 2)
+
+        attempt = 0
+        settled = False # 本次请求的结果已计入熔断器
+        try:
+            while True:
+                try:
+                    request = client.build_request("POST", url, headers=headers, json=payload)
+                    resp = await client.send(request, stream=stream)
+                except cls.RETRYABLE_ERRORS as e:
+                    if attempt < max_retries:
+                        delay = ProviderClientModule._backoff_delay(provider, attempt)
+                        print(f"[异步提供者客户端] {provider} 连接失败 ({type(e).__name__})，{delay:.2f}秒后重试 ({attempt + 1}/{max_retries})")
+                        await asyncio.sleep(delay); attempt += 1
+                        continue
+                    settled = True
+                    breaker.record(False)
+                    raise
+                except httpx.HTTPError:
+                    settled = True
+                    breaker.record(False)
+                    raise
+
+                if resp.status_code in ProviderClientModule.RETRYABLE_STATUS and attempt < max_retries:
+                    delay = ProviderClientModule._backoff_delay(provider, attempt, resp)
+                    print(f"[异步提供者客户端] {provider} 返回 HTTP {resp.status_code}，{delay:.2f}秒后重试 ({attempt + 1}/{max_retries})")
+                    await resp.aclose()
+                    await asyncio.sleep(delay); attempt += 1
+                    continue
+
+                settled = True
+                breaker.record(resp.status_code < 500 and resp.status_code != 429)
+                return resp
+        except BaseException:
+            # 被取消 (对冲败方、客户端断开) 或意外中断时归还半开探测名额，否则该熔断器将一直拒绝请求
+            if not settled: breaker.release_probe()
+            raise
@@ -0,0 +1,79 @@
+# D:\python_code\LocalAgent\modules\async_runtime_module.py
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from flask import current_app
+
+
+class AsyncRuntimeModule:
+    """
+    进程级异步运行时：一个常驻后台线程运行的事件循环 + 一个分析线程池。
+    同步调用方 (Flask 视图、Celery 线程池任务) 通过 run() 把协程提交到同一个循环，
+    因此所有在途对话共享一个事件循环和同一组 HTTP 连接池。
+    提交时复制调用方的 contextvars，协程内仍可使用 current_app / session。
+    """
+    _loop: asyncio.AbstractEventLoop | None = None
+    _loop_pid: int | None = None # 创建循环的进程 (prefork 子进程不继承循环线程，需要重建)
+    _executor: ThreadPoolExecutor | None = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def _loop_usable(cls) -> bool:
+        return cls._loop is not None and cls._loop_pid == os.getpid() and cls._loop.is_running()
+
+    @classmethod
+    def get_loop(cls) -> asyncio.AbstractEventLoop:
+        # 获取 (或启动) 后台事件循环
+        if cls._loop_usable(): return cls._loop
+        with cls._lock:
+            if not cls._loop_usable():
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+                threading.Thread(target=_run, name="async-runtime", daemon=True).start()
+                started.wait()
+                cls._loop = loop; cls._loop_pid = os.getpid()
+                cls._executor = None # 线程池同样不能跨 fork 复用
+        return cls._loop
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        # 获取分析模块使用的线程池
+        if cls._executor is None:
+            with cls._lock:
+                if cls._executor is None:
+                    try: workers = current_app.config.get('ASYNC_ANALYZER_WORKERS', 4)
+                    except RuntimeError: workers = 4
+                    cls._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analyzer")
+        return cls._executor
+
+    @classmethod
+    def run(cls, coro):
+        # 在后台循环中执行协程并阻塞等待结果 (同步包装入口)
+        loop = cls.get_loop()
+        ctx = contextvars.copy_context() # 携带 Flask 应用/请求上下文
+        result_future = Future()
+
+        def _submit():
+            task = ctx.run(loop.create_task, coro) # 任务复制创建时的上下文 (create_task 的 context 参数需要 3.11+)
+            def _done(t: asyncio.Task):
+                if t.cancelled(): result_future.cancel()
+                elif t.exception() is not None: result_future.set_exception(t.exception())
+                else: result_future.set_result(t.result())
+            task.add_done_callback(_done)
+
+        loop.call_soon_threadsafe(_submit)
+        return result_future.result()
+
+    @classmethod
+    async def run_blocking(cls, func, *args, **kwargs):
+        # 把阻塞/CPU密集调用放到线程池，并复制当前上下文 (run_in_executor 默认不传递 contextvars)
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(cls.get_executor(), functools.partial(ctx.run, func, *args, **kwargs))
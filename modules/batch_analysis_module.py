@@ -0,0 +1,140 @@
+# D:\python_code\LocalAgent\modules\batch_analysis_module.py
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
+from modules.common import EmotionType, UserType, TokenizedText
+from modules.emotion_analyzer_module import EmotionAnalyzerModule
+from modules.user_analyzer_module import UserAnalyzerModule
+from modules.lexicon_module import LexiconModule
+
+EMOTION_LABELS = list(EmotionType)
+USER_TYPE_LABELS = list(UserType)
+
+
+def _init_worker(lexicons: dict):
+    # 进程池初始化：注册父进程的全部词表 (spawn/forkserver 启动的子进程只执行了本模块的导入，
+    # 缺少安全模块与意图模板等在其他地方注册的命名空间)
+    for namespace, lexicon in lexicons.items(): LexiconModule.register(namespace, lexicon)
+
+
+def _analyze_shard(texts: list, patterns: list) -> dict:
+    # 进程池中执行：扫描一批文本，构建稀疏命中矩阵 (COO: 行=文本, 列=关键词)，再用矩阵运算为所有类别打分
+    columns = {pattern: index for index, pattern in enumerate(patterns)}
+    categories = list(dict.fromkeys(category for category, _ in patterns))
+    category_index = {category: index for index, category in enumerate(categories)}
+    keyword_category = np.array([category_index[category] for category, _ in patterns], dtype=np.int64)
+
+    rows, cols = [], []
+    exclaim = np.zeros(len(texts), dtype=bool)
+    ellipsis = np.zeros(len(texts), dtype=bool)
+    for row, text in enumerate(texts):
+        # 与在线流水线一致：扫描规范化文本 (全角转半角、小写)
+        normalized = TokenizedText(text or "").normalized
+        for hit in LexiconModule.scan(normalized, memoize=False).hits:
+            column = columns.get((hit.category, hit.keyword))
+            if column is not None: rows.append(row); cols.append(column)
+        exclaim[row] = "!" in normalized
+        ellipsis[row] = "..." in normalized or "。。。" in normalized
+
+    rows = np.asarray(rows, dtype=np.int64); cols = np.asarray(cols, dtype=np.int64)
+    # 文本 x 类别 的命中次数 = 稀疏命中矩阵 x 关键词-类别关联矩阵
+    counts = np.bincount(rows * len(categories) + keyword_category[cols],
+                         minlength=len(texts) * len(categories)).reshape(len(texts), len(categories))
+    def _count(category: str) -> np.ndarray:
+        index = category_index.get(category)
+        return counts[:, index] if index is not None else np.zeros(len(texts), dtype=np.int64)
+
+    # 情感：与 EmotionAnalyzerModule.analyze 相同的规则
+    highest = np.full(len(texts), 0.5)
+    primary = np.full(len(texts), EMOTION_LABELS.index(EmotionType.NEUTRAL))
+    detected = np.zeros(len(texts), dtype=bool)
+    for etype in EmotionAnalyzerModule.EMOTION_KEYWORDS:
+        if etype == EmotionType.CRISIS: continue
+        count = _count(f"emotion:{etype.value}")
+        intensity = 0.6 + count * 0.1
+        better = (count > 0) & (intensity > highest)
+        highest = np.where(better, np.minimum(intensity, 1.0), highest)
+        primary = np.where(better, EMOTION_LABELS.index(etype), primary)
+        detected |= count > 0
+    ambivalent = (_count(f"emotion:{EmotionType.POSITIVE.value}") > 0) & (_count(f"emotion:{EmotionType.NEGATIVE.value}") > 0)
+    primary = np.where(ambivalent, EMOTION_LABELS.index(EmotionType.AMBIVALENT), primary)
+    highest = np.where(ambivalent, np.maximum(0.7, highest), highest)
+    highest = np.where(exclaim, np.minimum(1.0, highest + 0.1), highest)
+    highest = np.where(ellipsis, np.maximum(0.3, highest - 0.1), highest)
+    primary = np.where(~detected & (primary == EMOTION_LABELS.index(EmotionType.NEUTRAL)), EMOTION_LABELS.index(EmotionType.UNKNOWN), primary)
+    crisis = _count(f"emotion:{EmotionType.CRISIS.value}") > 0
+    primary = np.where(crisis, EMOTION_LABELS.index(EmotionType.CRISIS), primary)
+    highest = np.where(crisis, 1.0, np.round(highest, 2))
+
+    # 用户类型：按 USER_TYPE_KEYWORDS 顺序取第一个命中的类型，未命中为倾诉型
+    user_type = np.full(len(texts), USER_TYPE_LABELS.index(UserType.VENTING))
+    for utype in reversed(list(UserAnalyzerModule.USER_TYPE_KEYWORDS)):
+        user_type = np.where(_count(f"user_type:{utype.value}") > 0, USER_TYPE_LABELS.index(utype), user_type)
+
+    return {
+        "emotion_code": primary.astype(np.int8),
+        "emotion_intensity": highest,
+        "user_type_code": user_type.astype(np.int8),
+        "distortions": {name: _count(f"distortion:{name}") > 0 for name in UserAnalyzerModule.COGNITIVE_DISTORTION_KEYWORDS},
+        "keyword_hits": np.bincount(cols, minlength=len(patterns)),
+    }
+
+
+class BatchAnalysisModule:
+    """
+    离线批量分析 (调整词表后重跑归档消息)：文本按分片交给进程池，
+    每个分片一次性构建 文本 x 关键词 的稀疏命中矩阵，用 NumPy 矩阵运算给出与在线模块相同的情感/用户类型/认知扭曲结果。
+    返回列式结果，输入可以是任意长度的可迭代对象 (按分片读取，在途分片数有上限)。
+    """
+
+    @staticmethod
+    def _shards(texts, shard_size: int):
+        iterator = iter(texts)
+        while True:
+            shard = list(islice(iterator, shard_size))
+            if not shard: return
+            yield shard
+
+    @classmethod
+    def analyze_batch(cls, texts, workers: int | None = None, shard_size: int = 5000) -> dict:
+        """
+        返回列式结果：
+        {"count", "emotion_type": ndarray[str], "emotion_intensity": ndarray[float], "user_type": ndarray[str],
+         "distortions": {认知扭曲名: ndarray[bool]}, "keyword_hits": {(类别, 关键词): 命中次数}}
+        workers=1 时在当前进程内执行。
+        """
+        patterns = LexiconModule.patterns()
+        workers = workers or os.cpu_count() or 1
+        parts = []
+        if workers <= 1:
+            parts = [_analyze_shard(shard, patterns) for shard in cls._shards(texts, shard_size)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(LexiconModule.export(),)) as executor:
+                in_flight = deque()
+                for shard in cls._shards(texts, shard_size):
+                    in_flight.append(executor.submit(_analyze_shard, shard, patterns))
+                    if len(in_flight) >= workers * 2: parts.append(in_flight.popleft().result())
+                while in_flight: parts.append(in_flight.popleft().result())
+        return cls._merge(parts, patterns)
+
+    @staticmethod
+    def _merge(parts: list, patterns: list) -> dict:
+        # 按输入顺序拼接各分片的列
+        distortion_names = list(UserAnalyzerModule.COGNITIVE_DISTORTION_KEYWORDS)
+        if not parts:
+            return {"count": 0, "emotion_type": np.array([], dtype=object), "emotion_intensity": np.array([]),
+                    "user_type": np.array([], dtype=object), "distortions": {name: np.array([], dtype=bool) for name in distortion_names},
+                    "keyword_hits": {}}
+        emotion_codes = np.concatenate([part["emotion_code"] for part in parts])
+        user_codes = np.concatenate([part["user_type_code"] for part in parts])
+        keyword_hits = np.sum([part["keyword_hits"] for part in parts], axis=0)
+        return {
+            "count": len(emotion_codes),
+            "emotion_type": np.array([label.value for label in EMOTION_LABELS], dtype=object)[emotion_codes],
+            "emotion_intensity": np.concatenate([part["emotion_intensity"] for part in parts]),
+            "user_type": np.array([label.value for label in USER_TYPE_LABELS], dtype=object)[user_codes],
+            "distortions": {name: np.concatenate([part["distortions"][name] for part in parts]) for name in distortion_names},
+            "keyword_hits": {pattern: int(count) for pattern, count in zip(patterns, keyword_hits) if count},
+        }
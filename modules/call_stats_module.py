@@ -0,0 +1,29 @@
+# D:\python_code\LocalAgent\modules\call_stats_module.py
+import contextvars
+
+
+class CallStatsModule:
+    """
+    单次生成调用的统计容器 (限流等待、后端耗时等)，供流水线写入 outputs。
+    容器是放在 ContextVar 中的可变 dict：对冲等子任务复制上下文后写入的仍是同一个对象。
+    """
+    _holder: contextvars.ContextVar = contextvars.ContextVar("call_stats", default=None)
+
+    @classmethod
+    def begin(cls) -> dict:
+        # 在一次生成开始前调用，返回本次调用的统计容器
+        holder = {}
+        cls._holder.set(holder)
+        return holder
+
+    @classmethod
+    def update(cls, **fields):
+        # 写入统计字段 (未调用 begin 时忽略)
+        holder = cls._holder.get()
+        if holder is not None: holder.update(fields)
+
+    @classmethod
+    def add(cls, field: str, value: float):
+        # 累加统计字段 (同一轮多次调用时合计)
+        holder = cls._holder.get()
+        if holder is not None: holder[field] = round(holder.get(field, 0) + value, 1)
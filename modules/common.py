@@ -2,6 +2,8 @@
 from dataclasses import dataclass, field # 导入数据类和字段工厂 (Import dataclass and field factory)
 from enum import Enum  # 枚举类型 (Enum type)
 from typing import List, Dict, Any # 类型注解 (Type hints)
+import re # 正则表达式 (Regular expressions)
+import unicodedata # Unicode 规范化 (Unicode normalization)
 
 # --- 用户类型枚举 (User Type Enum) ---
 class UserType(Enum):
@@ -47,3 +49,30 @@ class ModuleOutput:
     data: Dict[str, Any] = field(default_factory=dict) # 处理返回的数据 (Data returned from processing)
     message: str = ""                 # 调试或用户提示信息 (Debug or user-facing message)
     next_module: str | None = None    # 建议的下一个处理模块 (Suggested next processing module) - 用于更灵活的流程控制 (for more flexible flow control)
+
+# --- 单轮分词文本 (Per-turn Tokenized Text) ---
+class TokenizedText:
+    """
+    单轮用户输入的规范化与分词结果，安全检测、预处理与各分析模块共用，规范化和分词每轮只做一次。
+    (Normalized and segmented form of one user turn, shared by safety, preprocessing and analyzers.)
+    - normalized: NFKC 规范化 (全角转半角) + 小写，保留标点；关键词扫描以此为准，LexiconModule 命中的位置均为 normalized 中的下标
+    - cleaned: normalized 去掉标点，分词的输入 (去掉标点后下标与 normalized 不再对应，不要混用)
+    - tokens: cleaned 的分词结果，由预处理模块填入
+    """
+    PUNCT_REGEX = re.compile(r'[^\w\s]')
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.normalized = unicodedata.normalize("NFKC", raw).lower()
+        self.cleaned = self.PUNCT_REGEX.sub('', self.normalized)
+        self.tokens: List[str] | None = None
+        self._memo: Dict[Any, Any] = {}
+
+    def set_tokens(self, tokens: List[str]):
+        # 写入分词结果 (每轮只分词一次，后续模块直接读取 tokens)
+        self.tokens = list(tokens)
+
+    def memo(self, key, factory):
+        # 供各模块缓存基于本轮文本的计算结果 (如关键词扫描)
+        if key not in self._memo: self._memo[key] = factory()
+        return self._memo[key]
@@ -0,0 +1,67 @@
+# D:\python_code\LocalAgent\modules\context_window_module.py
+from flask import current_app
+from modules.token_counter_module import TokenCounterModule
+
+
+class ContextWindowModule:
+    """
+    按 token 预算组装发送给模型的历史消息 (取代按消息条数截断)。
+    预算 = min(模型上下文窗口 - 系统提示 - max_tokens - 余量, CONTEXT_HISTORY_BUDGET)，
+    从最新一轮开始向前装入，装不下即停止，保证提示长度可预期；
+    最新的用户消息总会保留，超长时截断到预算内。
+    """
+
+    @staticmethod
+    def get_window(model: str | None) -> int:
+        # 模型上下文窗口大小 (token)
+        windows = current_app.config.get('MODEL_CONTEXT_WINDOWS', {})
+        return windows.get(model) or current_app.config.get('CONTEXT_DEFAULT_WINDOW', 4096)
+
+    @classmethod
+    def get_budget(cls, model: str | None, system_tokens: int, max_tokens: int) -> int:
+        # 历史消息可用的 token 预算
+        margin = current_app.config.get('CONTEXT_SAFETY_MARGIN', 256)
+        available = cls.get_window(model) - system_tokens - max_tokens - margin
+        return max(0, min(available, current_app.config.get('CONTEXT_HISTORY_BUDGET', 3000)))
+
+    @classmethod
+    def pack(cls, system_prompt: str, history: list, model: str | None, max_tokens: int,
+             system_tokens: int | None = None, align: int = 1) -> tuple[list, dict]:
+        # 返回 (装入的消息列表 [{"role", "content"}], 统计信息)；system_tokens 为调用方已算好的系统提示 token 数
+        # align > 1 时按该条数对齐截断起点 (会多丢弃至多 align-1 条)，只应在能复用 KV 前缀缓存的提供者上使用
+        family = TokenCounterModule.family(model)
+        if system_tokens is None: system_tokens = TokenCounterModule.count(system_prompt, family)
+        system_tokens += TokenCounterModule.MESSAGE_OVERHEAD
+        budget = cls.get_budget(model, system_tokens, max_tokens)
+
+        valid_history = [msg for msg in history if msg.get("role") in ["user", "assistant"] and msg.get("content")]
+        packed, packed_tokens, truncated = [], [], False
+        for msg in reversed(valid_history):
+            tokens = TokenCounterModule.message_tokens(msg, family)
+            content = msg["content"]
+            if sum(packed_tokens) + tokens > budget:
+                if packed: break
+                # 最新消息本身超出预算：按比例截断，保留开头部分
+                keep_chars = max(1, int(len(content) * budget / tokens)) if budget > 0 else 1
+                content = content[:keep_chars]
+                tokens = TokenCounterModule.count(content, family) + TokenCounterModule.MESSAGE_OVERHEAD
+                truncated = True
+            packed.append({"role": msg["role"], "content": content})
+            packed_tokens.append(tokens)
+        packed.reverse(); packed_tokens.reverse()
+
+        # 需要丢弃旧消息时，起点向后对齐到 align 的整数倍：
+        # 起点在连续多轮内保持不变，发送的消息前缀逐字节相同，本地模型可复用 KV 前缀缓存
+        start = len(valid_history) - len(packed)
+        if start and align > 1:
+            skip = min(-start % align, len(packed) - 1)
+            packed, packed_tokens = packed[skip:], packed_tokens[skip:]
+        used = sum(packed_tokens)
+
+        stats = {
+            "budget": budget, "system_tokens": system_tokens, "history_tokens": used,
+            "kept": len(packed), "dropped": len(valid_history) - len(packed), "truncated": truncated,
+        }
+        if stats["dropped"] or truncated:
+            print(f"[上下文窗口] {model}: 预算 {budget} tokens，保留 {len(packed)} 条，丢弃 {stats['dropped']} 条{'，最新消息已截断' if truncated else ''}")
+        return packed, stats
@@ -1,49 +1,146 @@
 # D:\python_code\LocalAgent\modules\dialogue_pipeline.py
+import asyncio
+import inspect
+import time
+from dataclasses import replace
 from flask import session
-from modules.common import DialogueState, UserType, EmotionType, ModuleOutput
+from modules.common import DialogueState, UserType, EmotionType, ModuleOutput, TokenizedText
 from modules.safety_module import SafetyModule
 from modules.preprocessor_module import PreprocessorModule
 from modules.emotion_analyzer_module import EmotionAnalyzerModule
 from modules.user_analyzer_module import UserAnalyzerModule
-from modules.context_manager_module import ContextManagerModule
+from app.modules.context_manager_module import ContextManagerModule # Redis 会话历史 (与 Web 端、任务共用)
 from modules.response_generator_module import ResponseGeneratorModule
 from modules.response_optimizer_module import ResponseOptimizerModule
+from modules.async_runtime_module import AsyncRuntimeModule
+from modules.semantic_cache_module import SemanticCacheModule
+from modules.ollama_adapter_module import OllamaAdapterModule
+from modules.pipeline_graph_module import PipelineGraphModule, Stage
+from modules.template_responder_module import TemplateResponderModule
+from modules.generation_policy_module import GenerationPolicyModule
 
 
 class DialoguePipeline:
     @classmethod
-    def process_input(cls, user_input: str, selected_provider: str | None = None, selected_model: str | None = None, session_id: str | None = None, temp_keys: dict | None = None) -> dict: # Added parameters based on other files
+    def process_input(cls, user_input: str, selected_provider: str | None = None, selected_model: str | None = None, session_id: str | None = None, temp_keys: dict | None = None,
+                      on_token=None) -> dict: # on_token: 流式输出回调 (增量文本)
+        # 同步入口：在进程级事件循环上执行 aprocess_input 并等待结果
+        return AsyncRuntimeModule.run(cls.aprocess_input(
+            user_input, selected_provider, selected_model, session_id, temp_keys, on_token=on_token
+        ))
+
+    @classmethod
+    async def aprocess_input(cls, user_input: str, selected_provider: str | None = None, selected_model: str | None = None, session_id: str | None = None, temp_keys: dict | None = None,
+                             on_token=None) -> dict:
+        # 异步流水线：按阶段依赖图执行，分析模块与 Redis 读取并发，LLM 调用走 httpx 异步客户端
         if not session_id: return cls._prepare_fallback_response(ModuleOutput(False, message="缺少会话ID"), {})
 
         state = cls._init_or_load_state(session_id)
-        outputs = {}
+        ctx = {
+            "user_input": user_input, "state": state, "session_id": session_id, "temp_keys": temp_keys,
+            "selected_provider": selected_provider, "selected_model": selected_model, "on_token": on_token,
+        }
+        started = time.perf_counter()
+        try:
+            results, timings, halted = await PipelineGraphModule.execute(cls._build_graph(), ctx)
+        except Exception as e:
+            print(f"[流水线] 执行阶段出错: {e}")
+            return cls._prepare_fallback_response(ModuleOutput(False, message=f"流水线异常: {e}"), {}, session_id)
+        outputs = cls._collect_outputs(results)
+        outputs["阶段耗时"] = PipelineGraphModule.format_timings(timings, round((time.perf_counter() - started) * 1000, 1))
+
+        if halted:
+            stage_name, halt_res = halted
+            if stage_name == "safety":
+                print("[流水线] 安全检测失败，启动危机响应流程。")
+                state.is_crisis = True
+                state.user_type = UserType.CRISIS
+                cls._save_state(session_id, state)
+                return cls._prepare_crisis_response(halt_res, state)
+            print(f"[流水线] 阶段 {stage_name} 失败。")
+            return cls._prepare_fallback_response(halt_res, outputs, session_id)
+
+        state.session_turn_count += 1
+        cls._save_state(session_id, state)
+
+        state_dict = cls._get_state_dict(state)
+        outputs["会话报告输出"] = f"轮次:{state_dict.get('session_turn_count')}, 类型:{state_dict.get('user_type')}, 情绪:{state_dict.get('user_emotion')}"
+        return {
+            "success": True,
+            "response": results["response_optimization"].data.get("optimized_response", ""),
+            "state": state_dict,
+            "outputs": outputs
+        }
 
+    @classmethod
+    def screen_crisis(cls, user_input: str, session_id: str) -> dict | None:
+        # Web 端入队前同步执行安全检测：命中危机关键词时直接返回危机响应 (不经过任务队列)，否则返回 None
         safe_res = SafetyModule.check(user_input)
-        outputs["安全检测输出"] = safe_res.message
-        if not safe_res.success:
-            print("[流水线] 安全检测失败，启动危机响应流程。")
-            state.is_crisis = True
-            state.user_type = UserType.CRISIS
-            cls._save_state(session_id, state)
-            # Assuming _prepare_crisis_response needs state now
-            return cls._prepare_crisis_response(safe_res, state)
-        else:
-            if state.is_crisis:
-                state.is_crisis = False
-                print("[流水线] 退出危机状态。")
+        if safe_res.success: return None
+        print(f"[流水线] 会话 {session_id} 检测到危机，Web 端直接返回危机响应。")
+        state = cls._init_or_load_state(session_id)
+        state.is_crisis = True
+        state.user_type = UserType.CRISIS
+        cls._save_state(session_id, state)
+        result = cls._prepare_crisis_response(safe_res, state)
+        result["outputs"]["处理路径"] = "Web 端快速通道 (未进入任务队列)"
+        return result
+
+    @classmethod
+    def _build_graph(cls) -> list:
+        # 阶段依赖图：next 边与各模块输出的 next_module 一致，after 为额外的数据依赖。
+        # 历史读取不依赖任何分析结果，与安全检测/预处理同时开始；
+        # 情感与用户分析在生成之前完成：模板快速回复与生成策略都依赖本轮分析结果 (关键词扫描已缓存，耗时可忽略)
+        return [
+            Stage("safety", cls._stage_safety, next=("preprocess",), required=True),
+            Stage("context_load", cls._stage_context_load, required=True),
+            Stage("preprocess", cls._stage_preprocess, next=("emotion_analysis",), required=True),
+            Stage("emotion_analysis", cls._stage_emotion_analysis, next=("user_analysis",)),
+            Stage("user_analysis", cls._stage_user_analysis, next=("context_update",)),
+            Stage("semantic_cache", cls._stage_semantic_cache, after=("preprocess", "context_load")),
+            Stage("template_response", cls._stage_template_response, after=("user_analysis", "context_load")),
+            Stage("response_generation", cls._stage_response_generation, after=("context_load", "semantic_cache", "template_response"),
+                  next=("response_optimization",), required=True),
+            Stage("response_optimization", cls._stage_response_optimization, after=("user_analysis",), next=("finalize_response",)),
+        ]
 
+    @classmethod
+    async def _stage_safety(cls, ctx: dict) -> ModuleOutput:
+        # 本轮输入只规范化一次，安全检测、预处理与各分析阶段共用 (关键词扫描结果也缓存在其上)
+        ctx["tokenized"] = TokenizedText(ctx["user_input"])
+        safe_res = SafetyModule.check(ctx["tokenized"])
+        state = ctx["state"]
+        if safe_res.success and state.is_crisis:
+            state.is_crisis = False
+            print("[流水线] 退出危机状态。")
+        # 语义缓存与情感/用户分析并发执行，使用此时的状态快照 (本轮安全结论 + 上一轮分析结果)，不读到分析到一半的状态
+        ctx["turn_state"] = replace(state)
+        return safe_res
 
-        pre_res = PreprocessorModule.process(user_input)
-        outputs["文本预处理输出"] = pre_res.message
-        if not pre_res.success:
-            print("[流水线] 文本预处理失败。")
-            return cls._prepare_fallback_response(pre_res, outputs, session_id)
-        cleaned_text = pre_res.data.get("cleaned_text", user_input)
-        preprocessed_words = pre_res.data.get("words", [])
+    @classmethod
+    async def _stage_context_load(cls, ctx: dict) -> ModuleOutput:
+        session_id = ctx["session_id"]
+        try:
+            conversation_history, history_summary = await asyncio.gather(
+                AsyncRuntimeModule.run_blocking(ContextManagerModule.get_history, session_id),
+                AsyncRuntimeModule.run_blocking(ContextManagerModule.get_summary, session_id))
+        except Exception as e:
+            print(f"[流水线] 获取上下文失败: {e}")
+            return ModuleOutput(False, message=f"获取历史失败: {e}")
+        message = f"获取历史 {len(conversation_history)} 条"
+        if history_summary: message += f" (另有 {history_summary['covered']} 条已折叠为摘要)"
+        return ModuleOutput(True, {"history": conversation_history, "summary": history_summary}, message, next_module="response_generation")
 
+    @classmethod
+    async def _stage_preprocess(cls, ctx: dict) -> ModuleOutput:
+        pre_res = await AsyncRuntimeModule.run_blocking(PreprocessorModule.process, ctx["tokenized"])
+        if not pre_res.success: print("[流水线] 文本预处理失败。")
+        return pre_res
 
-        emo_res = EmotionAnalyzerModule.analyze(cleaned_text)
-        outputs["情感分析输出"] = emo_res.message
+    @classmethod
+    async def _stage_emotion_analysis(cls, ctx: dict) -> ModuleOutput:
+        emo_res = await AsyncRuntimeModule.run_blocking(EmotionAnalyzerModule.analyze, ctx["tokenized"])
+        state = ctx["state"]
         if emo_res.success:
             state.user_emotion = emo_res.data.get("emotion_type", EmotionType.UNKNOWN)
             state.emotion_intensity = emo_res.data.get("emotion_intensity", 0.5)
@@ -58,82 +155,143 @@ class DialoguePipeline:
         else:
             print("[流水线] 情感分析失败（非关键错误，继续）。")
             state.user_emotion = EmotionType.UNKNOWN
+        return emo_res
 
-
-        user_ana_res = UserAnalyzerModule.analyze(cleaned_text, state.user_emotion)
-        outputs["用户分析输出"] = user_ana_res.message
+    @classmethod
+    async def _stage_user_analysis(cls, ctx: dict) -> ModuleOutput:
+        state = ctx["state"]
+        user_ana_res = await AsyncRuntimeModule.run_blocking(UserAnalyzerModule.analyze, ctx["tokenized"], state.user_emotion)
         if user_ana_res.success:
             state.user_type = user_ana_res.data.get("user_type", UserType.UNKNOWN)
             state.cognitive_distortions = user_ana_res.data.get("cognitive_distortions", [])
         else:
              print("[流水线] 用户分析失败（非关键错误，继续）。")
              state.user_type = UserType.UNKNOWN
+        return user_ana_res
 
+    @classmethod
+    async def _stage_semantic_cache(cls, ctx: dict) -> ModuleOutput | None:
+        # 开场轮次先查近重复语义缓存 (危机状态不参与)；不符合条件时跳过
+        conversation_history = ctx["results"]["context_load"].data["history"]
+        if not SemanticCacheModule.is_eligible(ctx["turn_state"], conversation_history): return None
+        provider_name, model_name, _, _ = ResponseGeneratorModule._get_provider_info(ctx["selected_provider"], ctx["selected_model"])
+        semantic_fp = SemanticCacheModule.fingerprint(ctx["tokenized"].tokens or [])
+        if not model_name or semantic_fp is None: return None
+        semantic_hit = await AsyncRuntimeModule.run_blocking(SemanticCacheModule.lookup, semantic_fp, provider_name, model_name)
+        return ModuleOutput(True, {"fingerprint": semantic_fp, "target": (provider_name, model_name), "hit": semantic_hit},
+                            f"命中 (汉明距离 {semantic_hit['distance']})" if semantic_hit else "未命中", next_module="response_generation")
 
-        # Context management might be handled differently now (e.g., in routes or tasks)
-        # Let's assume history needs to be fetched here for response generation
-        try:
-            # Assuming ContextManagerModule now uses Redis/session_id
-            conversation_history = ContextManagerModule.get_history(session_id)
-            outputs["上下文管理输出"] = f"获取历史 {len(conversation_history)} 条"
-        except Exception as e:
-            print(f"[流水线] 获取上下文失败: {e}")
-            # Depending on strategy, either return error or proceed without history
-            # For now, let's assume we need history for the next step
-            return cls._prepare_fallback_response(ModuleOutput(False, message=f"获取历史失败: {e}"), outputs, session_id)
+    @classmethod
+    async def _stage_template_response(cls, ctx: dict) -> ModuleOutput | None:
+        # 问候/能力试探且低风险的轮次直接使用模板回复；不符合条件时跳过
+        template = await AsyncRuntimeModule.run_blocking(TemplateResponderModule.match, ctx["tokenized"], ctx["state"],
+                                                         ctx["results"]["context_load"].data["history"]) # 命中计数写 Redis
+        if not template: return None
+        return ModuleOutput(True, template, f"命中意图 {template['intent']}", next_module="response_generation")
 
+    @classmethod
+    async def _stage_response_generation(cls, ctx: dict) -> ModuleOutput:
+        context_data = ctx["results"]["context_load"].data
+        semantic_res = ctx["results"].get("semantic_cache")
+        semantic = semantic_res.data if semantic_res else {}
+        semantic_hit = semantic.get("hit")
+        template_res = ctx["results"].get("template_response")
+        on_token = ctx["on_token"]
+        if template_res or semantic_hit:
+            response = template_res.data["response"] if template_res else semantic_hit["response"]
+            if on_token:
+                callback_result = on_token(response)
+                if inspect.isawaitable(callback_result): await callback_result
+            if template_res:
+                return ModuleOutput(True, {"raw_response": response, "model_used": f"template/{template_res.data['intent']}"},
+                                    "模板快速回复，跳过模型调用", next_module="response_optimization")
+            return ModuleOutput(True, {"raw_response": response, "model_used": semantic_hit["model_used"]},
+                                "语义缓存命中，跳过模型调用", next_module="response_optimization")
 
-        # Pass necessary parameters to response generator
-        resp_gen_res = ResponseGeneratorModule.generate(
-            user_input, state, conversation_history,
-            selected_provider, selected_model, session_id, temp_keys
+        history_summary = context_data["summary"]
+        # 生成阶段在用户分析之后执行：生成策略、提示词变体与模型档位都按本轮的分析结果决定
+        policy = GenerationPolicyModule.select(ctx["state"], ctx["user_input"])
+        resp_gen_res = await ResponseGeneratorModule.agenerate(
+            ctx["user_input"], ctx["state"], context_data["history"],
+            ctx["selected_provider"], ctx["selected_model"], ctx["session_id"], ctx["temp_keys"],
+            on_token=on_token,
+            history_summary=history_summary["summary"] if history_summary else None,
+            policy=policy
         )
-        outputs["大模型生成输出"] = resp_gen_res.message
-        outputs["模型"] = resp_gen_res.data.get("model_used", "?") # Added from other version
-        if not resp_gen_res.success:
-            print("[流水线] 大模型生成失败。")
-            return cls._prepare_fallback_response(resp_gen_res, outputs, session_id)
-        raw_response = resp_gen_res.data.get("raw_response", "抱歉，我暂时无法回应。")
-
-
-        opt_res = ResponseOptimizerModule.optimize(raw_response, state)
-        outputs["回复优化输出"] = opt_res.message
-        final_response = raw_response # Default to raw if optimization fails
-        if opt_res.success:
-             final_response = opt_res.data.get("optimized_response", final_response)
-             if opt_res.data.get("thought_content"): outputs["思考链"] = opt_res.data["thought_content"] # Added from other version
-        else:
-             print("[流水线] 回复优化失败（非关键错误，使用原始回复）。")
-             # Try basic cleanup even on failure
-             try:
-                 thought_content = ""; cleaned_response = raw_response.strip()
-                 match = ResponseOptimizerModule.COT_REGEX.search(cleaned_response) # Assume regex is defined in optimizer
-                 if match:
-                     thought_content = match.group(1).strip()
-                     cleaned_response = ResponseOptimizerModule.COT_REGEX.sub('', cleaned_response).strip()
-                 if thought_content: outputs["思考链"] = thought_content
-                 cleaned_response = ResponseOptimizerModule.RESPONSE_START_TAG_REGEX.sub('', cleaned_response).strip() # Assume regex is defined
-                 cleaned_response = ResponseOptimizerModule.RESPONSE_END_TAG_REGEX.sub('', cleaned_response).strip() # Assume regex is defined
-                 final_response = cleaned_response.replace("\n", "<br>").strip()
-             except Exception as e_clean:
-                 print(f"清理标签出错: {e_clean}")
-                 final_response = raw_response.replace("\n", "<br>").strip()
+        # 降级到其他模型时不写入主模型的语义缓存
+        semantic_target = semantic.get("target")
+        if resp_gen_res.success and semantic_target and resp_gen_res.data.get("model_used") == "/".join(semantic_target):
+            await AsyncRuntimeModule.run_blocking(SemanticCacheModule.store, semantic["fingerprint"], *semantic_target,
+                                                  resp_gen_res.data.get("raw_response", ""))
+        if not resp_gen_res.success: print("[流水线] 大模型生成失败。")
+        return resp_gen_res
 
+    @classmethod
+    async def _stage_response_optimization(cls, ctx: dict) -> ModuleOutput:
+        raw_response = ctx["results"]["response_generation"].data.get("raw_response", "抱歉，我暂时无法回应。")
+        opt_res = ResponseOptimizerModule.optimize(raw_response, ctx["state"])
+        if opt_res.success: return opt_res
 
-        state.session_turn_count += 1
-        cls._save_state(session_id, state)
+        print("[流水线] 回复优化失败（非关键错误，使用原始回复）。")
+        # Try basic cleanup even on failure
+        thought_content = ""
+        try:
+            cleaned_response = raw_response.strip()
+            match = ResponseOptimizerModule.COT_REGEX.search(cleaned_response) # Assume regex is defined in optimizer
+            if match:
+                thought_content = match.group(1).strip()
+                cleaned_response = ResponseOptimizerModule.COT_REGEX.sub('', cleaned_response).strip()
+            cleaned_response = ResponseOptimizerModule.RESPONSE_START_TAG_REGEX.sub('', cleaned_response).strip() # Assume regex is defined
+            cleaned_response = ResponseOptimizerModule.RESPONSE_END_TAG_REGEX.sub('', cleaned_response).strip() # Assume regex is defined
+            final_response = cleaned_response.replace("\n", "<br>").strip()
+        except Exception as e_clean:
+            print(f"清理标签出错: {e_clean}")
+            final_response = raw_response.replace("\n", "<br>").strip()
+        return ModuleOutput(True, {"optimized_response": final_response, "thought_content": thought_content},
+                            opt_res.message, next_module="finalize_response")
 
-        state_dict = cls._get_state_dict(state)
-        outputs["会话报告输出"] = f"轮次:{state_dict.get('session_turn_count')}, 类型:{state_dict.get('user_type')}, 情绪:{state_dict.get('user_emotion')}"
-        return {
-            "success": True,
-            "response": final_response,
-            "state": state_dict,
-            "outputs": outputs
-        }
+    @classmethod
+    def _collect_outputs(cls, results: dict) -> dict:
+        # 按固定顺序整理各阶段的输出信息 (阶段并发完成，顺序不固定)
+        outputs = {}
+        for stage_name, label in (("safety", "安全检测输出"), ("preprocess", "文本预处理输出"), ("emotion_analysis", "情感分析输出"),
+                                  ("user_analysis", "用户分析输出"), ("context_load", "上下文管理输出"), ("semantic_cache", "语义缓存"),
+                                  ("template_response", "模板快速回复")):
+            if results.get(stage_name) is not None: outputs[label] = results[stage_name].message
+        if outputs.get("语义缓存") == "未命中": del outputs["语义缓存"]
+
+        resp_gen_res = results.get("response_generation")
+        if resp_gen_res is None: return outputs
+        outputs["大模型生成输出"] = resp_gen_res.message
+        outputs["模型"] = resp_gen_res.data.get("model_used", "?") # Added from other version
+        tier = resp_gen_res.data.get("tier")
+        if tier and tier.get("managed"): # 配置了降级模型时显示当前档位
+            if tier["tier"] == "fallback": outputs["模型"] += f" [降级档: 主模型 {tier['primary']} 超出延迟目标, p95={tier['p95']}秒]"
+            else: outputs["模型"] += f" [主档{' (探测)' if tier.get('probe') else ''}]"
+        call_stats = resp_gen_res.data.get("call_stats") or {}
+        if "total_ms" in call_stats: outputs["本地模型耗时"] = OllamaAdapterModule.format_stats(call_stats)
+        if "rate_limit_wait_ms" in call_stats: outputs["限流等待"] = f"{call_stats['rate_limit_wait_ms']}ms"
+        context_stats = resp_gen_res.data.get("context")
+        if context_stats:
+            outputs["上下文窗口"] = (f"保留 {context_stats['kept']} 条 / {context_stats['history_tokens']} tokens (预算 {context_stats['budget']})"
+                                 f", 丢弃 {context_stats['dropped']} 条{', 最新消息已截断' if context_stats['truncated'] else ''}")
+        generation = resp_gen_res.data.get("generation")
+        if generation:
+            outputs["生成策略"] = (f"{generation['policy']}: 预算 {generation['max_tokens']} tokens, 实际 {generation['completion_tokens']} tokens"
+                               f"{' (达到上限)' if generation['truncated'] else ''}")
+        hedge = resp_gen_res.data.get("hedge")
+        if hedge:
+            outputs["请求对冲"] = (f"本轮{'已触发' if hedge['fired'] else '未触发'} (阈值 {hedge['delay']}秒)"
+                                 f"{', 备用获胜' if hedge['won'] else ''}; 累计触发 {hedge.get('total_fired', '?')} 次, 备用获胜 {hedge.get('total_won', '?')} 次")
 
-    @staticmethod
-    def _init_or_load_state(session_id: str) -> DialogueState:
+        opt_res = results.get("response_optimization")
+        if opt_res is not None:
+            outputs["回复优化输出"] = opt_res.message
+            if opt_res.data.get("thought_content"): outputs["思考链"] = opt_res.data["thought_content"] # Added from other version
+        return outputs
+
+    @classmethod
+    def _init_or_load_state(cls, session_id: str) -> DialogueState:
         state_key = f"dialogue_state_{session_id}"
         if state_key in session:
             try:
@@ -152,8 +310,8 @@ class DialoguePipeline:
                  print(f"[警告] 加载会话 {session_id} 状态失败: {e}, 将使用默认状态。")
         return DialogueState()
 
-    @staticmethod
-    def _save_state(session_id: str, state: DialogueState):
+    @classmethod
+    def _save_state(cls, session_id: str, state: DialogueState):
         state_key = f"dialogue_state_{session_id}"
         try:
             session[state_key] = cls._get_state_dict(state)
@@ -162,8 +320,8 @@ class DialoguePipeline:
             print(f"[错误] 保存状态到 Session 失败: {e}")
 
 
-    @staticmethod
-    def _get_state_dict(state: DialogueState) -> dict:
+    @classmethod
+    def _get_state_dict(cls, state: DialogueState) -> dict:
          if not isinstance(state, DialogueState): return {"error": "Invalid state"}
          return {
             "user_type": getattr(state.user_type, 'value', UserType.UNKNOWN.value),
@@ -176,8 +334,8 @@ class DialoguePipeline:
             "dialogue_goals": getattr(state, 'dialogue_goals', [])
          }
 
-    @staticmethod
-    def _prepare_crisis_response(safe_res: ModuleOutput, state: DialogueState) -> dict:
+    @classmethod
+    def _prepare_crisis_response(cls, safe_res: ModuleOutput, state: DialogueState) -> dict:
         state_dict = cls._get_state_dict(state)
         return {
             "success": False,
@@ -186,8 +344,8 @@ class DialoguePipeline:
             "outputs": {"安全检测输出": safe_res.message, "响应": "危机处理流程"}
         }
 
-    @staticmethod
-    def _prepare_fallback_response(fail_res: ModuleOutput, outputs: dict, session_id: str | None) -> dict:
+    @classmethod
+    def _prepare_fallback_response(cls, fail_res: ModuleOutput, outputs: dict, session_id: str | None = None) -> dict:
         fallback_msg = "抱歉，处理时遇到问题，请稍后再试。"
         outputs["错误"] = f"失败: {fail_res.message}"
         current_state_dict = {}
@@ -1,6 +1,6 @@
 # D:\python_code\LocalAgent\modules\emotion_analyzer_module.py
-from modules.common import ModuleOutput, EmotionType
-import re
+from modules.common import ModuleOutput, EmotionType, TokenizedText
+from modules.lexicon_module import LexiconModule
 
 class EmotionAnalyzerModule:
     """
@@ -27,20 +27,14 @@ class EmotionAnalyzerModule:
     }
     # 中性/疑惑类关键词可以放在 UserAnalyzerModule 处理意图 (Neutral/Confused keywords can be handled in UserAnalyzerModule for intent)
 
-    # 编译正则表达式以提高效率 (Compile regex for efficiency)
-    EMOTION_REGEX = {
-        etype: re.compile(r'\b(?:' + '|'.join(re.escape(k) for k in kws) + r')\b', re.IGNORECASE)
-        for etype, kws in EMOTION_KEYWORDS.items()
-    }
-
     @classmethod
-    def analyze(cls, text: str) -> ModuleOutput:
+    def analyze(cls, text: str | TokenizedText) -> ModuleOutput:
         """
         分析文本中的主要情绪。
         (Analyzes the primary emotion in the text.)
 
         Args:
-            text (str): 用户输入文本 (User input text).
+            text (str | TokenizedText): 用户输入文本，或预处理后的分词文本 (User input text, or the per-turn tokenized text).
 
         Returns:
             ModuleOutput: 包含识别出的情绪类型和强度（简单估计）。
@@ -50,9 +44,13 @@ class EmotionAnalyzerModule:
         highest_intensity = 0.5 # 基础强度 (Base intensity)
         primary_emotion = EmotionType.NEUTRAL # 默认情绪 (Default emotion)
         detected_keywords = []
+        # 共享词表的一次扫描结果中属于情感的部分 {情绪类型值: [命中关键词, ...]}
+        # (Emotion slice of the shared single-pass lexicon scan)
+        emotion_hits = LexiconModule.scan(text).by_category("emotion")
+        if isinstance(text, TokenizedText): text = text.normalized # 标点判断使用规范化文本 (全角标点已转半角)
 
         # 检查是否包含危机情绪关键词 (Check for crisis emotion keywords first)
-        crisis_match = cls.EMOTION_REGEX[EmotionType.CRISIS].findall(text)
+        crisis_match = emotion_hits.get(EmotionType.CRISIS.value, [])
         if crisis_match:
             primary_emotion = EmotionType.CRISIS
             highest_intensity = 1.0
@@ -65,9 +63,9 @@ class EmotionAnalyzerModule:
                                 next_module="user_analysis") # 继续分析用户类型 (Continue to analyze user type)
 
         # 查找其他情绪关键词 (Find other emotion keywords)
-        for etype, regex in cls.EMOTION_REGEX.items():
+        for etype in cls.EMOTION_KEYWORDS:
             if etype == EmotionType.CRISIS: continue # 跳过危机类别 (Skip crisis category here)
-            matches = regex.findall(text)
+            matches = emotion_hits.get(etype.value, [])
             if matches:
                 detected_emotions[etype] = len(matches) # 记录匹配次数 (Record match count)
                 detected_keywords.extend(matches)
@@ -103,3 +101,6 @@ class EmotionAnalyzerModule:
                             {"emotion_type": primary_emotion, "emotion_intensity": round(highest_intensity, 2), "keywords": list(set(detected_keywords))},
                             f"情感: {primary_emotion.value} (强度: {round(highest_intensity, 2)})",
                             next_module="user_analysis") # 指示下一步进行用户类型分析 (Indicate next step is user type analysis)
+
+
+LexiconModule.register("emotion", {etype.value: keywords for etype, keywords in EmotionAnalyzerModule.EMOTION_KEYWORDS.items()})
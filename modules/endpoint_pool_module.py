@@ -0,0 +1,189 @@
+# D:\python_code\LocalAgent\modules\endpoint_pool_module.py
+import random
+import threading
+import time
+import uuid
+from flask import current_app
+from modules.async_runtime_module import AsyncRuntimeModule
+
+
+class EndpointPoolModule:
+    """
+    单个提供者的多端点负载均衡 (如多台 Ollama 主机)。
+    每次调用选择 (在途请求数 + 1) x 平滑耗时 最小的端点；在途请求以 Redis 有序集合记录
+    (成员为请求ID、分值为开始时间)，所有 Celery Worker 共享，Worker 异常退出遗留的记录按超时自动清理。
+    被动健康检查：连续失败达到阈值的端点被摘除一段时间，到期后自动恢复参与调度 (首个请求即为探测)。
+    只配置一个端点时不做任何记录，直接使用该端点。
+    """
+    _local_inflight: dict = {} # (provider, url) -> 在途数 (Redis 不可用时)
+    _local_latency: dict = {} # (provider, url) -> 平滑耗时
+    _local_fails: dict = {} # (provider, url) -> 连续失败次数
+    _local_ejected: dict = {} # (provider, url) -> 恢复时间
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get_redis_client(cls):
+        return getattr(current_app, 'redis_client', None)
+
+    @staticmethod
+    def get_endpoints(provider: str, default_url: str | None = None) -> list[str]:
+        # 提供者的全部端点：AVAILABLE_PROVIDERS 中的 "endpoints"，否则为单个 url
+        provider_config = current_app.config.get('AVAILABLE_PROVIDERS', {}).get(provider, {})
+        endpoints = [u for u in provider_config.get("endpoints") or [] if u]
+        if endpoints: return endpoints
+        url = default_url or provider_config.get("url")
+        return [url] if url else []
+
+    @staticmethod
+    def _keys(provider: str, url: str) -> tuple[str, str, str]:
+        return f"lb:{provider}:inflight:{url}", f"lb:{provider}:ejected:{url}", f"lb:{provider}:fails"
+
+    @classmethod
+    def _snapshot(cls, provider: str, endpoints: list[str]) -> dict:
+        # 读取各端点 {url: (在途数, 平滑耗时, 是否摘除)}
+        redis = cls._get_redis_client()
+        stale_before = time.time() - current_app.config.get('LLM_REQUEST_TIMEOUT', 120) * 2
+        if redis is not None:
+            try:
+                pipe = redis.pipeline()
+                for url in endpoints:
+                    inflight_key, ejected_key, _ = cls._keys(provider, url)
+                    pipe.zremrangebyscore(inflight_key, 0, stale_before) # 清理异常退出遗留的在途记录
+                    pipe.zcard(inflight_key)
+                    pipe.exists(ejected_key)
+                pipe.hgetall(f"lb:{provider}:latency")
+                results = pipe.execute()
+                latencies = results[-1]
+                snapshot = {}
+                for i, url in enumerate(endpoints):
+                    inflight, ejected = results[i * 3 + 1], results[i * 3 + 2]
+                    latency = float(latencies[url]) if url in latencies else None
+                    snapshot[url] = (inflight, latency, bool(ejected))
+                return snapshot
+            except Exception as e:
+                print(f"[端点池] 读取 Redis 状态失败，使用进程内状态: {e}")
+        now = time.monotonic()
+        with cls._lock:
+            return {url: (cls._local_inflight.get((provider, url), 0),
+                          cls._local_latency.get((provider, url)),
+                          cls._local_ejected.get((provider, url), 0) > now) for url in endpoints}
+
+    @classmethod
+    def acquire(cls, provider: str, default_url: str) -> tuple[str, str | None]:
+        # 选择端点并登记在途请求，返回 (端点URL, 租约ID)；单端点时租约ID为 None
+        endpoints = cls.get_endpoints(provider, default_url)
+        if len(endpoints) <= 1: return (endpoints[0] if endpoints else default_url), None
+
+        snapshot = cls._snapshot(provider, endpoints)
+        candidates = [url for url in endpoints if not snapshot[url][2]] or endpoints # 全部被摘除时仍需尝试
+        known = [snapshot[url][1] for url in candidates if snapshot[url][1] is not None]
+        default_latency = min(known) if known else 1.0 # 新端点按已知最快估计，让它尽快获得样本
+
+        def _score(url):
+            inflight, latency, _ = snapshot[url]
+            return (inflight + 1) * (latency if latency is not None else default_latency)
+        best_score = min(_score(url) for url in candidates)
+        url = random.choice([u for u in candidates if _score(u) == best_score])
+
+        lease_id = uuid.uuid4().hex
+        redis = cls._get_redis_client()
+        try:
+            if redis is None: raise RuntimeError("Redis 不可用")
+            redis.zadd(cls._keys(provider, url)[0], {lease_id: time.time()})
+        except Exception:
+            with cls._lock: cls._local_inflight[(provider, url)] = cls._local_inflight.get((provider, url), 0) + 1
+            lease_id = f"local:{lease_id}"
+        return url, lease_id
+
+    @classmethod
+    def release(cls, provider: str, url: str, lease_id: str | None, elapsed: float, healthy: bool):
+        # 结束在途请求，更新平滑耗时与连续失败计数 (达到阈值则摘除端点)
+        if lease_id is None: return
+        config = current_app.config
+        alpha = config.get('ENDPOINT_LATENCY_ALPHA', 0.3)
+        max_fails = config.get('ENDPOINT_EJECT_FAILURES', 3)
+        eject_seconds = config.get('ENDPOINT_EJECT_SECONDS', 30)
+        redis = cls._get_redis_client()
+        inflight_key, ejected_key, fails_key = cls._keys(provider, url)
+
+        if redis is not None and not lease_id.startswith("local:"):
+            try:
+                pipe = redis.pipeline()
+                pipe.zrem(inflight_key, lease_id)
+                pipe.hget(f"lb:{provider}:latency", url)
+                if healthy: pipe.hdel(fails_key, url)
+                else: pipe.hincrby(fails_key, url, 1)
+                results = pipe.execute()
+                if healthy:
+                    previous = float(results[1]) if results[1] is not None else elapsed
+                    redis.hset(f"lb:{provider}:latency", url, f"{alpha * elapsed + (1 - alpha) * previous:.3f}")
+                elif results[2] >= max_fails:
+                    redis.pipeline().setex(ejected_key, eject_seconds, 1).hdel(fails_key, url).execute()
+                    print(f"[端点池] {provider} 端点 {url} 连续失败 {results[2]} 次，摘除 {eject_seconds} 秒")
+                return
+            except Exception as e:
+                print(f"[端点池] 更新 Redis 状态失败: {e}")
+
+        key = (provider, url)
+        with cls._lock:
+            if lease_id.startswith("local:"): cls._local_inflight[key] = max(0, cls._local_inflight.get(key, 0) - 1)
+            if healthy:
+                previous = cls._local_latency.get(key, elapsed)
+                cls._local_latency[key] = alpha * elapsed + (1 - alpha) * previous
+                cls._local_fails.pop(key, None)
+            else:
+                cls._local_fails[key] = cls._local_fails.get(key, 0) + 1
+                if cls._local_fails[key] >= max_fails:
+                    cls._local_ejected[key] = time.monotonic() + eject_seconds
+                    cls._local_fails.pop(key, None)
+                    print(f"[端点池] {provider} 端点 {url} 连续失败 {max_fails} 次，摘除 {eject_seconds} 秒")
+
+    @classmethod
+    def call(cls, provider: str, default_url: str, fn, is_unhealthy=lambda result: False):
+        # 选择端点执行 fn(url)，结束后登记耗时与健康状态
+        url, lease_id = cls.acquire(provider, default_url)
+        started = time.monotonic(); healthy = None
+        try:
+            result = fn(url)
+            healthy = not is_unhealthy(result)
+            return result
+        finally:
+            if lease_id is not None:
+                if healthy is None: cls._drop(provider, url, lease_id)
+                else: cls.release(provider, url, lease_id, time.monotonic() - started, healthy)
+
+    @classmethod
+    async def acall(cls, provider: str, default_url: str, coro_fn, is_unhealthy=lambda result: False):
+        # call 的 asyncio 版本 (被取消时同样释放在途记录，但不计入失败)
+        url, lease_id = await AsyncRuntimeModule.run_blocking(cls.acquire, provider, default_url)
+        started = time.monotonic(); healthy = None
+        try:
+            result = await coro_fn(url)
+            healthy = not is_unhealthy(result)
+            return result
+        finally:
+            if lease_id is not None:
+                if healthy is None:
+                    await AsyncRuntimeModule.run_blocking(cls._drop, provider, url, lease_id)
+                else:
+                    await AsyncRuntimeModule.run_blocking(cls.release, provider, url, lease_id, time.monotonic() - started, healthy)
+
+    @classmethod
+    def _drop(cls, provider: str, url: str, lease_id: str):
+        # 仅移除在途记录 (请求被取消或异常中断)
+        redis = cls._get_redis_client()
+        if redis is not None and not lease_id.startswith("local:"):
+            try: redis.zrem(cls._keys(provider, url)[0], lease_id); return
+            except Exception as e: print(f"[端点池] 更新 Redis 状态失败: {e}")
+        with cls._lock:
+            key = (provider, url)
+            if lease_id.startswith("local:"): cls._local_inflight[key] = max(0, cls._local_inflight.get(key, 0) - 1)
+
+    @classmethod
+    def get_status(cls, provider: str) -> dict:
+        # 各端点当前状态 (用于调试展示)
+        endpoints = cls.get_endpoints(provider)
+        snapshot = cls._snapshot(provider, endpoints) if len(endpoints) > 1 else {}
+        return {url: {"inflight": snapshot.get(url, (0, None, False))[0],
+                      "latency": snapshot.get(url, (0, None, False))[1],
+                      "ejected": snapshot.get(url, (0, None, False))[2]} for url in endpoints}
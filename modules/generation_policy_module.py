@@ -0,0 +1,100 @@
+# D:\python_code\LocalAgent\modules\generation_policy_module.py
+from flask import current_app
+from modules.common import DialogueState, UserType, EmotionType
+from modules.token_counter_module import TokenCounterModule
+
+
+class GenerationPolicyModule:
+    """
+    生成策略：按 DialogueState (用户类型、情绪、情绪强度、轮次) 与本轮消息长度，
+    从 GENERATION_POLICIES 表中选出第一条匹配的规则，决定 max_tokens、temperature、停止序列，
+    以及可选的提供者/模型。未匹配任何规则时使用 GENERATION_POLICY_DEFAULT。
+    每次调用后记录预算与实际输出 token 数，按策略累计到 Redis，通过 /api/cache_stats 查看。
+    """
+    STATS_KEY = "generation_policy:stats"
+    DEFAULT_NAME = "default"
+
+    @classmethod
+    def _defaults(cls) -> dict:
+        config = current_app.config
+        policy = {"name": cls.DEFAULT_NAME, "max_tokens": config.get('LLM_MAX_TOKENS', 1500), "temperature": 0.7, "stop": []}
+        policy.update(config.get('GENERATION_POLICY_DEFAULT', {}))
+        return policy
+
+    @staticmethod
+    def _matches(when: dict, state: DialogueState, user_input: str | None) -> bool:
+        # 规则条件全部满足才算匹配；未写的条件不限制
+        is_crisis = state.is_crisis or state.user_type == UserType.CRISIS or state.user_emotion == EmotionType.CRISIS
+        if "crisis" in when and bool(when["crisis"]) != is_crisis: return False
+        if "user_types" in when and getattr(state.user_type, 'value', None) not in when["user_types"]: return False
+        if "emotions" in when and getattr(state.user_emotion, 'value', None) not in when["emotions"]: return False
+        if "min_intensity" in when and state.emotion_intensity < when["min_intensity"]: return False
+        if "max_intensity" in when and state.emotion_intensity > when["max_intensity"]: return False
+        if "min_turns" in when and state.session_turn_count < when["min_turns"]: return False
+        if "max_turns" in when and state.session_turn_count > when["max_turns"]: return False
+        if "max_input_chars" in when and len((user_input or "").strip()) > when["max_input_chars"]: return False
+        return True
+
+    @classmethod
+    def select(cls, state: DialogueState | None, user_input: str | None = None) -> dict:
+        # 返回 {"name", "max_tokens", "temperature", "stop", 可选 "provider"/"model"}
+        policy = cls._defaults()
+        if state is None or not current_app.config.get('GENERATION_POLICY_ENABLED', True): return policy
+        for rule in current_app.config.get('GENERATION_POLICIES', []):
+            if not cls._matches(rule.get("when", {}), state, user_input): continue
+            policy.update({key: value for key, value in rule.items() if key != "when"})
+            break
+        return policy
+
+    @staticmethod
+    def request_params(policy: dict | None) -> dict:
+        # 请求体中的生成参数 (未传策略时保持原有的默认值)
+        if not policy:
+            return {"max_tokens": current_app.config.get('LLM_MAX_TOKENS', 1500), "temperature": 0.7, "stop": []}
+        return {"max_tokens": policy.get("max_tokens"), "temperature": policy.get("temperature", 0.7), "stop": list(policy.get("stop") or [])}
+
+    @classmethod
+    def record(cls, policy: dict, model: str, raw_response: str, success: bool, call_stats: dict | None = None) -> dict:
+        # 记录本次调用的预算与实际输出 token 数，返回写入模块输出的摘要
+        # 实际数优先取提供者返回的 eval_count (Ollama 原生模式)，否则按模型家族估算
+        actual = (call_stats or {}).get("eval_count") or TokenCounterModule.count(raw_response or "", TokenCounterModule.family(model))
+        budget = policy.get("max_tokens") or 0
+        truncated = bool(budget) and actual >= budget
+        summary = {"policy": policy.get("name", cls.DEFAULT_NAME), "max_tokens": budget, "completion_tokens": actual, "truncated": truncated}
+        print(f"[生成策略] {summary['policy']}: 预算 {budget} tokens, 实际 {actual} tokens{' (达到上限)' if truncated else ''}")
+        if success: cls._accumulate(summary)
+        return summary
+
+    @classmethod
+    def _accumulate(cls, summary: dict):
+        redis = getattr(current_app, 'redis_client', None)
+        if redis is None: return
+        name = summary["policy"]
+        try:
+            pipe = redis.pipeline()
+            pipe.hincrby(cls.STATS_KEY, f"{name}:calls", 1)
+            pipe.hincrby(cls.STATS_KEY, f"{name}:budget", summary["max_tokens"])
+            pipe.hincrby(cls.STATS_KEY, f"{name}:used", summary["completion_tokens"])
+            if summary["truncated"]: pipe.hincrby(cls.STATS_KEY, f"{name}:truncated", 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"[生成策略] 更新统计失败: {e}")
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        # 按策略：调用次数、平均预算、平均实际输出、预算利用率、达到上限的比例
+        redis = getattr(current_app, 'redis_client', None)
+        if redis is None: return {}
+        try: raw = {k: int(v) for k, v in redis.hgetall(cls.STATS_KEY).items()}
+        except Exception as e:
+            print(f"[生成策略] 读取统计失败: {e}"); return {}
+        stats = {}
+        for field, value in raw.items():
+            name, metric = field.rsplit(":", 1)
+            stats.setdefault(name, {"calls": 0, "budget": 0, "used": 0, "truncated": 0})[metric] = value
+        for name, entry in stats.items():
+            calls = entry["calls"] or 1
+            entry.update(avg_budget=round(entry["budget"] / calls, 1), avg_used=round(entry["used"] / calls, 1),
+                         utilization=round(entry["used"] / entry["budget"], 4) if entry["budget"] else 0.0,
+                         truncated_rate=round(entry["truncated"] / calls, 4))
+        return stats
@@ -0,0 +1,85 @@
+# D:\python_code\LocalAgent\modules\latency_stats_module.py
+import threading
+from collections import deque
+from flask import current_app
+
+
+class LatencyStatsModule:
+    """
+    按 (提供者, 模型) 记录最近 N 次 LLM 调用耗时，并计算分位数。
+    样本存放在 Redis 列表中 (LPUSH + LTRIM)，所有 Worker 共享同一窗口；Redis 不可用时退回进程内窗口。
+    kind 区分指标："total" 为整次调用耗时，"first_token" 为流式首个片段到达耗时。
+    """
+    _local: dict = {} # (kind, provider, model) -> deque
+    _local_seq: dict = {} # (kind, provider, model) -> 累计记录次数
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get_redis_client(cls):
+        return getattr(current_app, 'redis_client', None)
+
+    @staticmethod
+    def _key(kind: str, provider: str, model: str) -> str:
+        return f"latency:{kind}:{provider}/{model}"
+
+    @staticmethod
+    def _seq_key(kind: str, provider: str, model: str) -> str:
+        return f"latency:seq:{kind}:{provider}/{model}"
+
+    @classmethod
+    def record(cls, provider: str, model: str, seconds: float, kind: str = "total"):
+        # 记录一次耗时样本
+        window = current_app.config.get('LATENCY_WINDOW', 200)
+        with cls._lock:
+            samples = cls._local.setdefault((kind, provider, model), deque(maxlen=window))
+            samples.append(seconds)
+            cls._local_seq[(kind, provider, model)] = cls._local_seq.get((kind, provider, model), 0) + 1
+        redis = cls._get_redis_client()
+        if redis is None: return
+        key = cls._key(kind, provider, model)
+        try:
+            pipe = redis.pipeline()
+            pipe.lpush(key, f"{seconds:.3f}")
+            pipe.ltrim(key, 0, window - 1)
+            pipe.incr(cls._seq_key(kind, provider, model)) # 累计序号，用于统计某一时刻之后新增的样本数
+            pipe.execute()
+        except Exception as e:
+            print(f"[耗时统计] 写入 Redis 失败: {e}")
+
+    @classmethod
+    def samples(cls, provider: str, model: str, kind: str = "total", limit: int | None = None) -> list[float]:
+        # 读取窗口内的样本 (优先 Redis 全局窗口)；limit 为只取最近的若干个
+        if limit is not None and limit <= 0: return []
+        redis = cls._get_redis_client()
+        if redis is not None:
+            try: return [float(v) for v in redis.lrange(cls._key(kind, provider, model), 0, -1 if limit is None else limit - 1)]
+            except Exception as e: print(f"[耗时统计] 读取 Redis 失败: {e}")
+        with cls._lock:
+            samples = list(cls._local.get((kind, provider, model), ()))
+        return samples if limit is None else samples[-limit:]
+
+    @classmethod
+    def recorded(cls, provider: str, model: str, kind: str = "total") -> int:
+        # 累计记录的样本数 (不受窗口大小限制)，两次读取之差即为期间新增的样本数
+        redis = cls._get_redis_client()
+        if redis is not None:
+            try: return int(redis.get(cls._seq_key(kind, provider, model)) or 0)
+            except Exception as e: print(f"[耗时统计] 读取 Redis 失败: {e}")
+        with cls._lock:
+            return cls._local_seq.get((kind, provider, model), 0)
+
+    @staticmethod
+    def percentile(samples: list[float], q: float) -> float | None:
+        # 最近秩法分位数，q 取 0~1
+        if not samples: return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+        return ordered[index]
+
+    @classmethod
+    def get_percentiles(cls, provider: str, model: str, kind: str = "total", quantiles=(0.5, 0.95), limit: int | None = None) -> dict:
+        # 返回 {"count": N, "p50": ..., "p95": ...}；limit 为只统计最近的若干个样本
+        samples = cls.samples(provider, model, kind, limit)
+        result = {"count": len(samples)}
+        for q in quantiles: result[f"p{int(q * 100)}"] = cls.percentile(samples, q)
+        return result
@@ -0,0 +1,170 @@
+# D:\python_code\LocalAgent\modules\lexicon_module.py
+import re
+import threading
+from collections import OrderedDict, deque, namedtuple
+from modules.common import TokenizedText
+
+# 一次命中：类别 ("命名空间:类别")、词表中的原始关键词、在被扫描文本 (TokenizedText.normalized) 中的起始位置
+Hit = namedtuple("Hit", ["category", "keyword", "offset"])
+
+
+class LexiconHits:
+    """ 一次扫描的全部命中 (按位置排序)，各模块按命名空间读取自己的部分 """
+
+    def __init__(self, hits: list):
+        self.hits = hits
+
+    def slice(self, namespace: str) -> list:
+        # 某命名空间的命中，类别去掉命名空间前缀
+        prefix = namespace + ":"
+        return [Hit(h.category[len(prefix):], h.keyword, h.offset) for h in self.hits if h.category.startswith(prefix)]
+
+    def by_category(self, namespace: str) -> dict:
+        # {类别: [命中关键词, ...]}
+        grouped = {}
+        for hit in self.slice(namespace): grouped.setdefault(hit.category, []).append(hit.keyword)
+        return grouped
+
+
+class LexiconModule:
+    """
+    多模式关键词匹配：安全、情感、用户分析三个模块的词表编译成一个 Aho-Corasick 自动机，
+    一次 O(n) 扫描返回全部 (类别, 关键词, 位置)。按子串匹配，不依赖 \\b (中文字符之间没有词边界)。
+    词表语法：
+    - "活不下去了?" : 末尾字符可选 (匹配 "活不下去" 与 "活不下去了")；
+    - "要么...要么" / "我感觉.*所以.*" / "我就是个(.*?)者" : 片段按顺序出现即命中，中间可有任意内容。
+    各模块在导入时调用 register 注册词表，注册后自动机在下次扫描时重建。
+    """
+    GAP_REGEX = re.compile(r'\.\.\.|\(\.\*\?\)|\.\*')
+    _lexicons: dict = {}      # 命名空间 -> {类别: [关键词, ...]}
+    _automaton = None         # (goto, fail, output, 模式表)
+    _lock = threading.Lock()
+    _memo: OrderedDict = OrderedDict() # 最近扫描过的文本 -> LexiconHits (同一轮多个模块共用一次扫描)
+    MEMO_SIZE = 256
+
+    @classmethod
+    def register(cls, namespace: str, lexicon: dict):
+        # 注册 (或替换) 一个命名空间的词表 {类别: [关键词, ...]}
+        with cls._lock:
+            cls._lexicons[namespace] = {str(category): list(keywords) for category, keywords in lexicon.items()}
+            cls._automaton = None
+            cls._memo.clear()
+
+    @classmethod
+    def export(cls) -> dict:
+        # 当前注册的全部词表 {命名空间: {类别: [关键词, ...]}}，供子进程 (spawn 启动时不会执行注册代码) 原样注册
+        with cls._lock:
+            return {namespace: {category: list(keywords) for category, keywords in lexicon.items()}
+                    for namespace, lexicon in cls._lexicons.items()}
+
+    @classmethod
+    def _parse(cls, keyword: str) -> list:
+        # 关键词 -> 可选形式列表，每种形式是按顺序出现的片段列表
+        fragments = [f for f in cls.GAP_REGEX.split(keyword.lower()) if f]
+        if not fragments: return []
+        last = fragments[-1]
+        if last.endswith("?") and len(last) > 1:
+            fragments[-1] = last[:-1]
+            shorter = last[:-2]
+            forms = [fragments]
+            if shorter: forms.append(fragments[:-1] + [shorter])
+            return forms
+        return [fragments]
+
+    @classmethod
+    def _build(cls):
+        # 构建 goto / fail / output 表；output[状态] = [(模式编号, 片段序号, 片段长度), ...]
+        goto, fail, output = [{}], [0], [[]]
+        patterns = [] # 模式编号 -> (类别, 原始关键词, 片段数)
+        for namespace, lexicon in cls._lexicons.items():
+            for category, keywords in lexicon.items():
+                for keyword in keywords:
+                    for fragments in cls._parse(keyword):
+                        pattern_id = len(patterns)
+                        patterns.append((f"{namespace}:{category}", keyword.rstrip("?"), len(fragments)))
+                        for index, fragment in enumerate(fragments):
+                            state = 0
+                            for char in fragment:
+                                if char not in goto[state]:
+                                    goto.append({}); fail.append(0); output.append([])
+                                    goto[state][char] = len(goto) - 1
+                                state = goto[state][char]
+                            output[state].append((pattern_id, index, len(fragment)))
+
+        queue = deque(goto[0].values()) # 第一层的失败指针指向根
+        while queue: # 按层构建失败指针，并合并后缀状态的输出
+            state = queue.popleft()
+            for char, child in goto[state].items():
+                queue.append(child)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]: fallback = fail[fallback]
+                fail[child] = goto[fallback].get(char, 0)
+                output[child] = output[child] + output[fail[child]]
+        return goto, fail, output, patterns
+
+    @classmethod
+    def _get_automaton(cls):
+        automaton = cls._automaton
+        if automaton is None:
+            with cls._lock:
+                if cls._automaton is None: cls._automaton = cls._build()
+                automaton = cls._automaton
+        return automaton
+
+    @classmethod
+    def patterns(cls) -> list:
+        # 全部 (类别, 关键词)，去重并保持注册顺序 (批量分析以此作为命中矩阵的列)
+        _, _, _, patterns = cls._get_automaton()
+        return list(dict.fromkeys((category, keyword) for category, keyword, _ in patterns))
+
+    @classmethod
+    def scan(cls, text: str | TokenizedText, memoize: bool = True) -> LexiconHits:
+        # 扫描文本，返回全部命中 (不区分大小写)；TokenizedText 扫描其 normalized 形式，结果缓存在该对象上
+        # 批量离线分析传 memoize=False，避免大量一次性文本挤占缓存
+        if isinstance(text, TokenizedText):
+            return text.memo("lexicon", lambda: cls.scan(text.normalized, memoize))
+        if not text: return LexiconHits([])
+        cached = cls._memo.get(text) if memoize else None
+        if cached is not None: return cached
+
+        goto, fail, output, patterns = cls._get_automaton()
+        fragment_hits = {} # 模式编号 -> [(片段序号, 起始, 结束), ...]
+        state = 0
+        for position, char in enumerate(text.lower()):
+            while state and char not in goto[state]: state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id, index, length in output[state]:
+                fragment_hits.setdefault(pattern_id, []).append((index, position - length + 1, position + 1))
+
+        hits, seen = [], set()
+        for pattern_id, found in fragment_hits.items():
+            category, keyword, fragment_count = patterns[pattern_id]
+            if fragment_count == 1:
+                offsets = [start for _, start, _ in found]
+            else:
+                offsets = cls._match_in_order(found, fragment_count)
+            for offset in offsets:
+                if (category, keyword, offset) in seen: continue # 可选字符展开的两种形式在同一位置只记一次
+                seen.add((category, keyword, offset))
+                hits.append(Hit(category, keyword, offset))
+        hits.sort(key=lambda h: h.offset)
+
+        result = LexiconHits(hits)
+        if not memoize: return result
+        with cls._lock:
+            cls._memo[text] = result
+            if len(cls._memo) > cls.MEMO_SIZE: cls._memo.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _match_in_order(found: list, fragment_count: int) -> list:
+        # 带间隔的关键词：从最早的首片段开始，依次寻找位于前一片段之后的下一片段
+        found = sorted(found, key=lambda item: item[1])
+        firsts = [item for item in found if item[0] == 0]
+        if not firsts: return []
+        _, offset, cursor = firsts[0]
+        for index in range(1, fragment_count):
+            next_match = next((item for item in found if item[0] == index and item[1] >= cursor), None)
+            if next_match is None: return []
+            cursor = next_match[2]
+        return [offset]
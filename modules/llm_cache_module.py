@@ -0,0 +1,124 @@
+# D:\python_code\LocalAgent\modules\llm_cache_module.py
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+
+class LLMCacheModule:
+    """
+    LLM 回复的两级精确匹配缓存：进程内 LRU (L1) + Redis (L2)。
+    Key 为 (provider, model, messages, temperature, max_tokens) 规范化 JSON 的 SHA-256，
+    只缓存成功的回复；提供者可在 AVAILABLE_PROVIDERS 中设置 "cache_enabled": False 退出。
+    """
+    STATS_KEY = "llmcache:stats" # Redis 中的全局命中统计 (Hash)
+
+    _l1: OrderedDict = OrderedDict() # key -> (过期时间, 回复)
+    _lock = threading.Lock()
+    _stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "stores": 0} # 进程内统计
+
+    @classmethod
+    def is_enabled(cls, provider: str) -> bool:
+        # 全局开关 + 提供者级开关
+        if not current_app.config.get('LLM_CACHE_ENABLED', True): return False
+        provider_config = current_app.config.get('AVAILABLE_PROVIDERS', {}).get(provider, {})
+        return provider_config.get("cache_enabled", True)
+
+    @staticmethod
+    def make_key(provider: str, payload: dict) -> str:
+        # 规范化请求内容生成缓存Key (排序键、紧凑分隔符，保证字节级稳定)
+        canonical = json.dumps({
+            "provider": provider,
+            "model": payload.get("model"),
+            "messages": [{"role": m.get("role"), "content": m.get("content")} for m in payload.get("messages", [])],
+            "temperature": payload.get("temperature", payload.get("options", {}).get("temperature")),
+            "max_tokens": payload.get("max_tokens", payload.get("options", {}).get("num_predict")), # Ollama 原生请求的参数在 options 中
+            "stop": payload.get("stop", payload.get("options", {}).get("stop")) or [], # 停止序列不同，回复也不同
+        }, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _get_redis_client(cls):
+        # L2 可选：Redis 不可用时只使用 L1
+        return getattr(current_app, 'redis_client', None)
+
+    @classmethod
+    def _count(cls, field: str):
+        # 更新进程内与 Redis 全局计数
+        with cls._lock: cls._stats[field] += 1
+        redis = cls._get_redis_client()
+        if redis is None: return
+        try: redis.hincrby(cls.STATS_KEY, field, 1)
+        except Exception as e: print(f"[LLM缓存] 更新统计失败: {e}")
+
+    @classmethod
+    def _l1_get(cls, key: str) -> str | None:
+        with cls._lock:
+            entry = cls._l1.get(key)
+            if entry is None: return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del cls._l1[key]; return None
+            cls._l1.move_to_end(key) # 最近使用
+            return value
+
+    @classmethod
+    def _l1_set(cls, key: str, value: str):
+        max_size = current_app.config.get('LLM_CACHE_L1_MAXSIZE', 512)
+        ttl = current_app.config.get('LLM_CACHE_L1_TTL', 300)
+        with cls._lock:
+            cls._l1[key] = (time.monotonic() + ttl, value)
+            cls._l1.move_to_end(key)
+            while len(cls._l1) > max_size: cls._l1.popitem(last=False) # 淘汰最久未用
+
+    @classmethod
+    def get(cls, provider: str, payload: dict) -> str | None:
+        # 查询缓存：先 L1 后 L2，L2 命中回填 L1
+        if not cls.is_enabled(provider): return None
+        key = cls.make_key(provider, payload)
+        value = cls._l1_get(key)
+        if value is not None:
+            cls._count("l1_hits"); print(f"[LLM缓存] L1 命中 {key[:12]}")
+            return value
+        redis = cls._get_redis_client()
+        if redis is not None:
+            try:
+                value = redis.get(f"llmcache:{key}")
+            except Exception as e:
+                print(f"[LLM缓存] 读取 Redis 失败: {e}"); value = None
+            if value is not None:
+                cls._l1_set(key, value)
+                cls._count("l2_hits"); print(f"[LLM缓存] L2 命中 {key[:12]}")
+                return value
+        cls._count("misses")
+        return None
+
+    @classmethod
+    def set(cls, provider: str, payload: dict, response: str):
+        # 写入两级缓存 (调用方保证 response 为成功回复)
+        if not cls.is_enabled(provider) or not response: return
+        key = cls.make_key(provider, payload)
+        cls._l1_set(key, response)
+        redis = cls._get_redis_client()
+        if redis is not None:
+            try: redis.setex(f"llmcache:{key}", current_app.config.get('LLM_CACHE_L2_TTL', 3600), response)
+            except Exception as e: print(f"[LLM缓存] 写入 Redis 失败: {e}")
+        cls._count("stores")
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        # 命中统计：进程内 + (可用时) Redis 全局
+        with cls._lock:
+            stats = {"local": dict(cls._stats), "l1_size": len(cls._l1)}
+        redis = cls._get_redis_client()
+        if redis is not None:
+            try: stats["global"] = {k: int(v) for k, v in redis.hgetall(cls.STATS_KEY).items()}
+            except Exception as e: print(f"[LLM缓存] 读取统计失败: {e}")
+        return stats
+
+    @classmethod
+    def clear_local(cls):
+        # 清空进程内缓存
+        with cls._lock: cls._l1.clear()
@@ -0,0 +1,92 @@
+# D:\python_code\LocalAgent\modules\ollama_adapter_module.py
+import threading
+import time
+from flask import current_app
+from modules.call_stats_module import CallStatsModule
+from modules.context_window_module import ContextWindowModule
+from modules.endpoint_pool_module import EndpointPoolModule
+from modules.provider_client_module import ProviderClientModule
+from utils import load_prompt
+
+
+class OllamaAdapterModule:
+    """
+    "Local" 提供者的 Ollama 原生 /api/chat 适配：
+    - 请求带 keep_alive 与 options.num_ctx / num_predict，模型闲置后不被卸载，num_ctx 固定避免重新加载；
+    - 消息前缀 (系统提示 + 较早历史) 保持字节级稳定，命中服务端 KV 前缀缓存；
+    - Worker 启动时对每个 LOCAL_MODELS 条目做一次预热生成；
+    - 收集响应中的加载/预填充/生成耗时 (写入 CallStatsModule)，供流水线写入 outputs。
+    """
+
+    @staticmethod
+    def is_native(provider: str) -> bool:
+        # 提供者是否按 Ollama 原生接口调用
+        provider_config = current_app.config.get('AVAILABLE_PROVIDERS', {}).get(provider, {})
+        return provider_config.get("api_mode") == "ollama"
+
+    @staticmethod
+    def get_num_ctx(model: str) -> int:
+        # 与上下文预算使用同一窗口，保证每次请求的 num_ctx 一致
+        return current_app.config.get('OLLAMA_NUM_CTX') or ContextWindowModule.get_window(model)
+
+    @classmethod
+    def build_payload(cls, model: str, messages: list, stream: bool = False,
+                      temperature: float = 0.7, max_tokens: int | None = None, stop: list | None = None) -> dict:
+        # 原生请求体：生成参数放在 options 中 (顶层 temperature/max_tokens 会被 Ollama 忽略)
+        options = {"temperature": temperature, "num_ctx": cls.get_num_ctx(model)}
+        if max_tokens: options["num_predict"] = max_tokens
+        if stop: options["stop"] = stop
+        return {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": current_app.config.get('OLLAMA_KEEP_ALIVE', '30m'),
+            "options": options,
+        }
+
+    @staticmethod
+    def record_stats(response_data: dict):
+        # 从 Ollama 最终响应中提取耗时统计 (纳秒 -> 毫秒)
+        if not isinstance(response_data, dict) or "total_duration" not in response_data: return
+        stats = {field.replace("_duration", "_ms"): round(response_data.get(field, 0) / 1e6, 1)
+                 for field in ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")}
+        stats["prompt_eval_count"] = response_data.get("prompt_eval_count", 0) # 0 或很小说明命中了前缀缓存
+        stats["eval_count"] = response_data.get("eval_count", 0)
+        CallStatsModule.update(**stats)
+
+    @staticmethod
+    def format_stats(stats: dict) -> str:
+        # outputs 中展示的一行摘要
+        return (f"加载 {stats.get('load_ms', 0)}ms, 预填充 {stats.get('prompt_eval_count', 0)} tokens / {stats.get('prompt_eval_ms', 0)}ms, "
+                f"生成 {stats.get('eval_count', 0)} tokens / {stats.get('eval_ms', 0)}ms, 总计 {stats.get('total_ms', 0)}ms")
+
+    @classmethod
+    def warm_up(cls, provider: str = "Local"):
+        # 对每个端点上的每个模型发一次最小生成 (num_predict=1)：加载模型并预填充系统提示
+        if not cls.is_native(provider): return
+        models = current_app.config.get('AVAILABLE_PROVIDERS', {}).get(provider, {}).get("models", [])
+        system_prompt = load_prompt()
+        session = ProviderClientModule.get_session(provider)
+        timeout = current_app.config.get('LLM_REQUEST_TIMEOUT', 120)
+        api_key = current_app.config.get('LOCAL_API_KEY')
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        for url in EndpointPoolModule.get_endpoints(provider):
+            for model in models:
+                payload = cls.build_payload(model, [{"role": "system", "content": system_prompt},
+                                                    {"role": "user", "content": "你好"}], max_tokens=1)
+                started = time.monotonic()
+                try:
+                    resp = session.post(url, headers=headers, json=payload, timeout=(5, timeout))
+                    resp.raise_for_status()
+                    load_ms = round(resp.json().get("load_duration", 0) / 1e6, 1)
+                    print(f"[Ollama预热] {url} {model} 完成，耗时 {time.monotonic() - started:.2f}秒 (加载 {load_ms}ms)")
+                except Exception as e:
+                    print(f"[Ollama预热] {url} {model} 失败: {e}")
+
+    @classmethod
+    def start_warm_up(cls, app):
+        # Worker 启动时在后台线程中预热，不阻塞任务消费
+        if not app.config.get('OLLAMA_WARMUP_ON_START', True): return
+        def _run():
+            with app.app_context(): cls.warm_up("Local")
+        threading.Thread(target=_run, name="ollama-warmup", daemon=True).start()
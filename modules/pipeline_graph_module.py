@@ -0,0 +1,96 @@
+# D:\python_code\LocalAgent\modules\pipeline_graph_module.py
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+from modules.common import ModuleOutput
+
+
+@dataclass
+class Stage:
+    """ 流水线中的一个阶段 """
+    name: str                                   # 阶段名，与各模块 ModuleOutput.next_module 使用的名称一致
+    run: Callable[[dict], Awaitable]            # async (ctx) -> ModuleOutput | None (None 表示本轮跳过)
+    after: tuple = ()                           # 显式依赖的阶段
+    next: tuple = ()                            # 后继阶段 (即模块输出中的 next_module 边)，不在图中的名称忽略
+    required: bool = False                      # 失败 (success=False) 时中止整个流水线
+
+
+class PipelineGraphModule:
+    """
+    按阶段依赖图执行对话流水线：依赖 = 显式 after + 指向本阶段的 next 边。
+    没有依赖关系的阶段并发执行 (例如 Redis 历史读取与文本分析)，每个阶段记录耗时。
+    任一阶段输出的 next_module 为终止标记 (如安全模块的 end_conversation)，或必需阶段失败时，
+    取消其余阶段立即返回。阶段通过 ctx["results"] 读取上游阶段的输出。
+    """
+    TERMINAL = {"end_conversation"}
+
+    @staticmethod
+    def _next_names(hint) -> list:
+        # next_module 可能是字符串或列表 (预处理模块使用列表)
+        if not hint: return []
+        return [hint] if isinstance(hint, str) else list(hint)
+
+    @classmethod
+    def resolve(cls, stages: list) -> dict:
+        # 返回 {阶段名: 依赖集合}；依赖不存在或存在环时抛出 ValueError
+        names = {stage.name for stage in stages}
+        deps = {stage.name: set(stage.after) for stage in stages}
+        for stage in stages:
+            for target in stage.next:
+                if target in names: deps[target].add(stage.name)
+        for name, required in deps.items():
+            missing = required - names
+            if missing: raise ValueError(f"阶段 {name} 依赖不存在的阶段: {', '.join(sorted(missing))}")
+
+        visiting, visited = set(), set()
+        def _visit(name):
+            if name in visited: return
+            if name in visiting: raise ValueError(f"阶段依赖存在环: {name}")
+            visiting.add(name)
+            for dep in deps[name]: _visit(dep)
+            visiting.discard(name); visited.add(name)
+        for name in deps: _visit(name)
+        return deps
+
+    @classmethod
+    def _halts(cls, stage: Stage, output) -> bool:
+        if not isinstance(output, ModuleOutput): return False
+        if any(name in cls.TERMINAL for name in cls._next_names(output.next_module)): return True
+        return stage.required and not output.success
+
+    @classmethod
+    async def execute(cls, stages: list, ctx: dict) -> tuple[dict, dict, tuple | None]:
+        # 返回 (各阶段输出, 各阶段耗时 ms, 中止信息 (阶段名, 输出) 或 None)
+        deps = cls.resolve(stages)
+        results, timings, halted = {}, {}, []
+        tasks = {}
+        ctx["results"] = results
+
+        async def _run(stage: Stage):
+            if deps[stage.name]: await asyncio.gather(*(tasks[dep] for dep in deps[stage.name]))
+            if halted: return None
+            started = time.perf_counter()
+            output = await stage.run(ctx)
+            timings[stage.name] = round((time.perf_counter() - started) * 1000, 1)
+            results[stage.name] = output
+            if cls._halts(stage, output) and not halted: halted.append((stage.name, output))
+            return output
+
+        for stage in stages: tasks[stage.name] = asyncio.ensure_future(_run(stage))
+        pending = set(tasks.values())
+        try:
+            while pending and not halted:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None: raise task.exception()
+        finally:
+            for task in pending: task.cancel()
+            if pending: await asyncio.wait(pending)
+        return results, timings, halted[0] if halted else None
+
+    @staticmethod
+    def format_timings(timings: dict, total_ms: float) -> str:
+        # outputs 中展示的一行摘要 (按耗时从高到低)
+        parts = [f"{name} {ms}ms" for name, ms in sorted(timings.items(), key=lambda item: -item[1])]
+        return f"{', '.join(parts)}; 总计 {total_ms}ms"
@@ -1,23 +1,26 @@
 # modules/preprocessor_module.py
 import re  # 正则表达式
-import jieba  # 中文分词
-from modules.common import ModuleOutput
+from modules.tokenizer_module import TokenizerModule  # 中文分词 (jieba，启动时预加载)
+from modules.common import ModuleOutput, TokenizedText
 
 class PreprocessorModule:
     # 文本预处理模块
     @classmethod
-    def process(cls, text: str) -> ModuleOutput:
+    def process(cls, text: str | TokenizedText) -> ModuleOutput:
+        # 传入 TokenizedText 时直接使用其规范化结果，并把分词结果写回 (供后续模块共用)
         try:
-            cleaned = re.sub(r'[^\w\s]', '', text.lower())  # 清除标点并转小写
+            tokenized = text if isinstance(text, TokenizedText) else TokenizedText(text)  # 全角转半角、小写、清除标点
         except re.error as e:
             return ModuleOutput(False, {}, f"正则错误: {e}", ["fallback"])
+        cleaned = tokenized.cleaned
         try:
-            words = list(jieba.cut(cleaned))  # 分词
+            if tokenized.tokens is None: tokenized.set_tokens(TokenizerModule.cut(cleaned))  # 分词
         except Exception as e:
             return ModuleOutput(False, {}, f"分词错误: {e}", ["fallback"])
+        words = tokenized.tokens
         entities = cls._extract_entities(words)
         keywords = cls._extract_keywords(words)
-        return ModuleOutput(True, {"cleaned_text": cleaned, "words": words,
+        return ModuleOutput(True, {"cleaned_text": cleaned, "words": words, "tokenized": tokenized,
                                    "entities": entities, "keywords": keywords},
                             "预处理完成", ["emotion_analysis"])
 
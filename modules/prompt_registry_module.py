@@ -0,0 +1,96 @@
+# D:\python_code\LocalAgent\modules\prompt_registry_module.py
+import os
+import threading
+import time
+from flask import current_app
+from modules.token_counter_module import TokenCounterModule
+
+
+class PromptRegistryModule:
+    """
+    系统提示词注册表：提示词文件只在首次使用或修改时间 (mtime) 变化时读取，
+    两次检查之间至少间隔 PROMPT_RELOAD_INTERVAL 秒，生成路径上不再每次访问文件系统。
+    按 DialogueState 的用户类型/情绪渲染变体 (基础提示 + PROMPT_STATE_VARIANTS 中的提示段)，
+    渲染结果连同各模型家族的 token 数一起缓存，供上下文预算直接使用。
+    """
+    FALLBACK_PROMPT = "你是一位友好的AI助手。"
+    _files: dict = {}    # 绝对路径 -> {"mtime", "checked", "text"}
+    _variants: dict = {} # (绝对路径, mtime, 用户类型, 情绪) -> {"text", "tokens"}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _resolve_path(path: str | None = None) -> str:
+        # 相对路径以应用根目录为基准
+        path = path or current_app.config.get('PROMPT_FILE_PATH') or ""
+        return path if os.path.isabs(path) else os.path.join(current_app.root_path, path)
+
+    @classmethod
+    def _load(cls, full_path: str, fallback: str) -> dict:
+        # 返回文件条目；仅在 mtime 变化时重新读取
+        now = time.monotonic()
+        entry = cls._files.get(full_path)
+        if entry and now - entry["checked"] < current_app.config.get('PROMPT_RELOAD_INTERVAL', 2): return entry
+        try: mtime = os.stat(full_path).st_mtime
+        except OSError: mtime = None
+        with cls._lock:
+            entry = cls._files.get(full_path)
+            if entry and entry["mtime"] == mtime:
+                entry["checked"] = now
+                return entry
+            text = fallback
+            if mtime is None:
+                print(f"提示词文件不存在: {full_path}，使用备用提示词。")
+            else:
+                try:
+                    with open(full_path, 'r', encoding='utf-8') as f: content = f.read().strip()
+                    if content: text = content
+                    else: print(f"提示词文件 {full_path} 为空，使用备用提示词。")
+                except OSError as e:
+                    print(f"读取提示词文件失败: {e}")
+                if entry: print(f"[提示词] {full_path} 已修改，重新加载")
+            entry = {"mtime": mtime, "checked": now, "text": text}
+            cls._files[full_path] = entry
+            # 旧版本的渲染结果全部失效
+            for key in [k for k in cls._variants if k[0] == full_path]: del cls._variants[key]
+        return entry
+
+    @classmethod
+    def get_base(cls, path: str | None = None, fallback: str | None = None) -> str:
+        # 基础提示词 (不含状态变体)
+        return cls._load(cls._resolve_path(path), fallback or cls.FALLBACK_PROMPT)["text"]
+
+    @staticmethod
+    def _state_key(state) -> tuple:
+        # 变体键：只取参与渲染的状态字段，保证缓存规模有限
+        if state is None or not current_app.config.get('PROMPT_STATE_VARIANTS_ENABLED', True): return (None, None)
+        return (getattr(state.user_type, 'value', None), getattr(state.user_emotion, 'value', None))
+
+    @staticmethod
+    def _render_variant(base: str, user_type: str | None, user_emotion: str | None) -> str:
+        variants = current_app.config.get('PROMPT_STATE_VARIANTS', {})
+        guidance = [text for text in (variants.get("user_type", {}).get(user_type),
+                                      variants.get("user_emotion", {}).get(user_emotion)) if text]
+        if not guidance: return base
+        # 提示段追加在基础提示之后，基础部分保持不变 (本地模型仍可复用其前缀缓存)
+        template = current_app.config.get('PROMPT_VARIANT_TEMPLATE', "\n\n{guidance}")
+        return base + template.format(guidance="\n".join(f"- {text}" for text in guidance))
+
+    @classmethod
+    def render(cls, state=None, path: str | None = None) -> dict:
+        # 返回 {"text": 系统提示, "tokens": {模型家族: token 数}}，按 (文件版本, 用户类型, 情绪) 缓存
+        full_path = cls._resolve_path(path)
+        entry = cls._load(full_path, cls.FALLBACK_PROMPT)
+        key = (full_path, entry["mtime"]) + cls._state_key(state)
+        rendered = cls._variants.get(key)
+        if rendered is None:
+            text = cls._render_variant(entry["text"], *key[2:])
+            rendered = {"text": text, "tokens": TokenCounterModule.count_all(text)}
+            cls._variants[key] = rendered
+        return rendered
+
+    @staticmethod
+    def tokens_for(rendered: dict, model: str | None) -> int:
+        # 渲染结果在指定模型下的 token 数
+        family = TokenCounterModule.family(model)
+        cached = rendered["tokens"].get(family)
+        return cached if cached is not None else TokenCounterModule.count(rendered["text"], family)
@@ -0,0 +1,200 @@
+# D:\python_code\LocalAgent\modules\provider_client_module.py
+import random
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from modules.endpoint_pool_module import EndpointPoolModule
+
+
+class CircuitOpenError(requests.RequestException):
+    """ 提供者处于熔断状态，请求被直接拒绝 (不发起网络调用) """
+
+
+class CircuitBreaker:
+    """
+    单个提供者 (配置了多个端点时为单个端点) 的熔断器 (closed -> open -> half_open -> closed)。
+    在最近 window 次调用中失败率超过阈值即打开，冷却后放行一个探测请求。
+    状态保存在进程内，每个 Celery Worker 进程独立判断。
+    """
+    def __init__(self, window: int, min_requests: int, failure_rate: float, cooldown: float):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self._results = deque(maxlen=window) # True=成功 False=失败
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow_request(self) -> bool:
+        # 判断是否放行本次请求
+        with self._lock:
+            if self._state == "closed": return True
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.cooldown: return False
+                self._state = "half_open" # 冷却结束，进入半开
+                self._probe_in_flight = False
+            if self._probe_in_flight: return False # 半开状态只放行一个探测
+            self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        # 探测请求被取消或意外中断 (未得到结果)：归还探测名额，不计为失败；否则半开状态将一直拒绝请求
+        with self._lock:
+            if self._state == "half_open": self._probe_in_flight = False
+
+    def record(self, success: bool):
+        # 记录调用结果并更新状态
+        with self._lock:
+            if self._state == "half_open":
+                self._probe_in_flight = False
+                if success:
+                    self._state = "closed"; self._results.clear()
+                    print("[熔断器] 探测成功，恢复正常。")
+                else:
+                    self._state = "open"; self._opened_at = time.monotonic()
+                    print("[熔断器] 探测失败，继续熔断。")
+                return
+            self._results.append(success)
+            if len(self._results) < self.min_requests: return
+            failures = self._results.count(False)
+            if failures / len(self._results) >= self.failure_rate:
+                self._state = "open"; self._opened_at = time.monotonic()
+                print(f"[熔断器] 失败率 {failures}/{len(self._results)} 超过阈值，打开熔断 {self.cooldown} 秒。")
+
+
+class ProviderClientModule:
+    """
+    LLM 提供者客户端层：每个提供者一个带连接池的 keep-alive Session，
+    对可安全重试的失败 (连接失败、429、502/503/504) 做带抖动的指数退避重试，
+    并通过熔断器在提供者大面积出错时快速失败。
+    """
+    RETRYABLE_STATUS = {429, 502, 503, 504}
+
+    _sessions: dict = {}
+    _breakers: dict = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _setting(cls, provider: str, key: str, config_key: str, default):
+        # 读取配置：AVAILABLE_PROVIDERS 中的单独配置优先，其次全局配置
+        provider_config = current_app.config.get('AVAILABLE_PROVIDERS', {}).get(provider, {})
+        if key in provider_config: return provider_config[key]
+        return current_app.config.get(config_key, default)
+
+    @classmethod
+    def get_session(cls, provider: str) -> requests.Session:
+        # 获取 (或创建) 提供者专属的连接池 Session
+        session = cls._sessions.get(provider)
+        if session is not None: return session
+        with cls._lock:
+            session = cls._sessions.get(provider)
+            if session is None:
+                pool_size = cls._setting(provider, "pool_maxsize", 'PROVIDER_POOL_MAXSIZE', 10)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0) # 重试由本模块控制
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls._sessions[provider] = session
+        return session
+
+    @staticmethod
+    def _breaker_key(provider: str, url: str | None) -> str:
+        # 配置了多个端点时每个端点一个熔断器，一台主机故障不会熔断整个提供者；否则整个提供者共用一个
+        if url is None or len(EndpointPoolModule.get_endpoints(provider)) <= 1: return provider
+        return f"{provider}@{url}"
+
+    @classmethod
+    def get_breaker(cls, provider: str, url: str | None = None) -> CircuitBreaker:
+        # 获取 (或创建) 提供者 (或其端点) 的熔断器
+        key = cls._breaker_key(provider, url)
+        breaker = cls._breakers.get(key)
+        if breaker is not None: return breaker
+        with cls._lock:
+            breaker = cls._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    window=cls._setting(provider, "breaker_window", 'CIRCUIT_BREAKER_WINDOW', 20),
+                    min_requests=cls._setting(provider, "breaker_min_requests", 'CIRCUIT_BREAKER_MIN_REQUESTS', 5),
+                    failure_rate=cls._setting(provider, "breaker_failure_rate", 'CIRCUIT_BREAKER_FAILURE_RATE', 0.5),
+                    cooldown=cls._setting(provider, "breaker_cooldown", 'CIRCUIT_BREAKER_COOLDOWN', 30),
+                )
+                cls._breakers[key] = breaker
+        return breaker
+
+    @classmethod
+    def is_open(cls, provider: str) -> bool:
+        # 提供者是否整体不可用 (多端点时全部端点都在熔断中)
+        endpoints = EndpointPoolModule.get_endpoints(provider) or [None]
+        return all(cls.get_breaker(provider, url).state == "open" for url in endpoints)
+
+    @classmethod
+    def _backoff_delay(cls, provider: str, attempt: int, resp: requests.Response | None = None) -> float:
+        # 计算退避时间 (full jitter)，429 时尊重 Retry-After
+        base = cls._setting(provider, "retry_backoff", 'PROVIDER_RETRY_BACKOFF', 0.5)
+        cap = cls._setting(provider, "retry_backoff_max", 'PROVIDER_RETRY_BACKOFF_MAX', 8)
+        if resp is not None:
+            retry_after = resp.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit(): return min(float(retry_after), cap)
+        return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+    @classmethod
+    def post(cls, provider: str, url: str, headers: dict, payload: dict, stream: bool = False) -> requests.Response:
+        # 发送请求：熔断检查 -> 连接池请求 -> 可重试失败退避重试；最终结果计入熔断器
+        breaker = cls.get_breaker(provider, url)
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"{provider} 熔断中，暂不发起请求")
+
+        session = cls.get_session(provider)
+        max_retries = cls._setting(provider, "max_retries", 'PROVIDER_MAX_RETRIES', 2)
+        connect_timeout = cls._setting(provider, "connect_timeout", 'PROVIDER_CONNECT_TIMEOUT', 5)
+        read_timeout = current_app.config.get('LLM_REQUEST_TIMEOUT', 120)
+
+        attempt = 0
+        settled = False # 本次请求的结果已计入熔断器
+        try:
+            while True:
+                try:
+                    resp = session.post(url, headers=headers, json=payload,
+                                        timeout=(connect_timeout, read_timeout), stream=stream)
+                except requests.ConnectionError as e:
+                    # 连接失败或复用的空闲连接被对端关闭，可安全重试 (读超时属于 Timeout，不在此重试，避免重复生成)
+                    if attempt < max_retries:
+                        delay = cls._backoff_delay(provider, attempt)
+                        print(f"[提供者客户端] {provider} 连接失败 ({type(e).__name__})，{delay:.2f}秒后重试 ({attempt + 1}/{max_retries})")
+                        time.sleep(delay); attempt += 1
+                        continue
+                    settled = True
+                    breaker.record(False)
+                    raise
+                except requests.RequestException:
+                    settled = True
+                    breaker.record(False)
+                    raise
+
+                if resp.status_code in cls.RETRYABLE_STATUS and attempt < max_retries:
+                    delay = cls._backoff_delay(provider, attempt, resp)
+                    print(f"[提供者客户端] {provider} 返回 HTTP {resp.status_code}，{delay:.2f}秒后重试 ({attempt + 1}/{max_retries})")
+                    resp.close() # 归还连接
+                    time.sleep(delay); attempt += 1
+                    continue
+
+                settled = True
+                breaker.record(resp.status_code < 500 and resp.status_code != 429)
+                return resp
+        except BaseException:
+            if not settled: breaker.release_probe() # 被中断 (如 KeyboardInterrupt、意外异常)，归还半开探测名额
+            raise
+
+    @classmethod
+    def get_status(cls) -> dict:
+        # 各提供者 (多端点时为 "提供者@端点") 的熔断状态 (用于调试展示)
+        return {name: breaker.state for name, breaker in cls._breakers.items()}
@@ -0,0 +1,112 @@
+# D:\python_code\LocalAgent\modules\rate_limiter_module.py
+import asyncio
+import random
+import time
+from flask import current_app
+from modules.async_runtime_module import AsyncRuntimeModule
+from modules.call_stats_module import CallStatsModule
+from modules.provider_client_module import ProviderClientModule
+
+
+class RateLimitTimeout(Exception):
+    """排队等待超过上限"""
+    pass
+
+
+class RateLimiterModule:
+    """
+    基于 Redis 的分布式令牌桶限流，每个提供者两个桶：请求数 (rps/burst) 与 token 数 (tpm)。
+    调用前先取令牌，不足时按脚本返回的等待时间排队，超过 max_wait 则放弃 (而不是打到提供者后收到 429)。
+    限额在 AVAILABLE_PROVIDERS[提供者]["rate_limit"] 中配置，未配置的提供者不限流；Redis 不可用时直接放行。
+    """
+    # 两个桶一起检查：任一不足则不扣减并返回需要等待的秒数，全部足够才扣减
+    # 使用服务端 TIME，避免各 Worker 时钟不一致
+    ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local function peek(key, rate, capacity)
+    if rate <= 0 then return nil end
+    local b = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(b[1]) or capacity
+    local ts = tonumber(b[2]) or now
+    return math.min(capacity, tokens + math.max(0, now - ts) * rate)
+end
+local rps, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local tps, tcap, cost = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local wait = 0
+local r = peek(KEYS[1], rps, burst)
+if r and r < 1 then wait = math.max(wait, (1 - r) / rps) end
+local k = peek(KEYS[2], tps, tcap)
+local c = math.min(cost, tcap)
+if k and k < c then wait = math.max(wait, (c - k) / tps) end
+if wait > 0 then return tostring(wait) end
+if r then redis.call('HSET', KEYS[1], 'tokens', r - 1, 'ts', now); redis.call('EXPIRE', KEYS[1], 3600) end
+if k then redis.call('HSET', KEYS[2], 'tokens', k - c, 'ts', now); redis.call('EXPIRE', KEYS[2], 3600) end
+return '0'
+"""
+
+    @classmethod
+    def _get_redis_client(cls):
+        return getattr(current_app, 'redis_client', None)
+
+    @staticmethod
+    def get_limits(provider: str) -> dict | None:
+        # 提供者的限额 {"rps", "burst", "tpm", "max_wait"}，未配置返回 None
+        return ProviderClientModule._setting(provider, "rate_limit", 'RATE_LIMIT_DEFAULT', None)
+
+    @classmethod
+    def _try_acquire(cls, provider: str, limits: dict, cost: int) -> float:
+        # 尝试取令牌，返回需要等待的秒数 (0 表示已取得)
+        redis = cls._get_redis_client()
+        if redis is None: return 0.0
+        rps = float(limits.get("rps") or 0)
+        burst = float(limits.get("burst") or max(1.0, rps))
+        tpm = float(limits.get("tpm") or 0)
+        try:
+            wait = redis.eval(cls.ACQUIRE_SCRIPT, 2, f"ratelimit:{provider}:req", f"ratelimit:{provider}:tok",
+                              rps, burst, tpm / 60.0, tpm, cost)
+            return float(wait)
+        except Exception as e:
+            print(f"[限流] 执行令牌桶脚本失败，直接放行: {e}")
+            return 0.0
+
+    @staticmethod
+    def _max_wait(limits: dict) -> float:
+        return float(limits.get("max_wait") or current_app.config.get('RATE_LIMIT_MAX_WAIT', 10))
+
+    @classmethod
+    def acquire(cls, provider: str, cost: int = 1) -> float:
+        # 阻塞排队直到取得令牌，返回等待秒数；超过 max_wait 抛出 RateLimitTimeout
+        limits = cls.get_limits(provider)
+        if not limits: return 0.0
+        started = time.monotonic(); max_wait = cls._max_wait(limits)
+        while True:
+            wait = cls._try_acquire(provider, limits, cost)
+            waited = time.monotonic() - started
+            if wait <= 0: return cls._export(provider, waited)
+            if waited + wait > max_wait:
+                cls._export(provider, waited)
+                raise RateLimitTimeout(f"{provider} 请求过多，排队超过 {max_wait:.0f} 秒")
+            time.sleep(wait + random.uniform(0, 0.05)) # 少量抖动，避免等待者同时醒来
+
+    @classmethod
+    async def aacquire(cls, provider: str, cost: int = 1) -> float:
+        # acquire 的 asyncio 版本
+        limits = cls.get_limits(provider)
+        if not limits: return 0.0
+        started = time.monotonic(); max_wait = cls._max_wait(limits)
+        while True:
+            wait = await AsyncRuntimeModule.run_blocking(cls._try_acquire, provider, limits, cost)
+            waited = time.monotonic() - started
+            if wait <= 0: return cls._export(provider, waited)
+            if waited + wait > max_wait:
+                cls._export(provider, waited)
+                raise RateLimitTimeout(f"{provider} 请求过多，排队超过 {max_wait:.0f} 秒")
+            await asyncio.sleep(wait + random.uniform(0, 0.05))
+
+    @staticmethod
+    def _export(provider: str, waited: float) -> float:
+        # 记录本次调用的排队时间
+        if waited >= 0.01: print(f"[限流] {provider} 排队等待 {waited:.2f}秒")
+        CallStatsModule.add("rate_limit_wait_ms", waited * 1000)
+        return waited
@@ -1,14 +1,31 @@
 # D:\python_code\LocalAgent\modules\response_generator_module.py
+import asyncio
+import inspect
 import json
 import time
-import requests
+import httpx
 import os
 from flask import current_app, session
 from modules.common import ModuleOutput, DialogueState, UserType
-from utils import load_prompt
+from modules.provider_client_module import ProviderClientModule, CircuitOpenError
+from modules.async_provider_client_module import AsyncProviderClientModule
+from modules.async_runtime_module import AsyncRuntimeModule
+from modules.llm_cache_module import LLMCacheModule
+from modules.singleflight_module import SingleflightModule
+from modules.latency_stats_module import LatencyStatsModule
+from modules.endpoint_pool_module import EndpointPoolModule
+from modules.context_window_module import ContextWindowModule
+from modules.ollama_adapter_module import OllamaAdapterModule
+from modules.slo_controller_module import SLOControllerModule
+from modules.call_stats_module import CallStatsModule
+from modules.rate_limiter_module import RateLimiterModule, RateLimitTimeout
+from modules.token_counter_module import TokenCounterModule
+from modules.prompt_registry_module import PromptRegistryModule
+from modules.generation_policy_module import GenerationPolicyModule
 import copy
 
 class ResponseGeneratorModule:
+    HEDGE_STATS_KEY = "hedge:stats" # 对冲请求累计统计 (Redis Hash: fired / won)
 
     @classmethod
     def _ensure_alternating_messages(cls, messages: list) -> list:
@@ -24,31 +41,46 @@ class ResponseGeneratorModule:
         return processed
 
     @classmethod
-    def generate(cls, user_input: str, state: DialogueState, history: list,
-                 selected_provider: str | None, selected_model: str | None,
-                 session_id: str | None = None,
-                 temp_keys: dict | None = None) -> ModuleOutput:
-
-        provider_name, model_name, api_url = cls._get_provider_info(selected_provider, selected_model)
+    def _prepare_call(cls, state: DialogueState, history: list,
+                      selected_provider: str | None, selected_model: str | None,
+                      session_id: str | None = None,
+                      history_summary: str | None = None,
+                      policy: dict | None = None) -> tuple[dict | None, dict | None, ModuleOutput | None]:
+        # 解析提供者并按 token 预算构建消息列表，返回 (调用参数, 调用信息 {"context", "tier"}, None) 或 (None, None, 失败输出)
+        # policy 为本轮的生成策略 (未传入时按 state 选择)，决定输出预算、采样参数，以及可选的提供者/模型
+        policy = policy or GenerationPolicyModule.select(state)
+        selected_provider, selected_model = cls._apply_policy_target(policy, selected_provider, selected_model)
+        provider_name, model_name, api_url, tier = cls._get_provider_info(selected_provider, selected_model, state)
         if not model_name or not api_url:
              fallback_msg = "无可用模型或API URL配置"
              if not provider_name or provider_name == 'None': fallback_msg = "未选择有效的LLM提供者"
              print(f"[生成错误] {fallback_msg} for provider '{selected_provider}', model '{selected_model}'")
-             return ModuleOutput(False, message=fallback_msg)
+             return None, None, ModuleOutput(False, message=fallback_msg)
 
-        print(f"[生成] 使用模型: {provider_name}/{model_name}")
+        print(f"[生成] 使用模型: {provider_name}/{model_name}，生成策略: {policy.get('name')} (max_tokens={policy.get('max_tokens')})")
 
-        system_prompt = load_prompt()
+        # 按用户类型/情绪渲染的系统提示 (注册表缓存，token 数已预先计算)
+        rendered_prompt = PromptRegistryModule.render(state)
+        system_prompt = rendered_prompt["text"]
+        system_tokens = PromptRegistryModule.tokens_for(rendered_prompt, model_name)
+        if history_summary: # 较早的对话已折叠为摘要，接在系统提示之后 (系统提示本身保持不变)
+            summary_text = current_app.config.get('HISTORY_SUMMARY_TEMPLATE', "\n\n{summary}").format(summary=history_summary)
+            system_prompt += summary_text
+            system_tokens += TokenCounterModule.count(summary_text, TokenCounterModule.family(model_name))
         messages = [{"role": "system", "content": system_prompt}]
-        valid_history = [msg for msg in history if msg.get("role") in ["user", "assistant"] and msg.get("content")]
-        messages.extend(valid_history)
+        packed_history, context_stats = ContextWindowModule.pack(
+            system_prompt, history, model_name, policy.get("max_tokens") or current_app.config.get('LLM_MAX_TOKENS', 1500),
+            system_tokens=system_tokens,
+            # 只有 Ollama 原生模式 (keep_alive 常驻、复用 KV 前缀) 才值得为稳定前缀多丢弃几条历史
+            align=current_app.config.get('CONTEXT_PACK_ALIGN', 1) if OllamaAdapterModule.is_native(provider_name) else 1)
+        messages.extend(packed_history)
 
         final_messages_to_send = cls._ensure_alternating_messages(copy.deepcopy(messages))
         if len(final_messages_to_send) <= 1 or final_messages_to_send[-1]['role'] != 'user':
             print(f"[错误] 构建消息列表失败: {final_messages_to_send}")
             user_msgs = [m for m in messages if m['role'] == 'user']
             if user_msgs: final_messages_to_send = [messages[0], user_msgs[-1]]
-            else: return ModuleOutput(False, message="无法构建有效请求(无用户消息)")
+            else: return None, None, ModuleOutput(False, message="无法构建有效请求(无用户消息)")
 
 
         session_key = None
@@ -58,38 +90,227 @@ class ResponseGeneratorModule:
              except RuntimeError: # Handle cases outside request context
                  session_key = None
 
-        start_time = time.time()
-        raw_response = cls._call_llm_api(
-            provider=provider_name, api_url=api_url, model=model_name,
-            messages=final_messages_to_send,
-            session_key=session_key,
-            temp_keys=temp_keys
-        )
-        end_time = time.time()
-        print(f"[生成] LLM调用耗时: {end_time - start_time:.2f}秒")
+        call_kwargs = {
+            "provider": provider_name, "api_url": api_url, "model": model_name,
+            "messages": final_messages_to_send, "session_key": session_key, "policy": policy,
+        }
+        return call_kwargs, {"context": context_stats, "tier": tier}, None
+
+    @staticmethod
+    def _apply_policy_target(policy: dict, selected_provider: str | None, selected_model: str | None) -> tuple:
+        # 策略指定了提供者时改用该提供者 (需已配置模型，且无需 Key 或已配置 Key)，否则保持用户的选择
+        target = policy.get("provider")
+        if not target or (target == selected_provider and not policy.get("model")): return selected_provider, selected_model
+        provider_config = current_app.config.get('AVAILABLE_PROVIDERS', {}).get(target, {})
+        if not provider_config.get("models") or (provider_config.get("key_required") and not provider_config.get("key_configured")):
+            print(f"[生成策略] 策略 {policy.get('name')} 指定的提供者 '{target}' 不可用，使用所选提供者")
+            return selected_provider, selected_model
+        return target, policy.get("model")
+
+    @staticmethod
+    def is_success_response(raw_response: str) -> bool:
+        # 按 _call_llm_api 的错误文本约定判断调用是否成功
+        return "调用失败" not in raw_response and "调用异常" not in raw_response and "调用超时" not in raw_response and "Key缺失" not in raw_response
+
+    @staticmethod
+    def is_endpoint_failure(raw_response: str) -> bool:
+        # 端点本身的故障 (超时、网络异常、5xx、该端点熔断中)，用于被动健康检查；Key缺失、4xx 等请求问题不算
+        return "调用超时" in raw_response or "网络异常" in raw_response or "调用失败: HTTP 5" in raw_response or "熔断中" in raw_response
 
-        success = "调用失败" not in raw_response and "调用异常" not in raw_response and "调用超时" not in raw_response and "Key缺失" not in raw_response
+    @staticmethod
+    def _rate_limit_cost(model: str, payload: dict) -> int:
+        # token 桶的扣减量：提示 token 估算 + 预计输出
+        family = TokenCounterModule.family(model)
+        prompt_tokens = sum(TokenCounterModule.count(m.get("content", ""), family) for m in payload.get("messages", []))
+        output_estimate = current_app.config.get('RATE_LIMIT_OUTPUT_ESTIMATE', 300)
+        max_tokens = payload.get("max_tokens") or payload.get("options", {}).get("num_predict")
+        return prompt_tokens + (min(output_estimate, max_tokens) if max_tokens else output_estimate)
+
+    @staticmethod
+    def _build_output(raw_response: str, provider_name: str, model_name: str,
+                      hedge: dict | None = None, call_stats: dict | None = None,
+                      context: dict | None = None, tier: dict | None = None,
+                      generation: dict | None = None) -> ModuleOutput:
+        # 根据原始回复组装模块输出 (错误文本约定见 _call_llm_api)
+        success = ResponseGeneratorModule.is_success_response(raw_response)
         message = f"模型调用 {'成功' if success else '失败'}"
         if not success: message += f": {raw_response.split(':', 1)[-1].strip()}"
 
+        data = {"raw_response": raw_response, "model_used": f"{provider_name}/{model_name}"}
+        if hedge: data["hedge"] = hedge
+        if context: data["context"] = context
+        if tier: data["tier"] = tier
+        if generation: data["generation"] = generation
+        if call_stats: data["call_stats"] = call_stats
         return ModuleOutput(
             success=success,
-            data={"raw_response": raw_response, "model_used": f"{provider_name}/{model_name}"},
+            data=data,
             message=message,
             next_module="response_optimization"
         )
 
+    @classmethod
+    def _get_hedge_target(cls, primary_provider: str, temp_keys: dict | None = None) -> dict | None:
+        # 选出对冲用的备用提供者：优先 HEDGE_SECONDARY_PROVIDER，否则取第一个可用的其他提供者
+        config = current_app.config
+        if not config.get('HEDGING_ENABLED', False): return None
+        available = config.get('AVAILABLE_PROVIDERS', {})
+        preferred = config.get('HEDGE_SECONDARY_PROVIDER')
+        for name in ([preferred] if preferred else list(available.keys())):
+            provider_config = available.get(name)
+            if name == primary_provider or not provider_config: continue
+            if not provider_config.get("models") or not provider_config.get("url"): continue
+            if provider_config.get("key_required") and not provider_config.get("key_configured") and not (temp_keys or {}).get(name): continue
+            if ProviderClientModule.is_open(name): continue # 熔断中的提供者不做备用
+            return {"provider": name, "api_url": provider_config["url"], "model": provider_config["models"][0]}
+        return None
+
+    @classmethod
+    def _hedge_delay(cls, provider: str, model: str, streaming: bool) -> float:
+        # 对冲等待时间：主提供者近期耗时的 p95 (流式按首个片段耗时)，样本不足时用默认值
+        config = current_app.config
+        samples = LatencyStatsModule.samples(provider, model, "first_token" if streaming else "total")
+        if len(samples) < config.get('HEDGE_MIN_SAMPLES', 20): return config.get('HEDGE_DEFAULT_DELAY', 8.0)
+        delay = LatencyStatsModule.percentile(samples, config.get('HEDGE_DELAY_PERCENTILE', 0.95))
+        return min(max(delay, config.get('HEDGE_MIN_DELAY', 1.0)), config.get('HEDGE_MAX_DELAY', 30.0))
+
+    @classmethod
+    def _count_hedge(cls, hedge: dict):
+        # 累计对冲次数与备用获胜次数，并把全局累计值写回 hedge
+        redis = getattr(current_app, 'redis_client', None)
+        if redis is None: return
+        try:
+            pipe = redis.pipeline()
+            pipe.hincrby(cls.HEDGE_STATS_KEY, "fired", 1 if hedge["fired"] else 0)
+            pipe.hincrby(cls.HEDGE_STATS_KEY, "won", 1 if hedge["won"] else 0)
+            hedge["total_fired"], hedge["total_won"] = pipe.execute()
+        except Exception as e:
+            print(f"[对冲] 更新统计失败: {e}")
+
+    @classmethod
+    async def _ahedged_call(cls, primary: dict, secondary: dict, delay: float,
+                            temp_keys: dict | None = None, on_token=None) -> tuple[str, dict, dict]:
+        # 对冲调用：主提供者 delay 秒内未完成 (流式为未出首个片段) 时，向备用提供者发送同样的消息，
+        # 先成功的一方获胜并取消另一方。返回 (原始回复, 获胜方调用参数, 对冲信息)
+        tasks = {}
+        winner = None
+        first_token = asyncio.Event() # 主提供者流出首个片段 (流式时以此判断是否超时，而不是整个回复完成)
+
+        def _claim(name: str) -> bool:
+            nonlocal winner
+            if winner is None:
+                winner = name
+                for other, task in tasks.items():
+                    if other != name and not task.done(): task.cancel()
+            return winner == name
+
+        def _launch(name: str, call_kwargs: dict):
+            if on_token:
+                async def _forward(delta):
+                    # 流式：首个片段即决出胜者，败方的片段丢弃
+                    if name == "primary": first_token.set()
+                    if not _claim(name): return
+                    callback_result = on_token(delta)
+                    if inspect.isawaitable(callback_result): await callback_result
+                coro = cls._astream_llm_api(temp_keys=temp_keys, on_token=_forward, **call_kwargs)
+            else:
+                coro = cls._acall_llm_api(temp_keys=temp_keys, **call_kwargs)
+            tasks[name] = asyncio.ensure_future(coro)
+
+        hedge = {"fired": False, "won": False, "delay": round(delay, 2)}
+        _launch("primary", primary)
+        first_token_wait = asyncio.ensure_future(first_token.wait())
+        try:
+            await asyncio.wait({tasks["primary"], first_token_wait}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            first_token_wait.cancel()
+        if tasks["primary"].done() or winner is not None:
+            # 主提供者已完成，或流式已出首个片段 (已获胜)：不再发起备用请求
+            return await tasks["primary"], primary, hedge
+
+        print(f"[对冲] {primary['provider']}/{primary['model']} {delay:.2f}秒未响应，并发请求 {secondary['provider']}/{secondary['model']}")
+        hedge["fired"] = True
+        _launch("secondary", secondary)
+        results = {}
+        pending = set(tasks.values())
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for name, task in tasks.items():
+                if task not in done or task.cancelled(): continue
+                results[name] = task.result()
+                if cls.is_success_response(results[name]) and _claim(name):
+                    for other in pending: other.cancel()
+                    hedge["won"] = name == "secondary"
+                    return results[name], (secondary if hedge["won"] else primary), hedge
+
+        # 双方都失败 (或胜者在首个片段之后失败)：返回胜者或主提供者的错误
+        name = winner if winner in results else ("primary" if "primary" in results else "secondary")
+        hedge["won"] = name == "secondary"
+        return results[name], (secondary if hedge["won"] else primary), hedge
+
+    @classmethod
+    def generate(cls, user_input: str, state: DialogueState, history: list,
+                 selected_provider: str | None, selected_model: str | None,
+                 session_id: str | None = None,
+                 temp_keys: dict | None = None,
+                 on_token=None,
+                 history_summary: str | None = None,
+                 policy: dict | None = None) -> ModuleOutput:
+        # 同步入口：交给后台事件循环执行 agenerate (on_token 存在时走流式调用)
+        return AsyncRuntimeModule.run(cls.agenerate(user_input, state, history, selected_provider, selected_model,
+                                                    session_id, temp_keys, on_token, history_summary, policy))
+
+    @classmethod
+    async def agenerate(cls, user_input: str, state: DialogueState, history: list,
+                        selected_provider: str | None, selected_model: str | None,
+                        session_id: str | None = None,
+                        temp_keys: dict | None = None,
+                        on_token=None,
+                        history_summary: str | None = None,
+                        policy: dict | None = None) -> ModuleOutput:
+        # 生成回复：等待模型期间不占用线程；on_token 存在时走流式调用，增量片段实时回调，返回值与非流式一致
+        # 选择提供者 (SLO 评估、延迟样本) 与对冲目标都会读写 Redis，放到线程池执行，不阻塞事件循环
+        call_kwargs, call_meta, error_output = await AsyncRuntimeModule.run_blocking(
+            cls._prepare_call, state, history, selected_provider, selected_model, session_id, history_summary, policy)
+        if error_output: return error_output
+
+        start_time = time.time()
+        call_stats = CallStatsModule.begin()
+        hedge = None
+        hedge_target = await AsyncRuntimeModule.run_blocking(cls._get_hedge_target, call_kwargs["provider"], temp_keys)
+        if hedge_target:
+            secondary = {**call_kwargs, **hedge_target, "session_key": None} # 会话Key属于主提供者
+            delay = await AsyncRuntimeModule.run_blocking(cls._hedge_delay, call_kwargs["provider"], call_kwargs["model"], on_token is not None)
+            raw_response, call_kwargs, hedge = await cls._ahedged_call(call_kwargs, secondary, delay, temp_keys, on_token)
+            await AsyncRuntimeModule.run_blocking(cls._count_hedge, hedge)
+        elif on_token: raw_response = await cls._astream_llm_api(temp_keys=temp_keys, on_token=on_token, **call_kwargs)
+        else: raw_response = await cls._acall_llm_api(temp_keys=temp_keys, **call_kwargs)
+        end_time = time.time()
+        print(f"[生成] LLM调用耗时: {end_time - start_time:.2f}秒")
+        generation = await AsyncRuntimeModule.run_blocking(GenerationPolicyModule.record, call_kwargs["policy"], call_kwargs["model"],
+                                                           raw_response, cls.is_success_response(raw_response), call_stats)
+
+        return cls._build_output(raw_response, call_kwargs["provider"], call_kwargs["model"], hedge, call_stats,
+                                 generation=generation, **call_meta)
+
     @staticmethod
-    def _call_llm_api(provider: str, api_url: str, model: str, messages: list,
-                      session_key: str | None = None,
-                      temp_keys: dict | None = None
-                     ) -> str:
+    def _build_request(provider: str, model: str, messages: list,
+                       session_key: str | None = None,
+                       temp_keys: dict | None = None,
+                       stream: bool = False,
+                       policy: dict | None = None):
+        # 构建请求头与请求体，Key缺失时返回 (None, 错误文本)
         available_providers = current_app.config.get('AVAILABLE_PROVIDERS', {})
-        llm_timeout = current_app.config.get('LLM_REQUEST_TIMEOUT', 120)
         deepseek_key_global = os.environ.get("DEEPSEEK_API_KEY", current_app.config.get("DEEPSEEK_API_KEY"))
         local_key_global = os.environ.get("LOCAL_API_KEY", current_app.config.get("LOCAL_API_KEY"))
 
-        payload = {"model": model, "messages": messages, "stream": False, "temperature": 0.7, "max_tokens": 1500}
+        params = GenerationPolicyModule.request_params(policy) # max_tokens / temperature / stop
+        if OllamaAdapterModule.is_native(provider):
+            payload = OllamaAdapterModule.build_payload(model, messages, stream, **params)
+        else:
+            payload = {"model": model, "messages": messages, "stream": stream,
+                       "temperature": params["temperature"], "max_tokens": params["max_tokens"]}
+            if params["stop"]: payload["stop"] = params["stop"]
         headers = {"Content-Type": "application/json"}
         api_key = None
         provider_config = available_providers.get(provider, {})
@@ -102,43 +323,177 @@ class ResponseGeneratorModule:
             else:
                 if provider == "DeepSeek" and provider_config.get("key_configured"): api_key = deepseek_key_global
                 elif provider == "Local" and provider_config.get("key_configured"): api_key = local_key_global
-            if not api_key: return f"调用失败: {provider} Key缺失"
+            if not api_key: return None, f"调用失败: {provider} Key缺失"
             headers["Authorization"] = f"Bearer {api_key}"
 
-        assistant_message = "调用失败: 未知错误"
-        try:
-            resp = requests.post(api_url, headers=headers, json=payload, timeout=llm_timeout)
-            resp.raise_for_status()
-            response_data = resp.json()
-
-            content = ""
-            if provider == "DeepSeek":
-                content = response_data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-            elif provider == "Local":
-                content = response_data.get("message", {}).get("content", "") or \
-                          response_data.get("response", "") or \
-                          (response_data.get("choices", [{}])[0].get("message", {}).get("content", "") if response_data.get("choices") else "")
-                content = content.strip()
-            else:
-                return f"调用失败: 未知提供者 '{provider}'"
+        return (headers, payload), None
 
-            assistant_message = content or f"模型返回空内容 ({provider})"
+    @staticmethod
+    def _call_llm_api(provider: str, api_url: str, model: str, messages: list,
+                      session_key: str | None = None,
+                      temp_keys: dict | None = None,
+                      policy: dict | None = None
+                     ) -> str:
+        # 同步调用入口 (如会话总结)：在后台事件循环上执行 _acall_llm_api，错误以 "调用失败..." 等文本返回
+        return AsyncRuntimeModule.run(ResponseGeneratorModule._acall_llm_api(
+            provider, api_url, model, messages, session_key, temp_keys, policy))
 
-        except requests.Timeout: assistant_message = f"调用超时({llm_timeout}秒)"
-        except requests.HTTPError as e:
-             error_body = "未知响应体"
-             try: error_body = e.response.text[:100]
-             except Exception: pass
-             assistant_message = f"调用失败: HTTP {e.response.status_code}: {error_body}"
-        except requests.RequestException as e: assistant_message = f"调用失败: 网络异常 {type(e).__name__}"
-        except Exception as e:
-             import traceback
-             print(f"处理LLM响应时发生未知错误: {traceback.format_exc()}")
-             assistant_message = f"调用失败: 处理异常 {type(e).__name__}"
-        return assistant_message
+    @staticmethod
+    def _extract_content(provider: str, response_data: dict) -> str | None:
+        # 从非流式响应中取出回复文本，未知提供者返回 None
+        if provider == "DeepSeek":
+            return response_data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+        if provider == "Local":
+            content = response_data.get("message", {}).get("content", "") or \
+                      response_data.get("response", "") or \
+                      (response_data.get("choices", [{}])[0].get("message", {}).get("content", "") if response_data.get("choices") else "")
+            return content.strip()
+        return None
+
+    @staticmethod
+    async def _acall_llm_api(provider: str, api_url: str, model: str, messages: list,
+                             session_key: str | None = None,
+                             temp_keys: dict | None = None,
+                             policy: dict | None = None
+                            ) -> str:
+        # _call_llm_api 的 asyncio 版本 (httpx)，错误文本约定一致
+        llm_timeout = current_app.config.get('LLM_REQUEST_TIMEOUT', 120)
+        request_parts, error = ResponseGeneratorModule._build_request(provider, model, messages, session_key, temp_keys, policy=policy)
+        if error: return error
+        headers, payload = request_parts
+        cached = await AsyncRuntimeModule.run_blocking(LLMCacheModule.get, provider, payload)
+        if cached is not None: return cached
+
+        async def _send(endpoint_url: str) -> str:
+            started = time.monotonic()
+            try:
+                resp = await AsyncProviderClientModule.post(provider, endpoint_url, headers, payload)
+                resp.raise_for_status()
+                response_data = resp.json()
+                OllamaAdapterModule.record_stats(response_data)
+                content = ResponseGeneratorModule._extract_content(provider, response_data)
+                if content is None: return f"调用失败: 未知提供者 '{provider}'"
+                if content:
+                    await AsyncRuntimeModule.run_blocking(LatencyStatsModule.record, provider, model, time.monotonic() - started)
+                    await AsyncRuntimeModule.run_blocking(LLMCacheModule.set, provider, payload, content)
+                return content or f"模型返回空内容 ({provider})"
+            except CircuitOpenError: return f"调用失败: {provider} 暂时不可用 (熔断中)"
+            except httpx.TimeoutException:
+                await AsyncRuntimeModule.run_blocking(LatencyStatsModule.record, provider, model, time.monotonic() - started)
+                return f"调用超时({llm_timeout}秒)"
+            except httpx.HTTPStatusError as e:
+                 return f"调用失败: HTTP {e.response.status_code}: {e.response.text[:100]}"
+            except httpx.HTTPError as e: return f"调用失败: 网络异常 {type(e).__name__}"
+            except Exception as e:
+                 import traceback
+                 print(f"处理LLM响应时发生未知错误: {traceback.format_exc()}")
+                 return f"调用失败: 处理异常 {type(e).__name__}"
+        async def _request() -> str:
+            try: await RateLimiterModule.aacquire(provider, ResponseGeneratorModule._rate_limit_cost(model, payload))
+            except RateLimitTimeout as e: return f"调用失败: {e}"
+            return await EndpointPoolModule.acall(provider, api_url, _send, ResponseGeneratorModule.is_endpoint_failure)
+        flight_key = LLMCacheModule.make_key(provider, payload)
+        result, _ = await SingleflightModule.ado(flight_key, _request, ResponseGeneratorModule.is_success_response)
+        return result
+
+    @staticmethod
+    def _parse_stream_line(provider: str, line: str) -> tuple[str, bool]:
+        # 解析一行流式输出，返回 (增量文本, 是否结束)
+        # Ollama: 每行一个 JSON 对象 (NDJSON)；DeepSeek/OpenAI 兼容: "data: {...}" 的 SSE 行
+        line = line.strip()
+        if not line: return "", False
+        if line.startswith("data:"):
+            line = line[5:].strip()
+            if line == "[DONE]": return "", True
+        elif line.startswith(":") or line.startswith("event:"):
+            return "", False # SSE 注释或事件名行
+        chunk = json.loads(line)
+        if provider == "DeepSeek" or chunk.get("choices"):
+            choice = (chunk.get("choices") or [{}])[0]
+            delta = choice.get("delta", {}).get("content") or choice.get("message", {}).get("content") or ""
+            return delta, choice.get("finish_reason") is not None
+        delta = chunk.get("message", {}).get("content", "") or chunk.get("response", "")
+        return delta, bool(chunk.get("done"))
+
+    @staticmethod
+    async def _astream_llm_api(provider: str, api_url: str, model: str, messages: list,
+                               session_key: str | None = None,
+                               temp_keys: dict | None = None,
+                               on_token=None,
+                               policy: dict | None = None
+                              ) -> str:
+        # 流式调用LLM：逐块解析并回调 on_token (普通函数或协程函数)，返回拼接后的完整文本 (错误文本约定同 _call_llm_api)
+        if provider not in ("DeepSeek", "Local"): return f"调用失败: 未知提供者 '{provider}'"
+        llm_timeout = current_app.config.get('LLM_REQUEST_TIMEOUT', 120)
+        request_parts, error = ResponseGeneratorModule._build_request(provider, model, messages, session_key, temp_keys, stream=True, policy=policy)
+        if error: return error
+        native = OllamaAdapterModule.is_native(provider)
+        headers, payload = request_parts
+        cached = await AsyncRuntimeModule.run_blocking(LLMCacheModule.get, provider, payload)
+        if cached is not None:
+            if on_token:
+                callback_result = on_token(cached) # 命中缓存时一次性推送完整回复
+                if inspect.isawaitable(callback_result): await callback_result
+            return cached
+
+        async def _send(endpoint_url: str) -> str:
+            chunks = []
+            started = time.monotonic()
+            try:
+                resp = await AsyncProviderClientModule.post(provider, endpoint_url, headers, payload, stream=True)
+                try:
+                    if resp.is_error:
+                        await resp.aread()
+                        resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line: continue
+                        try:
+                            delta, finished = ResponseGeneratorModule._parse_stream_line(provider, line)
+                            if finished and native: OllamaAdapterModule.record_stats(json.loads(line)) # 最后一行带耗时统计
+                        except json.JSONDecodeError:
+                            print(f"[生成] 跳过无法解析的流式片段: {line[:100]}")
+                            continue
+                        if delta:
+                            if not chunks: await AsyncRuntimeModule.run_blocking(LatencyStatsModule.record, provider, model, time.monotonic() - started, "first_token")
+                            chunks.append(delta)
+                            if on_token:
+                                try:
+                                    callback_result = on_token(delta)
+                                    if inspect.isawaitable(callback_result): await callback_result
+                                except Exception as cb_err: print(f"[生成] on_token 回调出错: {cb_err}")
+                        if finished: break
+                finally:
+                    await resp.aclose()
+                content = "".join(chunks).strip()
+                if content:
+                    await AsyncRuntimeModule.run_blocking(LatencyStatsModule.record, provider, model, time.monotonic() - started)
+                    await AsyncRuntimeModule.run_blocking(LLMCacheModule.set, provider, payload, content)
+                return content or f"模型返回空内容 ({provider})"
+            except CircuitOpenError: return f"调用失败: {provider} 暂时不可用 (熔断中)"
+            except httpx.TimeoutException:
+                await AsyncRuntimeModule.run_blocking(LatencyStatsModule.record, provider, model, time.monotonic() - started)
+                return f"调用超时({llm_timeout}秒)"
+            except httpx.HTTPStatusError as e:
+                 return f"调用失败: HTTP {e.response.status_code}: {e.response.text[:100]}"
+            except httpx.HTTPError as e: return f"调用失败: 网络异常 {type(e).__name__}"
+            except Exception as e:
+                 import traceback
+                 print(f"处理LLM流式响应时发生未知错误: {traceback.format_exc()}")
+                 return f"调用失败: 处理异常 {type(e).__name__}"
+        async def _request() -> str:
+            try: await RateLimiterModule.aacquire(provider, ResponseGeneratorModule._rate_limit_cost(model, payload))
+            except RateLimitTimeout as e: return f"调用失败: {e}"
+            return await EndpointPoolModule.acall(provider, api_url, _send, ResponseGeneratorModule.is_endpoint_failure)
+        flight_key = LLMCacheModule.make_key(provider, payload)
+        result, shared = await SingleflightModule.ado(flight_key, _request, ResponseGeneratorModule.is_success_response)
+        if shared and on_token:
+            callback_result = on_token(result) # 共享他人结果时一次性推送
+            if inspect.isawaitable(callback_result): await callback_result
+        return result
 
     @classmethod
-    def _get_provider_info(cls, provider_input, model_input):
+    def _get_provider_info(cls, provider_input, model_input, state: DialogueState | None = None):
+        # 返回 (提供者, 模型, API URL, 档位信息)；传入 state 且非危机时，由 SLO 控制器决定是否降级到较小模型
         config = current_app.config
         available = config.get('AVAILABLE_PROVIDERS', {})
         default_p = config.get('DEFAULT_PROVIDER', 'None')
@@ -149,7 +504,7 @@ class ResponseGeneratorModule:
 
         if not provider_config:
              print(f"[配置错误] 无法找到提供者 '{provider_name}' 的配置。")
-             return provider_name, None, None
+             return provider_name, None, None, None
 
         models = provider_config.get("models", [])
         model_name = model_input if model_input and model_input in models else (models[0] if models else None)
@@ -163,4 +518,8 @@ class ResponseGeneratorModule:
         if not model_name: print(f"[配置警告] 无法为提供者 '{provider_name}' 确定有效模型。")
         if not api_url: print(f"[配置错误] 提供者 '{provider_name}' 未配置 API URL。")
 
-        return provider_name, model_name, api_url
\ No newline at end of file
+        tier = None
+        if model_name and state is not None and not (state.is_crisis or state.user_type == UserType.CRISIS): # 危机轮次始终使用主模型
+            model_name, tier = SLOControllerModule.select(provider_name, model_name)
+
+        return provider_name, model_name, api_url, tier
\ No newline at end of file
@@ -1,7 +1,7 @@
 # D:\python_code\LocalAgent\modules\safety_module.py
 from flask import current_app
-from modules.common import ModuleOutput
-import re
+from modules.common import ModuleOutput, TokenizedText
+from modules.lexicon_module import LexiconModule
 
 class SafetyModule:
     CRISIS_KEYWORDS = [
@@ -9,13 +9,13 @@ class SafetyModule:
         '自残', '割腕', '伤害自己?', '了断', '自我了断', '报复社会', '伤害别人', '杀了他', '弄死他',
         '同归于尽', '绝望', '没希望了?', '崩溃', '无法承受', '救命', '紧急', '帮帮我'
     ]
-    CRISIS_REGEX = re.compile(r'\b(?:' + '|'.join(re.escape(k.replace('?', '')) for k in CRISIS_KEYWORDS) + r')\b', re.IGNORECASE)
 
     @classmethod
-    def check(cls, text: str) -> ModuleOutput:
-        match = cls.CRISIS_REGEX.search(text)
-        if match:
-            detected_keyword = match.group(0)
+    def check(cls, text: str | TokenizedText) -> ModuleOutput:
+        # 取词表扫描结果中 "safety" 部分的第一个命中
+        hits = LexiconModule.scan(text).slice("safety")
+        if hits:
+            detected_keyword = hits[0].keyword
             print(f"[安全模块] 检测到危机关键词: {detected_keyword}")
 
             try:
@@ -46,4 +46,7 @@ class SafetyModule:
                 data={"crisis": False},
                 message="安全检查通过",
                 next_module="preprocess"
-            )
\ No newline at end of file
+            )
+
+
+LexiconModule.register("safety", {"crisis": SafetyModule.CRISIS_KEYWORDS})
@@ -0,0 +1,138 @@
+# D:\python_code\LocalAgent\modules\semantic_cache_module.py
+import hashlib
+import json
+import time
+from flask import current_app
+from modules.common import DialogueState, UserType, EmotionType
+
+
+class SemanticCacheModule:
+    """
+    开场轮次的近重复语义缓存：对 jieba 分词结果计算 64 位 SimHash，
+    在 Redis 中按分段 (band) 建立倒排索引，汉明距离不超过阈值即复用已有回复。
+    按鸽巢原理，把指纹切成 (阈值+1) 段时，距离不超过阈值的两个指纹至少有一段完全相同，
+    因此只需查这些段的候选集合即可，不会漏掉真正的近邻。
+    仅用于历史很短的轮次，危机状态永不走缓存。
+    """
+    FINGERPRINT_BITS = 64
+    # 语气词、程度副词等对语义影响很小的词，去掉后 "我最近很焦虑怎么办" 与 "最近好焦虑，怎么办" 指纹一致
+    # 否定词 (不/没) 会改变语义，必须保留
+    IGNORED_TOKENS = {
+        "的", "了", "和", "是", "我", "你", "吗", "呢", "啊", "吧", "呀", "哦", "嗯", "么",
+        "很", "好", "太", "挺", "真", "特别", "非常", "有点", "有些", "比较", "超", "蛮", "还", "就", "都", "也",
+    }
+    STATS_KEY = "semcache:stats"
+
+    @classmethod
+    def _get_redis_client(cls):
+        return getattr(current_app, 'redis_client', None)
+
+    @classmethod
+    def _tokens(cls, words: list) -> list:
+        # 过滤空白、标点和忽略词
+        return [w for w in (w.strip() for w in words) if w and w not in cls.IGNORED_TOKENS]
+
+    @classmethod
+    def fingerprint(cls, words: list) -> int | None:
+        # 计算 SimHash 指纹 (权重: 词长 x 出现次数)，无有效词返回 None
+        tokens = cls._tokens(words)
+        if len(tokens) < current_app.config.get('SEMANTIC_CACHE_MIN_TOKENS', 1): return None
+        weights = {}
+        for token in tokens: weights[token] = weights.get(token, 0) + len(token)
+        vector = [0] * cls.FINGERPRINT_BITS
+        for token, weight in weights.items():
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+            for bit in range(cls.FINGERPRINT_BITS):
+                vector[bit] += weight if (h >> bit) & 1 else -weight
+        value = 0
+        for bit, score in enumerate(vector):
+            if score > 0: value |= 1 << bit
+        return value
+
+    @classmethod
+    def _bands(cls, fingerprint: int) -> list[tuple[int, int]]:
+        # 切分指纹为 (阈值+1) 段，返回 [(段序号, 段值)]
+        band_count = current_app.config.get('SEMANTIC_CACHE_MAX_DISTANCE', 3) + 1
+        width = cls.FINGERPRINT_BITS // band_count
+        bands = []
+        for i in range(band_count):
+            bits = width if i < band_count - 1 else cls.FINGERPRINT_BITS - width * i # 最后一段吸收余数
+            bands.append((i, (fingerprint >> (width * i)) & ((1 << bits) - 1)))
+        return bands
+
+    @staticmethod
+    def _namespace(provider: str, model: str) -> str:
+        # 不同模型的回复互不复用
+        return hashlib.sha1(f"{provider}/{model}".encode("utf-8")).hexdigest()[:10]
+
+    @classmethod
+    def is_eligible(cls, state: DialogueState, history: list | None = None) -> bool:
+        # 是否允许本轮使用语义缓存：开关开启、历史足够短、非危机
+        if not current_app.config.get('SEMANTIC_CACHE_ENABLED', True): return False
+        if state.is_crisis or state.user_type == UserType.CRISIS or state.user_emotion == EmotionType.CRISIS: return False
+        if state.session_turn_count > current_app.config.get('SEMANTIC_CACHE_MAX_TURNS', 0): return False
+        if history is not None:
+            user_turns = sum(1 for m in history if m.get("role") == "user")
+            if user_turns > current_app.config.get('SEMANTIC_CACHE_MAX_TURNS', 0) + 1: return False
+        return True
+
+    @classmethod
+    def _count(cls, field: str):
+        redis = cls._get_redis_client()
+        if redis is None: return
+        try: redis.hincrby(cls.STATS_KEY, field, 1)
+        except Exception as e: print(f"[语义缓存] 更新统计失败: {e}")
+
+    @classmethod
+    def lookup(cls, fingerprint: int, provider: str, model: str) -> dict | None:
+        # 查找最近的缓存条目，返回 {"response", "distance", "model_used"} 或 None
+        redis = cls._get_redis_client()
+        if redis is None or fingerprint is None: return None
+        max_distance = current_app.config.get('SEMANTIC_CACHE_MAX_DISTANCE', 3)
+        ns = cls._namespace(provider, model)
+        try:
+            pipe = redis.pipeline()
+            for i, value in cls._bands(fingerprint):
+                pipe.smembers(f"semcache:{ns}:band:{i}:{value:x}")
+            candidates = set()
+            for members in pipe.execute(): candidates.update(members)
+
+            best_fp, best_distance = None, max_distance + 1
+            for member in candidates:
+                distance = bin(int(member, 16) ^ fingerprint).count("1")
+                if distance < best_distance: best_fp, best_distance = member, distance
+            if best_fp is None:
+                cls._count("misses"); return None
+
+            entry_json = redis.get(f"semcache:{ns}:fp:{best_fp}")
+            if not entry_json:
+                cls._count("misses"); return None # 条目已过期，索引残留由 TTL 清理
+            entry = json.loads(entry_json)
+            entry["distance"] = best_distance
+            cls._count("hits")
+            print(f"[语义缓存] 命中 {best_fp} (汉明距离 {best_distance})")
+            return entry
+        except Exception as e:
+            print(f"[语义缓存] 查询失败: {e}")
+            return None
+
+    @classmethod
+    def store(cls, fingerprint: int, provider: str, model: str, response: str):
+        # 写入缓存条目及其分段索引
+        redis = cls._get_redis_client()
+        if redis is None or fingerprint is None or not response: return
+        ttl = current_app.config.get('SEMANTIC_CACHE_TTL', 86400)
+        ns = cls._namespace(provider, model)
+        fp_hex = f"{fingerprint:x}"
+        entry = {"response": response, "model_used": f"{provider}/{model}", "created_at": int(time.time())}
+        try:
+            pipe = redis.pipeline()
+            pipe.setex(f"semcache:{ns}:fp:{fp_hex}", ttl, json.dumps(entry, ensure_ascii=False))
+            for i, value in cls._bands(fingerprint):
+                band_key = f"semcache:{ns}:band:{i}:{value:x}"
+                pipe.sadd(band_key, fp_hex)
+                pipe.expire(band_key, ttl)
+            pipe.execute()
+            cls._count("stores")
+        except Exception as e:
+            print(f"[语义缓存] 写入失败: {e}")
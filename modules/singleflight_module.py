@@ -0,0 +1,149 @@
+# D:\python_code\LocalAgent\modules\singleflight_module.py
+import asyncio
+import json
+import time
+import uuid
+from flask import current_app
+from modules.async_runtime_module import AsyncRuntimeModule
+
+
+class SingleflightModule:
+    """
+    跨 Worker 合并相同的在途 LLM 请求 (singleflight)。
+    第一个调用者通过 Redis SET NX 获得锁并真正执行，完成后把结果写入结果Key并在频道上广播；
+    同一时刻到达的重复调用者订阅频道等待并共享结果，避免并发突发把同一请求放大到提供者。
+    领头者失败或超时时，等待者自行执行，保证不会因合并而丢请求。
+    """
+    # 仅当锁仍归自己所有时才删除 (避免误删超时后被他人重新获取的锁)
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    @classmethod
+    def _get_redis_client(cls):
+        if not current_app.config.get('SINGLEFLIGHT_ENABLED', True): return None
+        return getattr(current_app, 'redis_client', None)
+
+    @staticmethod
+    def _keys(key: str) -> tuple[str, str, str]:
+        return f"sf:lock:{key}", f"sf:result:{key}", f"sf:chan:{key}"
+
+    @staticmethod
+    def _wait_timeout() -> float:
+        # 等待领头者的最长时间，与单次 LLM 调用上限一致
+        return current_app.config.get('LLM_REQUEST_TIMEOUT', 120) + 10
+
+    @classmethod
+    def _acquire(cls, redis, key: str) -> str | None:
+        lock_key, _, _ = cls._keys(key)
+        token = uuid.uuid4().hex
+        if redis.set(lock_key, token, nx=True, px=int(cls._wait_timeout() * 1000)): return token
+        return None
+
+    @classmethod
+    def _finish(cls, redis, key: str, token: str, result, shareable: bool):
+        # 领头者发布结果并释放锁
+        lock_key, result_key, channel = cls._keys(key)
+        envelope = json.dumps({"ok": shareable, "result": result if shareable else None}, ensure_ascii=False)
+        try:
+            pipe = redis.pipeline()
+            pipe.setex(result_key, current_app.config.get('SINGLEFLIGHT_RESULT_TTL', 30), envelope)
+            pipe.publish(channel, envelope)
+            pipe.eval(cls.RELEASE_SCRIPT, 1, lock_key, token)
+            pipe.execute()
+        except Exception as e:
+            print(f"[合并请求] 发布结果失败: {e}")
+
+    @staticmethod
+    def _parse(envelope) -> tuple[bool, str | None]:
+        data = json.loads(envelope)
+        return bool(data.get("ok")), data.get("result")
+
+    @classmethod
+    def do(cls, key: str, fn, is_shareable=lambda result: True):
+        # 同步合并执行，返回 (结果, 是否来自他人)
+        redis = cls._get_redis_client()
+        if redis is None: return fn(), False
+        try:
+            token = cls._acquire(redis, key)
+        except Exception as e:
+            print(f"[合并请求] 获取锁失败，直接执行: {e}")
+            return fn(), False
+
+        if token:
+            result = None; shareable = False
+            try:
+                result = fn()
+                shareable = is_shareable(result)
+                return result, False
+            finally:
+                cls._finish(redis, key, token, result, shareable)
+
+        lock_key, result_key, channel = cls._keys(key)
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(channel)
+            existing = redis.get(result_key) # 订阅前领头者可能已完成
+            if existing:
+                ok, result = cls._parse(existing)
+                if ok: return result, True
+            else:
+                deadline = time.monotonic() + cls._wait_timeout()
+                while time.monotonic() < deadline:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        ok, result = cls._parse(message["data"])
+                        if ok:
+                            print(f"[合并请求] 共享领头者结果 {key[:12]}")
+                            return result, True
+                        break # 领头者失败，自行执行
+                    if message is None and not redis.exists(lock_key):
+                        existing = redis.get(result_key) # 锁已释放：可能刚好错过广播，或领头者异常退出
+                        if existing:
+                            ok, result = cls._parse(existing)
+                            if ok: return result, True
+                        break
+        except Exception as e:
+            print(f"[合并请求] 等待结果出错，直接执行: {e}")
+        finally:
+            try: pubsub.close()
+            except Exception: pass
+        return fn(), False
+
+    @classmethod
+    async def ado(cls, key: str, coro_fn, is_shareable=lambda result: True):
+        # asyncio 版本：等待者轮询结果Key (指数退避)，不阻塞事件循环
+        redis = cls._get_redis_client()
+        if redis is None: return await coro_fn(), False
+        try:
+            token = await AsyncRuntimeModule.run_blocking(cls._acquire, redis, key)
+        except Exception as e:
+            print(f"[合并请求] 获取锁失败，直接执行: {e}")
+            return await coro_fn(), False
+
+        if token:
+            result = None; shareable = False
+            try:
+                result = await coro_fn()
+                shareable = is_shareable(result)
+                return result, False
+            finally:
+                await AsyncRuntimeModule.run_blocking(cls._finish, redis, key, token, result, shareable)
+
+        lock_key, result_key, _ = cls._keys(key)
+        deadline = time.monotonic() + cls._wait_timeout()
+        delay = 0.05
+        try:
+            while time.monotonic() < deadline:
+                existing, lock_alive = await AsyncRuntimeModule.run_blocking(
+                    lambda: (redis.get(result_key), redis.exists(lock_key)))
+                if existing:
+                    ok, result = cls._parse(existing)
+                    if ok:
+                        print(f"[合并请求] 共享领头者结果 {key[:12]}")
+                        return result, True
+                    break
+                if not lock_alive: break # 领头者异常退出
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+        except Exception as e:
+            print(f"[合并请求] 等待结果出错，直接执行: {e}")
+        return await coro_fn(), False
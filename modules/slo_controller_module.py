@@ -0,0 +1,105 @@
+# D:\python_code\LocalAgent\modules\slo_controller_module.py
+import time
+from flask import current_app
+from modules.latency_stats_module import LatencyStatsModule
+
+
+class SLOControllerModule:
+    """
+    基于延迟 SLO 的模型降级控制器。
+    按 (提供者, 模型) 的近期 p50/p95 判断是否超出 SLO；超出时新的非危机轮次改用 MODEL_FALLBACKS 中配置的较小模型，
+    恢复需 p95/p50 回落到 SLO x SLO_RECOVER_RATIO 以下且降级已持续 SLO_MIN_DEGRADED_SECONDS (滞回，避免来回切换)；
+    降级与恢复都只看上次切换之后新增的样本 (恢复时最多取最近 SLO_RECOVER_WINDOW 个，至少 SLO_RECOVER_MIN_SAMPLES 个)，
+    否则降级前的慢样本要等整个窗口被探测请求挤出后才能恢复，恢复后又会立即再次降级。
+    降级期间每隔 SLO_PROBE_INTERVAL 秒放行一个请求到主模型，持续刷新主模型的延迟样本。
+    降级状态存放在 Redis 中，所有 Worker 一致。
+    """
+    _cache: dict = {} # (provider, model) -> (过期时间, 评估结果)，减少每轮的 Redis 读取
+
+    @classmethod
+    def _get_redis_client(cls):
+        return getattr(current_app, 'redis_client', None)
+
+    @staticmethod
+    def get_fallback(provider: str, model: str) -> str | None:
+        # 主模型对应的降级模型："提供者/模型" 优先，其次仅模型名
+        fallbacks = current_app.config.get('MODEL_FALLBACKS', {})
+        return fallbacks.get(f"{provider}/{model}") or fallbacks.get(model)
+
+    @staticmethod
+    def get_slo(model: str) -> dict:
+        # 模型的延迟目标 {"p50": 秒, "p95": 秒}
+        return current_app.config.get('LATENCY_SLO_OVERRIDES', {}).get(model) or current_app.config.get('LATENCY_SLO', {"p50": 8.0, "p95": 20.0})
+
+    @staticmethod
+    def _breached(stats: dict, slo: dict, ratio: float) -> bool:
+        return any(stats.get(name) is not None and stats[name] > limit * ratio for name, limit in slo.items())
+
+    @classmethod
+    def evaluate(cls, provider: str, model: str) -> dict:
+        # 评估并更新降级状态，返回 {"degraded", "count", "p50", "p95"}
+        key = (provider, model)
+        cached = cls._cache.get(key)
+        if cached and cached[0] > time.monotonic(): return cached[1]
+
+        config = current_app.config
+        slo = cls.get_slo(model)
+        redis = cls._get_redis_client()
+        state_key = f"slo:degraded:{provider}/{model}"
+        seq_key = f"slo:switch_seq:{provider}/{model}" # 上次切换 (降级/恢复) 时主模型的累计样本序号
+        now = time.time()
+        stats = LatencyStatsModule.get_percentiles(provider, model)
+        try:
+            degraded_since = float(redis.get(state_key) or 0) if redis is not None else 0
+            # 只用上次切换之后新增的样本判断，切换前的样本不再影响新状态 (否则要等整个窗口被挤出)
+            recorded = LatencyStatsModule.recorded(provider, model)
+            fresh = recorded - int((redis.get(seq_key) if redis is not None else 0) or 0)
+            if not degraded_since:
+                stats = LatencyStatsModule.get_percentiles(provider, model, limit=fresh)
+                if stats["count"] >= config.get('SLO_MIN_SAMPLES', 20) and cls._breached(stats, slo, 1.0):
+                    degraded_since = now
+                    if redis is not None:
+                        pipe = redis.pipeline()
+                        pipe.set(state_key, now)
+                        pipe.set(seq_key, recorded)
+                        pipe.execute()
+                    print(f"[SLO] {provider}/{model} 超出延迟目标 (p50={stats['p50']}, p95={stats['p95']})，新轮次切换到降级模型")
+            elif now - degraded_since >= config.get('SLO_MIN_DEGRADED_SECONDS', 60):
+                # 降级期间主模型的新样本来自探测请求，取其中最近的若干个
+                recent = LatencyStatsModule.get_percentiles(provider, model, limit=min(fresh, config.get('SLO_RECOVER_WINDOW', 20)))
+                if recent["count"] >= config.get('SLO_RECOVER_MIN_SAMPLES', 5) \
+                        and not cls._breached(recent, slo, config.get('SLO_RECOVER_RATIO', 0.7)):
+                    degraded_since = 0
+                    pipe = redis.pipeline()
+                    pipe.delete(state_key)
+                    pipe.set(seq_key, recorded)
+                    pipe.execute()
+                    stats = recent
+                    print(f"[SLO] {provider}/{model} 延迟恢复 (最近 {recent['count']} 个样本 p50={recent['p50']}, p95={recent['p95']})，切回主模型")
+        except Exception as e:
+            print(f"[SLO] 读取/更新降级状态失败: {e}")
+            degraded_since = 0
+
+        result = {"degraded": bool(degraded_since), **stats}
+        cls._cache[key] = (time.monotonic() + config.get('SLO_EVAL_INTERVAL', 5), result)
+        return result
+
+    @classmethod
+    def _take_probe(cls, provider: str, model: str) -> bool:
+        # 降级期间定期放行一个探测请求到主模型
+        redis = cls._get_redis_client()
+        if redis is None: return False
+        try: return bool(redis.set(f"slo:probe:{provider}/{model}", 1, nx=True, ex=current_app.config.get('SLO_PROBE_INTERVAL', 30)))
+        except Exception: return False
+
+    @classmethod
+    def select(cls, provider: str, model: str) -> tuple[str, dict]:
+        # 为新轮次选择模型，返回 (模型, 档位信息)
+        fallback = cls.get_fallback(provider, model)
+        if not fallback or not current_app.config.get('SLO_DOWNGRADE_ENABLED', True):
+            return model, {"tier": "primary", "managed": False}
+        status = cls.evaluate(provider, model)
+        tier = {"tier": "primary", "managed": True, "primary": model, "p50": status["p50"], "p95": status["p95"]}
+        if not status["degraded"]: return model, tier
+        if cls._take_probe(provider, model): return model, {**tier, "probe": True}
+        return fallback, {**tier, "tier": "fallback"}
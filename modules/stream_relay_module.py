@@ -0,0 +1,86 @@
+# D:\python_code\LocalAgent\modules\stream_relay_module.py
+import json
+from flask import current_app
+from redis import exceptions as redis_exceptions
+from modules.async_runtime_module import AsyncRuntimeModule
+
+
+class StreamRelayModule:
+    """
+    Celery 任务与 Web 层之间的 token 中继 (基于 Redis Stream)。
+    任务端 XADD 增量片段，Web 端 XREAD BLOCK 读取并转为 SSE 事件；
+    使用 Stream 而非 Pub/Sub，浏览器晚连接或断线重连 (Last-Event-ID) 都不会丢片段。
+    """
+
+    @classmethod
+    def _get_redis_client(cls):
+        # 获取Redis连接实例
+        if not hasattr(current_app, 'redis_client') or current_app.redis_client is None:
+            raise redis_exceptions.ConnectionError("Redis client not available or not initialized.")
+        return current_app.redis_client
+
+    @classmethod
+    def _get_stream_key(cls, task_id: str) -> str:
+        # 生成任务流式输出的Redis Key
+        return f"stream:{task_id}"
+
+    @classmethod
+    def publish(cls, task_id: str, event: str, data):
+        # 写入一个事件 (token / done / error)
+        stream_key = cls._get_stream_key(task_id)
+        ttl = current_app.config.get('STREAM_RELAY_TTL', 600)
+        max_len = current_app.config.get('STREAM_RELAY_MAXLEN', 5000)
+        payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        try:
+            redis = cls._get_redis_client() # Redis 未初始化时同样只记录错误
+            pipe = redis.pipeline()
+            pipe.xadd(stream_key, {"event": event, "data": payload}, maxlen=max_len, approximate=True)
+            pipe.expire(stream_key, ttl) # 过期自动清理
+            pipe.execute()
+        except Exception as e:
+            # 中继失败不影响任务本身，最终结果仍可通过 get_task_result 获取
+            print(f"[错误][流式中继] 任务 {task_id} 写入事件 {event} 失败: {e}")
+
+    @classmethod
+    def make_token_callback(cls, task_id: str):
+        # 生成供 ResponseGeneratorModule 使用的 on_token 回调 (协程函数)
+        # 回调在事件循环上被等待，XADD 放到线程池执行，逐个等待以保持片段顺序
+        async def _on_token(delta: str):
+            if delta: await AsyncRuntimeModule.run_blocking(cls.publish, task_id, "token", delta)
+        return _on_token
+
+    @classmethod
+    def iter_events(cls, task_id: str, last_id: str = "0-0", block_ms: int | None = None, idle_timeout: float | None = None):
+        # 逐个读取事件，产出 (event_id, event, data)；遇到 done/error 或空闲超时结束
+        redis = cls._get_redis_client()
+        stream_key = cls._get_stream_key(task_id)
+        if block_ms is None: block_ms = current_app.config.get('STREAM_RELAY_BLOCK_MS', 15000)
+        if idle_timeout is None: idle_timeout = current_app.config.get('LLM_REQUEST_TIMEOUT', 120) + 15
+        idle_ms = 0
+        while True:
+            entries = redis.xread({stream_key: last_id}, count=100, block=block_ms)
+            if not entries:
+                idle_ms += block_ms
+                if idle_ms >= idle_timeout * 1000:
+                    yield None, "error", json.dumps({"error": "等待模型输出超时"}, ensure_ascii=False)
+                    return
+                yield None, "ping", "" # 心跳，避免代理断开空闲连接
+                continue
+            idle_ms = 0
+            for _, items in entries:
+                for event_id, fields in items:
+                    last_id = event_id
+                    event = fields.get("event", "token")
+                    yield event_id, event, fields.get("data", "")
+                    if event in ("done", "error"): return
+
+    @classmethod
+    def format_sse(cls, event: str, data: str, event_id: str | None = None) -> str:
+        # 组装 text/event-stream 帧 (多行数据需逐行加 data: 前缀)
+        lines = []
+        if event_id: lines.append(f"id: {event_id}")
+        if event == "ping": return ": ping\n\n"
+        lines.append(f"event: {event}")
+        for line in (data.split("\n") if data else [""]):
+            lines.append(f"data: {line}")
+        return "\n".join(lines) + "\n\n"
@@ -7,27 +7,25 @@ from modules.response_generator_module import ResponseGeneratorModule
 class SummaryModule:
 
     @classmethod
-    def generate_summary(cls, conversation_history: list, temp_keys: dict | None = None) -> ModuleOutput:
-        if not conversation_history:
-            return ModuleOutput(success=False, message="对话历史为空，无法生成总结。")
-
+    def _get_summary_llm(cls) -> tuple[tuple[str, str, str] | None, str | None]:
+        # 解析总结用的 (提供者, 模型, API URL)，失败返回 (None, 错误信息)
         provider_name = current_app.config.get('SUMMARY_PROVIDER')
         model_name = current_app.config.get('SUMMARY_MODEL')
-        summary_prompt_template = current_app.config.get('SUMMARY_PROMPT')
         available_providers = current_app.config.get('AVAILABLE_PROVIDERS', {})
 
         if not provider_name or not model_name:
-             return ModuleOutput(success=False, message="未配置用于总结的模型或提供者。")
-        if not summary_prompt_template:
-             return ModuleOutput(success=False, message="未配置总结提示词模板 (SUMMARY_PROMPT)。")
+             return None, "未配置用于总结的模型或提供者。"
 
         provider_config = available_providers.get(provider_name)
         if not provider_config:
-             return ModuleOutput(success=False, message=f"未找到总结提供者配置: {provider_name}")
+             return None, f"未找到总结提供者配置: {provider_name}"
         api_url = provider_config.get("url")
         if not api_url:
-            return ModuleOutput(success=False, message=f"总结提供者 '{provider_name}' 未配置 API URL。")
+            return None, f"总结提供者 '{provider_name}' 未配置 API URL。"
+        return (provider_name, model_name, api_url), None
 
+    @classmethod
+    def _format_history(cls, conversation_history: list) -> str:
         formatted_history = ""
         for msg in conversation_history:
             role = "用户" if msg.get("role") == "user" else "AI助手" if msg.get("role") == "assistant" else msg.get("role", "系统")
@@ -35,8 +33,14 @@ class SummaryModule:
             if msg.get("role") == "system" and len(content) > 500:
                   content = content[:500] + "... (内容过长已截断)"
             formatted_history += f"{role}: {content}\n---\n"
+        return formatted_history.strip()
 
-        prompt_text = summary_prompt_template.format(conversation_history=formatted_history.strip())
+    @classmethod
+    def _request_summary(cls, prompt_text: str, temp_keys: dict | None = None) -> ModuleOutput:
+        # 用总结模型完成一次单轮请求，返回 data["summary"]
+        llm, error = cls._get_summary_llm()
+        if error: return ModuleOutput(success=False, message=error)
+        provider_name, model_name, api_url = llm
         summary_messages = [{"role": "user", "content": prompt_text}]
 
         print(f"[总结模块] 使用模型 {provider_name}/{model_name} 请求总结...")
@@ -48,7 +52,6 @@ class SummaryModule:
         except RuntimeError: # Handle cases outside request context
             session_key = None
 
-
         summary_response = ResponseGeneratorModule._call_llm_api(
             provider=provider_name,
             api_url=api_url,
@@ -58,7 +61,7 @@ class SummaryModule:
             temp_keys=temp_keys
         )
 
-        success = "调用失败" not in summary_response and "调用异常" not in summary_response and "调用超时" not in summary_response and "Key缺失" not in summary_response
+        success = ResponseGeneratorModule.is_success_response(summary_response)
         message = f"总结生成 {'成功' if success else '失败'}"
         if not success: message += f": {summary_response.split(':', 1)[-1].strip()}"
         summary_text = summary_response if success else ""
@@ -67,4 +70,31 @@ class SummaryModule:
             success=success,
             data={"summary": summary_text},
             message=message
-        )
\ No newline at end of file
+        )
+
+    @classmethod
+    def generate_summary(cls, conversation_history: list, temp_keys: dict | None = None) -> ModuleOutput:
+        if not conversation_history:
+            return ModuleOutput(success=False, message="对话历史为空，无法生成总结。")
+
+        summary_prompt_template = current_app.config.get('SUMMARY_PROMPT')
+        if not summary_prompt_template:
+             return ModuleOutput(success=False, message="未配置总结提示词模板 (SUMMARY_PROMPT)。")
+
+        prompt_text = summary_prompt_template.format(conversation_history=cls._format_history(conversation_history))
+        return cls._request_summary(prompt_text, temp_keys)
+
+    @classmethod
+    def fold_summary(cls, previous_summary: str | None, messages: list, temp_keys: dict | None = None) -> ModuleOutput:
+        # 增量摘要：把一段较早的对话并入已有的滚动摘要
+        if not messages:
+            return ModuleOutput(success=False, message="没有需要折叠的对话。")
+        compaction_prompt_template = current_app.config.get('COMPACTION_PROMPT')
+        if not compaction_prompt_template:
+             return ModuleOutput(success=False, message="未配置增量摘要提示词模板 (COMPACTION_PROMPT)。")
+
+        prompt_text = compaction_prompt_template.format(
+            previous_summary=previous_summary or "(无)",
+            conversation_history=cls._format_history(messages)
+        )
+        return cls._request_summary(prompt_text, temp_keys)
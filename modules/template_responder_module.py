@@ -0,0 +1,126 @@
+# D:\python_code\LocalAgent\modules\template_responder_module.py
+import re
+import threading
+from flask import current_app
+from modules.common import DialogueState, UserType, EmotionType, TokenizedText
+from modules.lexicon_module import LexiconModule
+
+
+class TemplateResponderModule:
+    """
+    问候与能力试探类轮次的模板快速回复：用户分析之后查 TEMPLATE_RESPONSES 意图表，
+    消息本身就是该意图 (去掉意图关键词后剩余不超过 TEMPLATE_MAX_LEFTOVER_CHARS 个字符，且长度不超过 max_chars)、
+    会话历史很短且风险低时直接返回预先渲染的回复，跳过模型调用。
+    "你好，我失恋了" 这类带有实际内容的消息必须交给模型；英文关键词按整词匹配 ("hi" 不匹配 "this")。
+    危机状态、危机情绪或强度达到 TEMPLATE_MAX_NEGATIVE_INTENSITY 的消极情绪永远不使用模板。
+    意图关键词注册到共享词表 (命名空间 "intent")，与安全/情感分析共用一次扫描；按意图统计命中率。
+    """
+    STATS_KEY = "template_fastpath:stats"
+    _registered_table = None # 已注册到词表的意图表 (配置对象)
+    _rendered: dict = {}     # 意图 -> 渲染后的回复
+    _patterns: dict = {}     # 意图 -> 关键词正则 (用于计算消息被关键词覆盖的部分)
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get_redis_client(cls):
+        return getattr(current_app, 'redis_client', None)
+
+    @classmethod
+    def register_intents(cls, app=None) -> bool:
+        # 把意图关键词注册到共享词表并预先渲染回复模板；表未变化时不重复注册，返回是否本次注册
+        config = (app or current_app).config
+        table = config.get('TEMPLATE_RESPONSES', {})
+        if table is cls._registered_table: return False
+        with cls._lock:
+            if table is cls._registered_table: return False
+            variables = config.get('TEMPLATE_VARIABLES', {})
+            cls._rendered = {intent: entry["response"].format(**variables) for intent, entry in table.items()}
+            cls._patterns = {intent: [cls._keyword_regex(keyword) for keyword in entry.get("keywords", [])] for intent, entry in table.items()}
+            LexiconModule.register("intent", {intent: entry.get("keywords", []) for intent, entry in table.items()})
+            cls._registered_table = table
+        return True
+
+    @staticmethod
+    def _keyword_regex(keyword: str):
+        # 英文关键词前后不能紧接字母数字 (整词)，中文关键词按子串
+        keyword = keyword.lower()
+        if keyword.isascii(): return re.compile(rf'(?<![a-z0-9]){re.escape(keyword)}(?![a-z0-9])')
+        return re.compile(re.escape(keyword))
+
+    @classmethod
+    def _dominant_intent(cls, text: str, intents) -> str | None:
+        # 去掉所有出现的意图关键词后剩余字符足够少时，返回覆盖字符最多的意图 ("你好，你是谁" -> identity)，否则 None
+        leftover, covered = text, {}
+        for intent in intents:
+            remaining, count = text, 0
+            for regex in cls._patterns.get(intent, []):
+                remaining, n = regex.subn("", remaining)
+                count += n
+                leftover = regex.sub("", leftover)
+            if count: covered[intent] = len(text) - len(remaining)
+        if not covered: return None
+        if len(re.sub(r'\s+', '', leftover)) > current_app.config.get('TEMPLATE_MAX_LEFTOVER_CHARS', 1): return None
+        return max(covered, key=covered.get)
+
+    @staticmethod
+    def is_low_risk(state: DialogueState) -> bool:
+        # 危机或高强度消极情绪的轮次必须交给模型
+        if state.is_crisis or state.user_type == UserType.CRISIS or state.user_emotion == EmotionType.CRISIS: return False
+        if state.user_emotion == EmotionType.NEGATIVE and state.emotion_intensity >= current_app.config.get('TEMPLATE_MAX_NEGATIVE_INTENSITY', 0.6):
+            return False
+        return True
+
+    @classmethod
+    def match(cls, tokenized: TokenizedText, state: DialogueState, history: list | None = None) -> dict | None:
+        # 返回 {"intent", "response"}，不适用时返回 None
+        config = current_app.config
+        if not config.get('TEMPLATE_FASTPATH_ENABLED', True): return None
+        if history is not None:
+            completed_turns = sum(1 for m in history if m.get("role") == "user") - 1 # 历史中已包含本轮用户消息
+            if completed_turns > config.get('TEMPLATE_MAX_TURNS', 2): return None
+
+        freshly_registered = cls.register_intents()
+        # 刚注册时本轮的缓存扫描结果不含意图关键词，重新扫描一次
+        hits = LexiconModule.scan(tokenized.normalized) if freshly_registered else LexiconModule.scan(tokenized)
+        intents = hits.by_category("intent")
+        if not intents: return None
+
+        cls._count("checked")
+        # 关键词扫描只做预筛选：消息必须几乎完全由意图关键词构成
+        intent = cls._dominant_intent(tokenized.cleaned, intents)
+        if intent is None:
+            for name in intents: cls._count(f"{name}:blocked")
+            return None
+        entry = config.get('TEMPLATE_RESPONSES', {}).get(intent, {})
+        user_types = entry.get("user_types")
+        if len(re.sub(r'\s+', '', tokenized.cleaned)) > entry.get("max_chars", 8) \
+                or (user_types and getattr(state.user_type, 'value', None) not in user_types) \
+                or not cls.is_low_risk(state):
+            cls._count(f"{intent}:blocked")
+            return None
+        cls._count(f"{intent}:served")
+        print(f"[模板回复] 命中意图 {intent}，跳过模型调用")
+        return {"intent": intent, "response": cls._rendered.get(intent, "")}
+
+    @classmethod
+    def _count(cls, field: str):
+        redis = cls._get_redis_client()
+        if redis is None: return
+        try: redis.hincrby(cls.STATS_KEY, field, 1)
+        except Exception as e: print(f"[模板回复] 更新统计失败: {e}")
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        # 按意图的命中统计：served / blocked 以及命中率 (served / 含意图关键词的轮次)
+        redis = cls._get_redis_client()
+        if redis is None: return {}
+        try: raw = {k: int(v) for k, v in redis.hgetall(cls.STATS_KEY).items()}
+        except Exception as e:
+            print(f"[模板回复] 读取统计失败: {e}"); return {}
+        checked = raw.get("checked", 0)
+        stats = {"checked": checked, "intents": {}}
+        for intent in current_app.config.get('TEMPLATE_RESPONSES', {}):
+            served, blocked = raw.get(f"{intent}:served", 0), raw.get(f"{intent}:blocked", 0)
+            stats["intents"][intent] = {"served": served, "blocked": blocked,
+                                        "hit_rate": round(served / checked, 4) if checked else 0.0}
+        return stats
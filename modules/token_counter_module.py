@@ -0,0 +1,52 @@
+# D:\python_code\LocalAgent\modules\token_counter_module.py
+import re
+from flask import current_app
+
+
+class TokenCounterModule:
+    """
+    按模型家族估算 token 数 (不依赖各模型的分词器)。
+    文本按字符类别计数：汉字/全角字符、英文单词与数字串、其余非空白符号，
+    再乘以 TOKEN_COUNT_RATIOS 中该家族的系数。系数按各家分词器在中文对话上的实测比例设定，误差由上下文余量吸收。
+    """
+    CJK_REGEX = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+    WORD_REGEX = re.compile(r'[A-Za-z]+|\d+')
+    SYMBOL_REGEX = re.compile(r'[^\sA-Za-z\d\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+    MESSAGE_OVERHEAD = 4 # 每条消息的角色标记与分隔符开销
+
+    DEFAULT_RATIOS = {"default": (1.0, 1.3, 1.0)}
+
+    @staticmethod
+    def _ratios() -> dict:
+        return current_app.config.get('TOKEN_COUNT_RATIOS') or TokenCounterModule.DEFAULT_RATIOS
+
+    @classmethod
+    def family(cls, model: str | None) -> str:
+        # 模型名包含的家族关键字 (如 "qwen2:latest" -> "qwen")，未匹配返回 "default"
+        model_lower = (model or "").lower()
+        for name in cls._ratios():
+            if name != "default" and name in model_lower: return name
+        return "default"
+
+    @classmethod
+    def count(cls, text: str, family: str = "default") -> int:
+        # 估算单段文本的 token 数
+        if not text: return 0
+        ratios = cls._ratios()
+        cjk_ratio, word_ratio, symbol_ratio = ratios.get(family) or ratios.get("default") or cls.DEFAULT_RATIOS["default"]
+        estimate = (len(cls.CJK_REGEX.findall(text)) * cjk_ratio
+                    + len(cls.WORD_REGEX.findall(text)) * word_ratio
+                    + len(cls.SYMBOL_REGEX.findall(text)) * symbol_ratio)
+        return int(estimate) + 1
+
+    @classmethod
+    def count_all(cls, text: str) -> dict:
+        # 按所有已配置家族估算，写入历史条目的 "tokens" 字段
+        return {name: cls.count(text, name) for name in cls._ratios()}
+
+    @classmethod
+    def message_tokens(cls, message: dict, family: str = "default") -> int:
+        # 单条消息的 token 数：优先使用历史条目中缓存的值
+        cached = message.get("tokens")
+        if isinstance(cached, dict) and family in cached: return cached[family] + cls.MESSAGE_OVERHEAD
+        return cls.count(str(message.get("content", "")), family) + cls.MESSAGE_OVERHEAD
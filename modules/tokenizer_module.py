@@ -0,0 +1,65 @@
+# D:\python_code\LocalAgent\modules\tokenizer_module.py
+import os
+import threading
+import time
+import jieba
+from flask import current_app, has_app_context
+
+
+class TokenizerModule:
+    """
+    jieba 分词服务：进程启动时 (create_app 中，Celery prefork 在 fork 子进程之前) 显式加载词典，
+    子进程以写时复制方式共享已加载的词典，首个用户消息不再承担约 1 秒的词典构建。
+    词典序列化缓存写到 JIEBA_CACHE_FILE，之后的启动直接加载缓存；
+    JIEBA_USER_DICT 中的领域词 (每行 "词 [词频] [词性]") 加载后参与分词。
+    加载耗时记录在 get_stats() 中，并通过 /api/cache_stats 输出。
+    """
+    _stats: dict = {"loaded": False}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _resolve(path: str | None, root: str) -> str | None:
+        if not path: return None
+        return path if os.path.isabs(path) else os.path.join(root, path)
+
+    @classmethod
+    def initialize(cls, app=None) -> dict:
+        # 加载词典与自定义词 (已加载时直接返回)，返回统计信息
+        if cls._stats.get("loaded"): return cls._stats
+        if app is None and has_app_context(): app = current_app
+        config = app.config if app is not None else {}
+        root = app.root_path if app is not None else os.getcwd()
+        with cls._lock:
+            if cls._stats.get("loaded"): return cls._stats
+            started = time.perf_counter()
+            cache_file = cls._resolve(config.get('JIEBA_CACHE_FILE'), root)
+            if cache_file:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                jieba.dt.cache_file = cache_file
+            # 缓存文件已存在时 jieba 直接反序列化，否则从词典构建并写出缓存
+            source = "cache" if cache_file and os.path.isfile(cache_file) else "built"
+            jieba.initialize()
+
+            user_words = 0
+            user_dict = cls._resolve(config.get('JIEBA_USER_DICT'), root)
+            if user_dict and os.path.isfile(user_dict):
+                try:
+                    jieba.load_userdict(user_dict)
+                    with open(user_dict, 'r', encoding='utf-8') as f: user_words = sum(1 for line in f if line.strip())
+                except Exception as e:
+                    print(f"[分词] 加载自定义词典 {user_dict} 失败: {e}")
+
+            load_ms = round((time.perf_counter() - started) * 1000, 1)
+            cls._stats = {"loaded": True, "source": source, "load_ms": load_ms, "user_words": user_words, "pid": os.getpid()}
+            print(f"[分词] jieba 词典加载完成 ({'序列化缓存' if source == 'cache' else '重新构建'})，耗时 {load_ms}ms，自定义词 {user_words} 个")
+        return cls._stats
+
+    @classmethod
+    def cut(cls, text: str) -> list:
+        # 分词 (未预加载时先加载词典)
+        if not cls._stats.get("loaded"): cls.initialize()
+        return jieba.lcut(text)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        return dict(cls._stats)
@@ -0,0 +1,332 @@
+# D:\python_code\LocalAgent\modules\transcript_log_module.py
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, has_app_context
+try:
+    import fcntl # 跨进程文件锁 (POSIX)
+except ImportError: # Windows 下只做进程内加锁
+    fcntl = None
+
+
+class TranscriptLogModule:
+    """
+    旧版 app.py 的聊天记录存储：分段追加日志 + 会话偏移索引，代替逐行扫描/整体重写的 context.txt。
+    - 记录按 JSON 行追加到 TRANSCRIPT_LOG_DIR 下的 segment-NNNNNN.log，超过 TRANSCRIPT_SEGMENT_BYTES 后滚动到新段；
+    - index.log 为追加写的索引 (会话, 序号, 段号, 偏移, 长度)，删除会话只追加一条墓碑，不改动段文件；
+    - 各进程在内存中维护索引，每次操作前只读取 index.log 新增的部分，读取会话时按偏移直接 seek；
+    - 后台压缩线程把死数据比例达到 TRANSCRIPT_COMPACT_DEAD_RATIO 的已封存段中的存活记录搬到新段，删除旧段并重写索引；
+      重写后的 index.log 首行为代数 {"gen": N}，其他进程发现代数变化 (或文件变短) 时完整重新加载。
+    写入与压缩持有排他文件锁 (fcntl)，读取持有共享锁。首次使用时导入旧的 CONTEXT_FILE。
+    Windows 下没有 fcntl，只做进程内加锁，此时只支持单个进程使用同一个 TRANSCRIPT_LOG_DIR。
+    index.log 不保持打开，只在读写时短暂打开，因此 Windows 下重写索引时的 os.replace 不会因文件被占用而失败。
+    """
+    SEGMENT_FORMAT = "segment-{:06d}.log"
+    SEGMENT_REGEX = re.compile(r'^segment-(\d+)\.log$')
+    INDEX_FILE = "index.log"
+    TOMBSTONE = "_tombstone" # append_many 中带此字段的项为删除标记，与记录按提交顺序写入索引
+    LOCK_FILE = ".lock"
+    _lock = threading.RLock()
+    _settings: dict | None = None
+    _index: dict = {}      # 会话 ID -> {序号: (段号, 偏移, 长度)}
+    _index_pos = 0         # index.log 已读取到的位置
+    _index_gen = 0         # 已加载的 index.log 代数 (每次重写加一；没有代数首行的文件为 0)
+    _index_lines = 0       # index.log 的行数 (含被覆盖的记录与墓碑)，决定何时重写索引
+    _next_seq = 0
+    _active = 1            # 当前写入的段号
+    _unsynced: set = set() # 写入后尚未 fsync 的段号 (由 sync() 落盘)
+    _owner_pid = None      # 启动压缩线程的进程 (fork 后的子进程需要重新启动)
+
+    @staticmethod
+    def _load_settings() -> dict:
+        config = current_app.config if has_app_context() else {}
+        return {
+            "dir": os.path.abspath(config.get('TRANSCRIPT_LOG_DIR', 'transcripts')),
+            "legacy_file": config.get('CONTEXT_FILE', 'context.txt'),
+            "segment_bytes": config.get('TRANSCRIPT_SEGMENT_BYTES', 64 * 1024 * 1024),
+            "compact_interval": config.get('TRANSCRIPT_COMPACT_INTERVAL', 300),
+            "dead_ratio": config.get('TRANSCRIPT_COMPACT_DEAD_RATIO', 0.5),
+        }
+
+    @classmethod
+    def initialize(cls):
+        # 首次使用时加载索引 (并导入旧文件)；每个进程启动一次压缩线程。
+        # 配置在首次调用时从 current_app 读取，后台线程写入前应先在应用上下文中调用一次
+        if cls._settings is not None and cls._owner_pid == os.getpid(): return
+        with cls._lock:
+            if cls._settings is None:
+                settings = cls._load_settings()
+                os.makedirs(settings["dir"], exist_ok=True)
+                cls._settings = settings
+                with cls._locked():
+                    cls._catch_up()
+                    cls._migrate_legacy()
+            if cls._owner_pid != os.getpid():
+                cls._owner_pid = os.getpid()
+                cls._start_compactor()
+
+    @classmethod
+    @contextmanager
+    def _locked(cls, exclusive: bool = True):
+        with cls._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(cls._settings["dir"], cls.LOCK_FILE), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try: yield
+                finally: fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @classmethod
+    def _path(cls, name: str) -> str:
+        return os.path.join(cls._settings["dir"], name)
+
+    @classmethod
+    def _segment_path(cls, segment: int) -> str:
+        return cls._path(cls.SEGMENT_FORMAT.format(segment))
+
+    @classmethod
+    def _segments(cls) -> list:
+        segments = []
+        for name in os.listdir(cls._settings["dir"]):
+            match = cls.SEGMENT_REGEX.match(name)
+            if match: segments.append(int(match.group(1)))
+        return sorted(segments)
+
+    # --- 索引 ---
+    @classmethod
+    def _apply(cls, entry: dict):
+        cls._index_lines += 1
+        sid = entry.get("s")
+        if entry.get("t"): # 墓碑
+            cls._index.pop(sid, None)
+            return
+        cls._index.setdefault(sid, {})[entry["q"]] = (entry["g"], entry["o"], entry["n"])
+        cls._next_seq = max(cls._next_seq, entry["q"] + 1)
+        cls._active = max(cls._active, entry["g"])
+
+    @staticmethod
+    def _read_generation(f) -> int:
+        # 读取首行的代数；首行不是代数行 (旧文件或从未重写过) 时为 0
+        first = f.readline()
+        if not first.startswith(b'{"gen"'): return 0
+        try: return int(json.loads(first)["gen"])
+        except (json.JSONDecodeError, KeyError, ValueError): return 0
+
+    @classmethod
+    def _catch_up(cls):
+        # 读取其他进程追加的索引行；index.log 被压缩重写 (代数变化或文件变短) 时完整重新加载
+        try: f = open(cls._path(cls.INDEX_FILE), 'rb')
+        except FileNotFoundError: return
+        with f:
+            generation = cls._read_generation(f)
+            size = f.seek(0, os.SEEK_END)
+            if generation != cls._index_gen or size < cls._index_pos:
+                cls._index, cls._index_pos, cls._index_lines, cls._next_seq = {}, 0, 0, 0
+                cls._index_gen = generation
+                cls._active = max(cls._segments(), default=1)
+            f.seek(cls._index_pos)
+            data = f.read()
+        if not data: return
+        end = data.rfind(b"\n") + 1 # 只处理完整的行
+        for line in data[:end].splitlines():
+            if not line.strip() or line.startswith(b'{"gen"'): continue
+            try: cls._apply(json.loads(line))
+            except (json.JSONDecodeError, KeyError): print(f"[聊天记录] 跳过无效的索引行: {line[:80]!r}")
+        cls._index_pos += end
+
+    @classmethod
+    def _append_index(cls, entries: list, fsync: bool = False):
+        # 调用方持有排他锁且已 _catch_up，写入位置即当前文件末尾
+        data = b"".join((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8") for entry in entries)
+        with open(cls._path(cls.INDEX_FILE), 'ab') as f:
+            size = f.seek(0, os.SEEK_END)
+            # 末尾残留不完整的行 (写入途中进程崩溃) 时先补换行，避免与本次写入粘连
+            if size > cls._index_pos: data = b"\n" + data
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        cls._index_pos = size + len(data)
+        for entry in entries: cls._apply(entry)
+
+    @classmethod
+    def _write_records(cls, records: list, fsync: bool = False) -> list:
+        # records: [(会话 ID, 序号, JSON 行字节)]，一次写入当前段 (已满时滚动到新段)，返回对应的索引项
+        if not records: return []
+        segment = cls._active
+        try: offset = os.path.getsize(cls._segment_path(segment))
+        except FileNotFoundError: offset = 0
+        if offset >= cls._settings["segment_bytes"]: segment, offset = segment + 1, 0
+        with open(cls._segment_path(segment), 'ab') as f:
+            f.write(b"".join(line for _, _, line in records))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+            else: cls._unsynced.add(segment)
+        cls._active = segment
+        entries = []
+        for sid, seq, line in records:
+            entries.append({"s": sid, "q": seq, "g": segment, "o": offset, "n": len(line)})
+            offset += len(line)
+        return entries
+
+    @staticmethod
+    def _encode(item: dict) -> bytes:
+        return (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+
+    # --- 公共接口 ---
+    @classmethod
+    def append_many(cls, items: list, fsync: bool = False):
+        # 追加多条记录：段文件与索引各一次写入；fsync 为 True 时写入后落盘
+        # 删除标记项 ({"session_id": ..., TOMBSTONE: 1}) 按在 items 中的位置写入墓碑
+        if not items: return
+        cls.initialize()
+        lines = [(item.get("session_id"), None if item.get(cls.TOMBSTONE) else cls._encode(item)) for item in items]
+        with cls._locked():
+            cls._catch_up()
+            records = [(sid, cls._next_seq + i, line) for i, (sid, line) in enumerate(item for item in lines if item[1] is not None)]
+            entries = iter(cls._write_records(records, fsync))
+            cls._append_index([next(entries) if line is not None else {"s": sid, "t": 1} for sid, line in lines], fsync)
+
+    @classmethod
+    def append(cls, item: dict, fsync: bool = False):
+        cls.append_many([item], fsync)
+
+    @classmethod
+    def read_session(cls, sid: str) -> list:
+        # 按索引偏移直接读取该会话的记录 (按写入顺序)，与日志总大小无关
+        cls.initialize()
+        records = []
+        with cls._locked(exclusive=False):
+            cls._catch_up()
+            locations = [location for _, location in sorted(cls._index.get(sid, {}).items())]
+            handles = {}
+            try:
+                for segment, offset, length in locations:
+                    f = handles.get(segment)
+                    if f is None: f = handles[segment] = open(cls._segment_path(segment), 'rb')
+                    f.seek(offset)
+                    line = f.read(length)
+                    try: records.append(json.loads(line))
+                    except json.JSONDecodeError: print(f"[聊天记录] 跳过无效的记录: 段 {segment} 偏移 {offset}")
+            finally:
+                for f in handles.values(): f.close()
+        return records
+
+    @classmethod
+    def sync(cls):
+        # 把此前未 fsync 的段文件与 index.log 落盘 (不创建已被压缩删除的段)
+        cls.initialize()
+        with cls._lock:
+            paths = [cls._segment_path(segment) for segment in sorted(cls._unsynced)] + [cls._path(cls.INDEX_FILE)]
+            cls._unsynced.clear()
+            for path in paths:
+                try: fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+                except FileNotFoundError: continue
+                try: os.fsync(fd)
+                finally: os.close(fd)
+
+    @classmethod
+    def delete_session(cls, sid: str) -> bool:
+        # 追加墓碑；占用的空间由压缩线程回收
+        cls.initialize()
+        with cls._locked():
+            cls._catch_up()
+            if sid not in cls._index: return False
+            cls._append_index([{"s": sid, "t": 1}])
+        return True
+
+    @classmethod
+    def compact(cls, force: bool = False) -> dict:
+        # 回收空间：死数据比例达到阈值 (force 时只要有死数据) 的已封存段中的存活记录搬到新段，删除旧段；
+        # 有段被回收或索引中失效行过多时重写 index.log
+        cls.initialize()
+        started = time.perf_counter()
+        with cls._locked():
+            cls._catch_up()
+            live_bytes = {}
+            for locations in cls._index.values():
+                for segment, _, length in locations.values(): live_bytes[segment] = live_bytes.get(segment, 0) + length
+
+            candidates = []
+            for segment in cls._segments():
+                if segment == cls._active: continue
+                size = os.path.getsize(cls._segment_path(segment))
+                dead_ratio = 1 - live_bytes.get(segment, 0) / size if size else 1.0
+                if dead_ratio >= cls._settings["dead_ratio"] or (force and dead_ratio > 0): candidates.append(segment)
+
+            moved = 0
+            if candidates:
+                # 按段内顺序读出存活记录，保持原序号 (会话内顺序不变)
+                chosen = set(candidates)
+                pending = sorted(((location, sid, seq) for sid, locations in cls._index.items()
+                                  for seq, location in locations.items() if location[0] in chosen))
+                records, handles = [], {}
+                try:
+                    for (segment, offset, length), sid, seq in pending:
+                        f = handles.get(segment)
+                        if f is None: f = handles[segment] = open(cls._segment_path(segment), 'rb')
+                        f.seek(offset)
+                        records.append((sid, seq, f.read(length)))
+                finally:
+                    for f in handles.values(): f.close()
+                # 搬到新段 (不与当前段混写，旧段的记录集中在一起)
+                cls._active = max(cls._segments(), default=cls._active) + 1
+                entries = cls._write_records(records)
+                for entry in entries: cls._index[entry["s"]][entry["q"]] = (entry["g"], entry["o"], entry["n"])
+                moved = len(entries)
+
+            live_entries = sum(len(locations) for locations in cls._index.values())
+            if candidates or cls._index_lines > 2 * live_entries + 1000:
+                cls._rewrite_index()
+            for segment in candidates: os.remove(cls._segment_path(segment)) # 索引已指向新位置后再删除
+        result = {"segments_reclaimed": len(candidates), "records_moved": moved, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+        if candidates: print(f"[聊天记录] 压缩完成: 回收 {len(candidates)} 个段，搬移 {moved} 条记录，耗时 {result['elapsed_ms']}ms")
+        return result
+
+    @classmethod
+    def _rewrite_index(cls):
+        # 只保留存活的索引项，首行写入新的代数，写入临时文件后原子替换；其他进程检测到代数变化后重新加载
+        tmp_path = cls._path(cls.INDEX_FILE + ".tmp")
+        generation = cls._index_gen + 1
+        entries = [{"s": sid, "q": seq, "g": segment, "o": offset, "n": length}
+                   for sid, locations in cls._index.items() for seq, (segment, offset, length) in sorted(locations.items())]
+        data = b"".join((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8") for entry in [{"gen": generation}] + entries)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, cls._path(cls.INDEX_FILE))
+        cls._index_gen, cls._index_pos, cls._index_lines = generation, len(data), len(entries)
+
+    @classmethod
+    def _migrate_legacy(cls):
+        # 索引为空时导入旧的单文件聊天记录 (只读，不修改原文件)
+        legacy_file = cls._settings["legacy_file"]
+        if os.path.exists(cls._path(cls.INDEX_FILE)) or not legacy_file or not os.path.isfile(legacy_file): return
+        records = []
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip(): continue
+                try: item = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"导入时跳过无效JSON行: {line.strip()}"); continue
+                records.append((item.get("session_id"), cls._next_seq + len(records), cls._encode(item)))
+        if not records: return
+        cls._append_index(cls._write_records(records))
+        print(f"[聊天记录] 已从 {legacy_file} 导入 {len(records)} 条记录")
+
+    @classmethod
+    def _start_compactor(cls):
+        interval = cls._settings["compact_interval"]
+        if not interval or interval <= 0: return
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try: cls.compact()
+                except Exception as e: print(f"[聊天记录] 压缩失败: {e}")
+        threading.Thread(target=_loop, name="transcript-compactor", daemon=True).start()
@@ -0,0 +1,195 @@
+# D:\python_code\LocalAgent\modules\transcript_writer_module.py
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from flask import current_app, has_app_context
+from modules.transcript_log_module import TranscriptLogModule
+
+
+class TranscriptWriterModule:
+    """
+    聊天记录的后写 (write-behind) 写入器：请求线程只把记录放入内存队列，
+    后台线程按批量 (TRANSCRIPT_FLUSH_BATCH 条) 或时间 (TRANSCRIPT_FLUSH_INTERVAL 秒) 合并成一次段文件写入 + 一次索引写入。
+    - 队列上限 TRANSCRIPT_QUEUE_MAX 条；队列满时最多等待 TRANSCRIPT_ENQUEUE_TIMEOUT 秒，仍满则在请求线程中同步写入 (不丢记录)；
+    - 落盘策略 TRANSCRIPT_FSYNC：always 每批 fsync，interval 至多每 TRANSCRIPT_FSYNC_INTERVAL 秒一次，never 交给操作系统；
+    - 进程正常退出时 (atexit) 在 TRANSCRIPT_SHUTDOWN_TIMEOUT 秒内写完队列；异常终止时最多丢失一个刷新间隔内的记录。
+    - interval 策略下空闲时也会在间隔到期后 fsync 尚未落盘的批次，不必等到下一批写入。
+    删除会话通过 delete() 以删除标记排入同一队列，保证排在此前提交的记录之后；读取会话前先调用 flush()。
+    """
+    _queue: deque = deque()
+    _cond = threading.Condition()
+    _settings: dict | None = None
+    _thread = None
+    _owner_pid = None     # 启动后台线程的进程 (fork 后子进程重新启动，并丢弃从父进程复制来的队列)
+    _in_flight = 0        # 已取出、正在写入的条数
+    _flush_requested = False
+    _closing = False
+    _last_fsync = 0.0
+    _dirty = False        # interval 策略下已写出但尚未 fsync
+    _stats: dict = {"enqueued": 0, "written": 0, "batches": 0, "fsyncs": 0, "sync_fallbacks": 0, "write_errors": 0, "max_batch": 0}
+
+    @staticmethod
+    def _load_settings() -> dict:
+        config = current_app.config if has_app_context() else {}
+        return {
+            "enabled": config.get('TRANSCRIPT_WRITE_BEHIND', True),
+            "queue_max": config.get('TRANSCRIPT_QUEUE_MAX', 10000),
+            "flush_batch": config.get('TRANSCRIPT_FLUSH_BATCH', 256),
+            "flush_interval": config.get('TRANSCRIPT_FLUSH_INTERVAL', 0.2),
+            "fsync": config.get('TRANSCRIPT_FSYNC', 'interval'),
+            "fsync_interval": config.get('TRANSCRIPT_FSYNC_INTERVAL', 1.0),
+            "enqueue_timeout": config.get('TRANSCRIPT_ENQUEUE_TIMEOUT', 0.5),
+            "shutdown_timeout": config.get('TRANSCRIPT_SHUTDOWN_TIMEOUT', 5),
+        }
+
+    @classmethod
+    def _ensure_started(cls):
+        if cls._settings is not None and cls._owner_pid == os.getpid(): return
+        with cls._cond:
+            if cls._settings is None:
+                cls._settings = cls._load_settings()
+                TranscriptLogModule.initialize() # 在应用上下文中读取日志配置，后台线程不再依赖 current_app
+                atexit.register(cls.shutdown)
+            if cls._owner_pid != os.getpid():
+                cls._owner_pid = os.getpid()
+                cls._queue.clear() # 父进程的记录由父进程写入
+                cls._in_flight, cls._flush_requested, cls._closing = 0, False, False
+                if cls._settings["enabled"]:
+                    cls._thread = threading.Thread(target=cls._run, name="transcript-writer", daemon=True)
+                    cls._thread.start()
+
+    @classmethod
+    def _should_fsync(cls) -> bool:
+        policy = cls._settings["fsync"]
+        if policy == "always": return True
+        if policy != "interval": return False
+        now = time.monotonic()
+        if now - cls._last_fsync < cls._settings["fsync_interval"]: return False
+        cls._last_fsync = now
+        return True
+
+    @classmethod
+    def _fsync_due(cls) -> bool:
+        # interval 策略下有未落盘的批次且已到间隔 (空闲时由后台线程补做 fsync)
+        return cls._dirty and time.monotonic() - cls._last_fsync >= cls._settings["fsync_interval"]
+
+    @classmethod
+    def _sync(cls):
+        if not cls._dirty: return
+        try:
+            TranscriptLogModule.sync()
+            cls._dirty = False
+            cls._last_fsync = time.monotonic()
+            cls._stats["fsyncs"] += 1
+        except OSError as e:
+            print(f"[聊天记录] 落盘失败: {e}")
+
+    @classmethod
+    def submit(cls, item: dict):
+        # 放入队列后立即返回；未启用后写或队列持续满时同步写入
+        cls._ensure_started()
+        if cls._thread is None:
+            TranscriptLogModule.append(item, fsync=cls._settings["fsync"] == "always")
+            return
+        with cls._cond:
+            if len(cls._queue) >= cls._settings["queue_max"]:
+                cls._flush_requested = True
+                cls._cond.notify_all()
+                cls._cond.wait_for(lambda: len(cls._queue) < cls._settings["queue_max"], timeout=cls._settings["enqueue_timeout"])
+            if len(cls._queue) < cls._settings["queue_max"] and not cls._closing:
+                cls._queue.append(item)
+                cls._stats["enqueued"] += 1
+                if len(cls._queue) >= cls._settings["flush_batch"]: cls._cond.notify_all()
+                return
+            cls._stats["sync_fallbacks"] += 1
+        print("[聊天记录] 写入队列已满或正在关闭，本条记录同步写入")
+        TranscriptLogModule.append(item, fsync=cls._settings["fsync"] == "always")
+
+    @classmethod
+    def delete(cls, sid: str):
+        # 删除会话：删除标记与记录走同一队列，写入顺序与提交顺序一致
+        cls.submit({"session_id": sid, TranscriptLogModule.TOMBSTONE: 1})
+
+    @classmethod
+    def _run(cls):
+        batch_max = cls._settings["flush_batch"]
+        interval = cls._settings["flush_interval"]
+        while True:
+            with cls._cond:
+                # 攒够一批、等满一个刷新间隔、或有 flush/退出请求时写出；空闲且 fsync 到期时补做 fsync
+                deadline = time.monotonic() + interval
+                while len(cls._queue) < batch_max and not cls._flush_requested and not cls._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 and cls._queue: break
+                    cls._cond.wait(timeout=remaining if remaining > 0 else interval)
+                    if not cls._queue:
+                        if cls._fsync_due(): break
+                        deadline = time.monotonic() + interval # 空闲时不计时
+                closing, batch = cls._closing, None
+                if not cls._queue:
+                    cls._flush_requested = False
+                    cls._cond.notify_all()
+                else:
+                    batch = [cls._queue.popleft() for _ in range(min(batch_max, len(cls._queue)))]
+                    cls._in_flight = len(batch)
+            if batch is None:
+                if closing or cls._fsync_due(): cls._sync() # 退出前也落盘 interval 策略下未 fsync 的批次
+                if closing: return
+                continue
+            cls._write(batch)
+            with cls._cond:
+                cls._in_flight = 0
+                cls._cond.notify_all() # 唤醒等待队列空位或等待 flush 完成的线程
+
+    @classmethod
+    def _write(cls, batch: list):
+        try:
+            fsync = cls._should_fsync()
+            TranscriptLogModule.append_many(batch, fsync=fsync)
+            cls._stats["written"] += len(batch)
+            cls._stats["batches"] += 1
+            cls._stats["max_batch"] = max(cls._stats["max_batch"], len(batch))
+            if fsync: cls._stats["fsyncs"] += 1
+            cls._dirty = not fsync and cls._settings["fsync"] == "interval"
+        except Exception as e:
+            # 写入失败时放回队首 (队列已满则丢弃)，稍后重试
+            cls._stats["write_errors"] += 1
+            print(f"[聊天记录] 批量写入失败 ({len(batch)} 条): {e}")
+            with cls._cond:
+                room = cls._settings["queue_max"] - len(cls._queue)
+                cls._queue.extendleft(reversed(batch[:max(room, 0)]))
+                if len(batch) > room: print(f"[聊天记录] 队列已满，丢弃 {len(batch) - max(room, 0)} 条记录")
+            time.sleep(min(1.0, cls._settings["flush_interval"] * 5))
+
+    @classmethod
+    def flush(cls, timeout: float | None = 5.0) -> bool:
+        # 等待队列中 (含正在写入) 的记录全部写出，返回是否在超时前完成 (timeout=None 时一直等待)
+        if cls._thread is None or cls._owner_pid != os.getpid(): return True
+        with cls._cond:
+            if not cls._queue and not cls._in_flight: return True
+            cls._flush_requested = True
+            cls._cond.notify_all()
+            return cls._cond.wait_for(lambda: not cls._queue and not cls._in_flight, timeout=timeout)
+
+    @classmethod
+    def shutdown(cls):
+        # 进程退出时写完队列 (有时间上限)
+        if cls._thread is None or cls._owner_pid != os.getpid(): return
+        timeout = cls._settings["shutdown_timeout"]
+        with cls._cond:
+            pending = len(cls._queue) + cls._in_flight
+            cls._closing = True
+            cls._cond.notify_all()
+        cls._thread.join(timeout)
+        if cls._thread.is_alive() or cls._queue:
+            print(f"[聊天记录] 退出时未能在 {timeout} 秒内写完，剩余 {len(cls._queue)} 条记录")
+        elif pending:
+            print(f"[聊天记录] 退出前已写出队列中的 {pending} 条记录")
+        cls._thread = None
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._cond:
+            return {**cls._stats, "queued": len(cls._queue), "in_flight": cls._in_flight}
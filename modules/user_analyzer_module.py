@@ -1,12 +1,12 @@
 # D:\python_code\LocalAgent\modules\user_analyzer_module.py
-from .common import ModuleOutput, UserType, EmotionType
-import re
+from .common import ModuleOutput, UserType, EmotionType, TokenizedText
+from .lexicon_module import LexiconModule
 
 class UserAnalyzerModule:
-    USER_TYPE_PATTERNS = {
-        UserType.EXPLORATORY: re.compile(r'我想了解|是什么|为什么|心理学|知识|概念|区别是', re.IGNORECASE),
-        UserType.SEEKING_SOLUTIONS: re.compile(r'怎么办|如何解决|怎样才能|给我建议|需要方法|有办法吗', re.IGNORECASE),
-        UserType.TESTING: re.compile(r'你觉得我|你认为|测试一下|你是谁|你能做什么|你的能力', re.IGNORECASE),
+    USER_TYPE_KEYWORDS = { # 按顺序匹配，先命中的类型优先
+        UserType.EXPLORATORY: ['我想了解', '是什么', '为什么', '心理学', '知识', '概念', '区别是'],
+        UserType.SEEKING_SOLUTIONS: ['怎么办', '如何解决', '怎样才能', '给我建议', '需要方法', '有办法吗'],
+        UserType.TESTING: ['你觉得我', '你认为', '测试一下', '你是谁', '你能做什么', '你的能力'],
     }
     COGNITIVE_DISTORTION_KEYWORDS = {
         "非黑即白": ['必须', '应该', '一定', '要么...要么', '不是...就是', '永远', '从不'],
@@ -19,12 +19,15 @@ class UserAnalyzerModule:
     }
 
     @classmethod
-    def analyze(cls, text: str, emotion_type: EmotionType) -> ModuleOutput:
+    def analyze(cls, text: str | TokenizedText, emotion_type: EmotionType) -> ModuleOutput:
         identified_type = UserType.UNKNOWN
-        detected_distortions = []
+        # 共享词表的一次扫描结果：用户类型与认知扭曲各读自己的部分
+        lexicon_hits = LexiconModule.scan(text)
+        type_hits = lexicon_hits.by_category("user_type")
+        detected_distortions = list(lexicon_hits.by_category("distortion"))
 
-        for utype, pattern in cls.USER_TYPE_PATTERNS.items():
-            if pattern.search(text):
+        for utype in cls.USER_TYPE_KEYWORDS:
+            if utype.value in type_hits:
                 identified_type = utype
                 break
 
@@ -34,14 +37,6 @@ class UserAnalyzerModule:
              else:
                  identified_type = UserType.VENTING
 
-        for distortion_name, keywords in cls.COGNITIVE_DISTORTION_KEYWORDS.items():
-             if isinstance(keywords, list):
-                 if any(re.search(r'\b' + re.escape(k) + r'\b', text, re.IGNORECASE) for k in keywords):
-                       detected_distortions.append(distortion_name)
-             elif isinstance(keywords, str):
-                  if re.search(keywords, text, re.IGNORECASE):
-                      detected_distortions.append(distortion_name)
-
         return ModuleOutput(
             success=True,
             data={
@@ -50,4 +45,8 @@ class UserAnalyzerModule:
             },
             message=f"用户类型: {identified_type.value}, 认知扭曲: {', '.join(detected_distortions) if detected_distortions else '无'}",
             next_module="context_update"
-        )
\ No newline at end of file
+        )
+
+
+LexiconModule.register("user_type", {utype.value: keywords for utype, keywords in UserAnalyzerModule.USER_TYPE_KEYWORDS.items()})
+LexiconModule.register("distortion", UserAnalyzerModule.COGNITIVE_DISTORTION_KEYWORDS)
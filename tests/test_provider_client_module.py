@@ -0,0 +1,71 @@
+# D:\python_code\LocalAgent\tests\test_provider_client_module.py
+import asyncio
+import time
+import pytest
+from flask import Flask
+from modules.provider_client_module import ProviderClientModule
+from modules.async_provider_client_module import AsyncProviderClientModule
+
+PROVIDER = "Local"
+URL = "http://127.0.0.1:11434/api/chat"
+COOLDOWN = 0.05
+
+
+class _HangingClient:
+    # 请求发出后一直不返回，模拟半开状态下迟迟没有结果的探测请求
+    def __init__(self):
+        self.sending = asyncio.Event()
+
+    def build_request(self, method, url, headers=None, json=None):
+        return None
+
+    async def send(self, request, stream=False):
+        self.sending.set()
+        await asyncio.Event().wait()
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(AVAILABLE_PROVIDERS={PROVIDER: {"url": URL}},
+                      CIRCUIT_BREAKER_WINDOW=1, CIRCUIT_BREAKER_MIN_REQUESTS=1,
+                      CIRCUIT_BREAKER_FAILURE_RATE=0.5, CIRCUIT_BREAKER_COOLDOWN=COOLDOWN)
+    ProviderClientModule._breakers.clear()
+    with app.app_context():
+        yield app
+    ProviderClientModule._breakers.clear()
+
+
+def _half_open_breaker():
+    # 打开熔断并等待冷却结束，下一次 allow_request 即为半开探测
+    breaker = ProviderClientModule.get_breaker(PROVIDER, URL)
+    breaker.record(False)
+    assert breaker.state == "open"
+    time.sleep(COOLDOWN * 2)
+    return breaker
+
+
+def test_release_probe_allows_next_probe(app):
+    breaker = _half_open_breaker()
+    assert breaker.allow_request()
+    assert not breaker.allow_request() # 探测在途时拒绝其他请求
+    breaker.release_probe()
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+
+
+def test_cancelled_half_open_probe_releases_breaker(app, monkeypatch):
+    breaker = _half_open_breaker()
+    client = _HangingClient()
+    monkeypatch.setattr(AsyncProviderClientModule, "get_client", classmethod(lambda cls, provider: client))
+
+    async def _cancel_probe():
+        task = asyncio.create_task(AsyncProviderClientModule.post(PROVIDER, URL, {}, {}))
+        await asyncio.wait_for(client.sending.wait(), timeout=1)
+        task.cancel() # 对冲败方被取消
+        with pytest.raises(asyncio.CancelledError): await task
+
+    asyncio.run(_cancel_probe())
+    assert breaker.state == "half_open" # 取消不计为失败
+    time.sleep(COOLDOWN * 2)
+    assert breaker.allow_request()
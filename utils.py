@@ -1,63 +1,26 @@
 # D:\python_code\LocalAgent\utils.py
-import os
-import json
-from flask import session, current_app
+from flask import session
+from modules.prompt_registry_module import PromptRegistryModule
+from modules.transcript_log_module import TranscriptLogModule
+from modules.transcript_writer_module import TranscriptWriterModule
 
 FALLBACK_PROMPT = "你是一位友好的AI助手。"
 
 def load_prompt() -> str:
-    prompt_file_path = current_app.config.get('PROMPT_FILE_PATH')
-    if not prompt_file_path:
-        print("[警告] 配置中未找到 PROMPT_FILE_PATH，使用备用提示词。")
-        return FALLBACK_PROMPT
-
-    prompt_dir = os.path.dirname(prompt_file_path)
-    if prompt_dir and not os.path.exists(prompt_dir):
-        try:
-            os.makedirs(prompt_dir)
-            print(f"创建目录: {prompt_dir}")
-        except OSError as e:
-            print(f"创建提示词目录失败: {e}")
-
-    if not os.path.exists(prompt_file_path):
-        print(f"提示词文件不存在: {prompt_file_path}，将使用备用提示词。")
-        return FALLBACK_PROMPT
-    try:
-        with open(prompt_file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            if not content:
-                 print(f"提示词文件 {prompt_file_path} 为空，使用备用提示词。")
-                 return FALLBACK_PROMPT
-            return content
-    except OSError as e:
-        print(f"读取提示词文件失败: {e}")
-        return FALLBACK_PROMPT
-    except Exception as e:
-        print(f"加载提示词时发生未知错误: {e}")
-        return FALLBACK_PROMPT
+    # 系统提示词由注册表缓存，文件修改后自动重新加载
+    return PromptRegistryModule.get_base(fallback=FALLBACK_PROMPT)
 
 
 def load_context_from_file(temp_context: list):
+    # 按会话索引直接读取本会话的记录，不再逐行扫描整个日志
     sid = session.get("session_id")
-    context_file = current_app.config.get('CONTEXT_FILE')
-    if not sid or not context_file or not os.path.exists(context_file):
-        if not context_file: print("[警告] 配置中未找到 CONTEXT_FILE。")
-        temp_context.clear()
-        return
+    temp_context.clear()
+    if not sid: return
     try:
-        with open(context_file, 'r', encoding='utf-8') as f:
-            current_session_lines = []
-            for line in f:
-                if line.strip():
-                    try:
-                        data = json.loads(line)
-                        if data.get("session_id") == sid:
-                            current_session_lines.append(data)
-                    except json.JSONDecodeError:
-                         print(f"跳过无效的JSON行: {line.strip()}")
-            temp_context.clear()
-            temp_context.extend(current_session_lines)
-
+        # 先写出队列中的记录，保证读到本会话刚保存的消息
+        if not TranscriptWriterModule.flush():
+            print("[聊天记录] 等待写入队列超时，可能读不到最新的记录")
+        temp_context.extend(TranscriptLogModule.read_session(sid))
     except OSError as e:
         print(f"加载聊天记录文件失败: {e}")
     except Exception as e:
@@ -65,13 +28,9 @@ def load_context_from_file(temp_context: list):
 
 
 def save_context_to_file(item: dict):
-    context_file = current_app.config.get('CONTEXT_FILE')
-    if not context_file:
-        print("[错误] 配置中未找到 CONTEXT_FILE，无法保存聊天记录。")
-        return
+    # 放入后写队列立即返回，由后台线程批量写入
     try:
-        with open(context_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        TranscriptWriterModule.submit(item)
     except OSError as e:
         print(f"保存聊天记录到文件失败: {e}")
     except Exception as e:
@@ -79,27 +38,10 @@ def save_context_to_file(item: dict):
 
 
 def remove_session_lines_from_file(sid: str):
-    context_file = current_app.config.get('CONTEXT_FILE')
-    if not context_file or not os.path.exists(context_file):
-        if not context_file: print("[警告] 配置中未找到 CONTEXT_FILE，无法清理聊天记录。")
-        return
+    # 删除标记与记录走同一写入队列，排在本会话已提交的记录之后；空间由后台压缩回收
     try:
-        kept_lines = []
-        with open(context_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if not line.strip():
-                     continue
-                try:
-                    obj = json.loads(line)
-                    if obj.get("session_id") != sid:
-                        kept_lines.append(line.strip())
-                except json.JSONDecodeError:
-                    print(f"清理时跳过无效JSON行: {line.strip()}")
-
-        with open(context_file, 'w', encoding='utf-8') as f:
-            if kept_lines:
-                 f.write("\n".join(kept_lines) + "\n")
+        TranscriptWriterModule.delete(sid)
     except OSError as e:
         print(f"清理聊天记录文件失败: {e}")
     except Exception as e:
-        print(f"清理聊天记录时发生未知错误: {e}")
\ No newline at end of file
+        print(f"清理聊天记录时发生未知错误: {e}")